@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import PackedSequence
 
 
 
@@ -29,8 +30,11 @@ class IS_RNN_encoder(nn.Module):
         self.normH = nn.LayerNorm(d_model_in)
 
     def forward(self, inp, hidden=None):
-        """ Apply the RNN encoder to the input tensor."""
+        """ Apply the RNN encoder to the input tensor, or to a PackedSequence of variable-length
+        inputs (e.g. from PackedBatchIS.pack_sequence), in which case a PackedSequence is returned."""
         out, hidden = self.rnn(inp,hidden)
+        if isinstance(inp, PackedSequence):
+            return out._replace(data=self.normH(self.dropout(out.data)+inp.data)), hidden # (N, Di), (num_layers, B, Di)
         return self.normH(self.dropout(out)+inp), hidden # (B, L, Di), (num_layers, B, Di)
 
 
@@ -1 +1,2 @@
+from .cache import CatalogCache, catalog_cache
 from .is_cases import IScases
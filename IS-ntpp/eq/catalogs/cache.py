@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, Optional, Tuple, Union
+
+import torch
+
+from eq.data import SequenceIS
+from eq.data.dot_dict import DotDict
+
+
+def file_signature(root_dir: Union[str, Path]) -> Tuple:
+    """ Signature (name, size, modification time) of every file a catalog is loaded from."""
+    root_dir = Path(root_dir)
+    paths = [root_dir / 'metadata.pt', root_dir / 'full_sequence.pt']
+    columnar_dir = root_dir / 'full_sequence'
+    if columnar_dir.is_dir():
+        paths += sorted(columnar_dir.iterdir())
+    signature = []
+    for path in paths:
+        if path.exists():
+            stat = path.stat()
+            signature.append((str(path.relative_to(root_dir)), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def sequence_nbytes(sequence: SequenceIS) -> int:
+    """ Number of bytes held by the tensors of a sequence."""
+    return sum(
+        value.element_size() * value.nelement()
+        for value in sequence.values()
+        if isinstance(value, torch.Tensor)
+    )
+
+
+def sequence_versions(sequence: SequenceIS) -> dict:
+    """ Version counter (bumped by every in-place operation) of each tensor of a sequence.
+
+    The views returned by sequence_view share the counters of the original tensors, so
+    writing into a view changes the versions of the cached sequence.
+    """
+    return {
+        key: value._version
+        for key, value in sequence.items()
+        if isinstance(value, torch.Tensor)
+    }
+
+
+def sequence_view(sequence: SequenceIS) -> SequenceIS:
+    """ New SequenceIS whose tensors are shared, mutable aliases of those of sequence.
+
+    No data is copied. Setting attributes of the view (e.g. t_nll_start) or moving it to
+    another device leaves the original untouched. An in-place write into one of its tensors
+    is not: it is visible through the original and every other view of it. The cache detects
+    such writes (see sequence_versions) and reloads the catalog on the next IScases lookup,
+    but views created before then keep the modified data. Clone a tensor before modifying it.
+    """
+    view = SequenceIS.__new__(SequenceIS)
+    DotDict.__init__(view, {
+        key: value.detach() if isinstance(value, torch.Tensor) else value
+        for key, value in sequence.items()
+    })
+    return view
+
+
+class CatalogCache:
+    """ Process-wide least recently used (LRU) cache of loaded catalogs.
+
+    IScases keys the entries by the case name and the loaded fields, and stores the signature
+    of the files on disk and the versions of the tensors with each entry, so that a regenerated
+    or converted catalog, or a sequence modified in place through one of its views, replaces
+    its stale entry instead of being served from it.
+
+    Args:
+        max_mb: Memory bound (in MB) on the tensors of all the cached sequences. The least
+            recently used catalogs are evicted once it is exceeded (0 disables the cache).
+    """
+
+    def __init__(self, max_mb: float = 1024.0):
+        self.max_mb = max_mb
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        with self._lock:
+            self._entries.pop(key, None)
+            if nbytes > self.max_mb * 2**20:
+                return
+            self._entries[key] = (value, nbytes)
+            while self.nbytes > self.max_mb * 2**20:
+                self._entries.popitem(last=False)
+
+    def resize(self, max_mb: float):
+        """ Change the memory bound, evicting the least recently used catalogs if needed."""
+        with self._lock:
+            self.max_mb = max_mb
+            while self._entries and self.nbytes > self.max_mb * 2**20:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({len(self)} catalogs, "
+            f"{self.nbytes / 2**20:.1f}/{self.max_mb} MB, hits={self.hits}, misses={self.misses})"
+        )
+
+
+# Shared by all the IScases instances of the process.
+catalog_cache = CatalogCache()
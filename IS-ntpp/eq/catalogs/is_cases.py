@@ -1,3 +1,4 @@
+import hashlib
 import io
 from pathlib import Path
 from typing import Tuple, Union
@@ -6,28 +7,74 @@ import numpy as np
 import pandas as pd
 import requests
 import torch
+from joblib import Parallel, delayed
 
 from eq.data import Catalog, InMemoryDataset, SequenceIS, default_catalogs_dir
+from eq.data.columnar import is_columnar, load_columnar, read_columnar_header, save_columnar
+
+from .cache import catalog_cache, file_signature, sequence_nbytes, sequence_versions, sequence_view
 
 
 class IScases(Catalog):
+    """ Induced seismicity case, loaded from the columnar store (full_sequence/) if it exists,
+    or from the pickled full_sequence.pt otherwise (see convert_catalog).
+
+    A missing sequence is built from the csv files on first access (see generate_catalog).
+    Loaded catalogs are kept in the process-wide catalog_cache, so repeated IScases(CaseID)
+    calls return views of the same sequence. Their tensors are shared, mutable aliases (see
+    sequence_view), so an in-place write is visible through the other views; a cached sequence
+    that was modified in place is reloaded from disk on the next lookup.
+
+    Args:
+        CaseID: Name of the case (folder in the data directory).
+        fields: Supplementary marks to load from the columnar store (all if None).
+        use_cache: Whether to get (and keep) the catalog in the catalog_cache.
+    """
 
     def __init__(
         self,
         CaseID,
+        fields=None,
+        use_cache=True,
         #mag_completeness: float = -1.5,
         #train_start_ts: pd.Timestamp = pd.Timestamp("2009-01-01"),
         #val_start_ts: pd.Timestamp = pd.Timestamp("2014-01-01"),
         #test_start_ts: pd.Timestamp = pd.Timestamp("2017-01-01"),
     ):
         root_dir = default_catalogs_dir / CaseID
-        metadata=torch.load(root_dir / 'metadata.pt', weights_only=False)
-        super().__init__(root_dir=root_dir, metadata=metadata)
+        fields = tuple(sorted(fields)) if fields is not None else None
 
-        self.full_sequence = InMemoryDataset.load_from_disk(
-            self.root_dir / 'full_sequence.pt'
-        )[0]
-        
+        # Build the sequence on first access, if only the csv files are there.
+        has_sequence = (root_dir / 'full_sequence.pt').exists() or is_columnar(root_dir / 'full_sequence')
+        if not has_sequence and (root_dir / (CaseID + '_Cat.csv')).exists():
+            IScases.generate_catalog(CaseID)
+        cache_key = (CaseID, fields)
+        signature = file_signature(root_dir)
+        cached = catalog_cache.get(cache_key) if use_cache else None
+
+        if cached is None or cached[0] != signature or cached[3] != sequence_versions(cached[2]):
+            metadata=torch.load(root_dir / 'metadata.pt', weights_only=False)
+            super().__init__(root_dir=root_dir, metadata=metadata)
+
+            if is_columnar(self.root_dir / 'full_sequence'):
+                sequence = load_columnar(self.root_dir / 'full_sequence', fields=fields)
+            else:
+                sequence = InMemoryDataset.load_from_disk(
+                    self.root_dir / 'full_sequence.pt'
+                )[0]
+            if use_cache:
+                catalog_cache.put(
+                    cache_key,
+                    (signature, self.metadata, sequence, sequence_versions(sequence)),
+                    sequence_nbytes(sequence),
+                )
+        else:
+            # (the files are unchanged since they were checked and loaded)
+            _, metadata, sequence, _ = cached
+            self.root_dir = root_dir.expanduser().resolve()
+            self.metadata = dict(metadata)
+
+        self.full_sequence = sequence_view(sequence)
         self.dataset=InMemoryDataset([self.full_sequence])
 
         #self.metadata["train_start_ts"] = pd.Timestamp(train_start_ts)
@@ -47,95 +94,87 @@ class IScases(Catalog):
 
     @property
     def required_files(self):
+        if is_columnar(self.root_dir / 'full_sequence'):
+            return ['full_sequence', 'metadata.pt']
         return ['full_sequence.pt', 'metadata.pt']
 
+    def convert_catalog(CaseID, half_precision_marks=False):
+
+        # Convert the pickled sequence of a case into the columnar store.
+        root_dir=default_catalogs_dir / CaseID
+        sequence = InMemoryDataset.load_from_disk(root_dir / 'full_sequence.pt')[0]
+        save_columnar(sequence, root_dir / 'full_sequence', half_precision_marks=half_precision_marks)
+
+    def convert_catalogs(half_precision_marks=False):
+
+        # Convert every case in the data directory that has a pickled sequence.
+        for root_dir in sorted(default_catalogs_dir.iterdir()):
+            if (root_dir / 'full_sequence.pt').exists():
+                IScases.convert_catalog(root_dir.name, half_precision_marks=half_precision_marks)
+
     def generate_catalog(CaseID):
 
-        # Load in the csv files as dataframes.
+        # Load in the csv files as dataframes (only the needed columns, as float64).
         root_dir=default_catalogs_dir / CaseID
         f_hed=CaseID+'_Hed.csv'
         f_cat=CaseID+'_Cat.csv'
         f_inj=CaseID+'_Inj.csv'
-        df_hed=pd.read_csv(root_dir / f_hed)
-        df_cat=pd.read_csv(root_dir / f_cat)
-        df_inj=pd.read_csv(root_dir / f_inj)
-
-        # Save full event sequence as InMemoryDataset
-        #start_ts = self.metadata["start_ts"]
-        #end_ts = self.metadata["end_ts"]
+        df_hed=pd.read_csv(root_dir / f_hed, usecols=list(HED_COLUMNS), dtype=np.float64, engine='c')
+        df_cat=pd.read_csv(root_dir / f_cat, usecols=list(CAT_COLUMNS), dtype=np.float64, engine='c')
+        if (root_dir / f_inj).exists():
+            df_inj=pd.read_csv(root_dir / f_inj, usecols=list(INJ_COLUMNS), dtype=np.float64, engine='c')
+        else:
+            df_inj=None
 
         # Get the header information.
-        t_start = df_hed['Start Time (min)'].to_numpy()[0] # Minutes. # Minutes.
+        t_start = df_hed['Start Time (min)'].to_numpy()[0] # Minutes.
         t_end = df_hed['End Time (min)'].to_numpy()[0] # Minutes.
         mag_completeness = df_hed['Magnitude of Completeness (M)'].to_numpy()[0] # M.
 
-        # Get the catalogue.
+        # Get the catalogue and its supplementary marks (see CAT_COLUMNS for the units).
         arrival_times = df_cat['Time (min)'].to_numpy() # Minutes
-        inter_times = df_cat['Inter-event Time (log10[min])'].to_numpy() # log10(Minutes)
-        mag = df_cat['Magnitude (M)'].to_numpy()
+        marks = {field: df_cat[column].to_numpy() for column, field in CAT_COLUMNS.items()}
+        del marks['arrival_times'], marks['inter_times']
 
         # Get the inter-event times.
-        inter_times=np.power(10,inter_times)
-        inter_times=np.append(inter_times, t_end-arrival_times[-1])
-
-        # Get the supplementary marks.
-        vm = df_cat['Instantaneous Injection Rate (log10[m3/min])'].to_numpy() # log10(m3/min)
-        dVc = df_cat['Sequential Volume Change (log10[m3])'].to_numpy() # log10(m3)
-        sv = df_cat['Sign of Sequential Volume Change (-)'].to_numpy() # -
-        dTS = df_cat['Time Since Injection Sign Change (log10[min])'].to_numpy() # -
-        Vc = df_cat['Cumulative Volume (log10[m3])'].to_numpy() # log10(m3)
-        Mo = df_cat['Cumulative Moment (M)'].to_numpy() # M
-        Pm = df_cat['Pressure (log10[MPa])'].to_numpy() # log10(MPa)
-        pm = df_cat['Instantaneous Pressure Rate (log10[MPa/min])'].to_numpy() # log10(MPa/min)
-        dP = df_cat['Sequential Pressure Change (log10[MPa])'].to_numpy() # log10(MPa)
-        sp = df_cat['Sign of Pressure Change (-)'].to_numpy() # -
-        Eh = df_cat['Cumulative Hydraulic Moment (M)'].to_numpy() # M
-        dEh = df_cat['Sequential Hydraulic Moment Change (M)'].to_numpy() # M
-        aRs = df_cat['Smoothed Causal Seismicity Rate log10[1/min]'].to_numpy() # log10(1/min)
+        inter_times = np.power(10, df_cat['Inter-event Time (log10[min])'].to_numpy())
+        inter_times = np.append(inter_times, t_end-arrival_times[-1])
 
         # Get the injection information.
-        inj_time=df_inj['Time (min)'].to_numpy() # Minutes
-        inj_rate=df_inj['Injection Rate (log10[m3/min])'].to_numpy() # log10(m3/min)
-        inj_dvol=df_inj['Sequential Volume Change (log10[m3])'].to_numpy() # log10(m3)
-        inj_sign=df_inj['Sign of Injection Rate (-)'].to_numpy() # -
-        inj_tsgn=df_inj['Time Since Injection Sign Change (log10[min])'].to_numpy() # -
-
-        # Check for errors.
-        #assert subset_df.time.min() > start_ts
-        #assert subset_df.time.max() < end_ts
+        if df_inj is not None:
+            injection = {field: df_inj[column].to_numpy() for column, field in INJ_COLUMNS.items()}
+        else:
+            # No injection file, so use the injection state sampled at each event instead
+            # (the segment ending at each event has the injection rate/volume change of that event).
+            injection = {
+                'inj_time': np.append(t_start, arrival_times),
+                'inj_rate': np.append(-np.inf, marks['vm']),
+                'inj_dvol': np.append(-np.inf, marks['dVc']),
+                'inj_sign': np.append(0.0, marks['sv']),
+                'inj_tsgn': np.append(-np.inf, marks['dTS']),
+            }
 
         # Make the sequence object.
         seq_cat = SequenceIS(
             inter_times=torch.as_tensor(inter_times, dtype=torch.float32),
             t_start=t_start,
             t_end=t_end,
-            mag=torch.as_tensor(mag, dtype=torch.float32),
-            vm=torch.as_tensor(vm, dtype=torch.float32),
-            dVc=torch.as_tensor(dVc, dtype=torch.float32),
-            sv=torch.as_tensor(sv, dtype=torch.float32),
-            dTS=torch.as_tensor(dTS, dtype=torch.float32),
-            Vc=torch.as_tensor(Vc, dtype=torch.float32),
-            Mo=torch.as_tensor(Mo, dtype=torch.float32),
-            Pm=torch.as_tensor(Pm, dtype=torch.float32),
-            pm=torch.as_tensor(pm, dtype=torch.float32),
-            dP=torch.as_tensor(dP, dtype=torch.float32),
-            sp=torch.as_tensor(sp, dtype=torch.float32),
-            Eh=torch.as_tensor(Eh, dtype=torch.float32),
-            dEh=torch.as_tensor(dEh, dtype=torch.float32),
-            aRs=torch.as_tensor(aRs, dtype=torch.float32),
-            inj_time=torch.as_tensor(inj_time, dtype=torch.float32),
-            inj_rate=torch.as_tensor(inj_rate, dtype=torch.float32),
-            inj_dvol=torch.as_tensor(inj_dvol, dtype=torch.float32),
-            inj_sign=torch.as_tensor(inj_sign, dtype=torch.float32),
-            inj_tsgn=torch.as_tensor(inj_tsgn, dtype=torch.float32),
+            **{key: torch.tensor(value, dtype=torch.float32) for key, value in marks.items()},
+            **{key: torch.tensor(value, dtype=torch.float32) for key, value in injection.items()},
             mag_completeness=mag_completeness,
         )
 
         # Save the sequences as InMemoryDatasets.
         dataset = InMemoryDataset(sequences=[seq_cat])
         dataset.save_to_disk(root_dir / 'full_sequence.pt')
+
+        # Keep an existing columnar store (which IScases reads first) in sync.
+        if is_columnar(root_dir / 'full_sequence'):
+            columns = read_columnar_header(root_dir / 'full_sequence')['columns'].values()
+            half_precision_marks = any(column['stored_dtype'] == 'float16' for column in columns)
+            save_columnar(seq_cat, root_dir / 'full_sequence', half_precision_marks=half_precision_marks)
         
-        # Make and then save the metadata.
+        # Make and then save the metadata (with the hashes of the csv inputs).
         metadata = {
             'name': CaseID,
             'freq': '1D',
@@ -143,5 +182,87 @@ class IScases(Catalog):
             'mag_completeness"': mag_completeness,
             'start_ts': t_start,
             'end_ts': t_end,
+            'input_hashes': IScases.input_hashes(CaseID),
+            'injection_source': 'csv' if df_inj is not None else 'catalog',
         }
         torch.save(metadata, root_dir / 'metadata.pt')
+
+    def input_hashes(CaseID):
+
+        # SHA-256 of the existing _Cat/_Hed/_Inj.csv inputs of a case.
+        root_dir=default_catalogs_dir / CaseID
+        hashes = {}
+        for suffix in ['_Cat.csv', '_Hed.csv', '_Inj.csv']:
+            path = root_dir / (CaseID + suffix)
+            if path.exists():
+                with open(path, 'rb') as f:
+                    hashes[path.name] = hashlib.file_digest(f, 'sha256').hexdigest()
+        return hashes
+
+    def is_current(CaseID):
+
+        # Whether the saved sequence of a case was built from its current csv inputs.
+        root_dir=default_catalogs_dir / CaseID
+        if not (root_dir / 'metadata.pt').exists() or not (root_dir / 'full_sequence.pt').exists():
+            return False
+        metadata = torch.load(root_dir / 'metadata.pt', weights_only=False)
+        return metadata.get('input_hashes') == IScases.input_hashes(CaseID)
+
+    def build_catalogs(case_list=None, n_jobs=-1, force=False):
+
+        # (Re)build the sequences of many cases in a process pool, skipping the up-to-date ones.
+        if case_list is None:
+            case_list = [
+                root_dir.name for root_dir in sorted(default_catalogs_dir.iterdir())
+                if (root_dir / (root_dir.name + '_Cat.csv')).exists()
+            ]
+        return dict(zip(case_list, Parallel(n_jobs=n_jobs)(
+            delayed(_build_catalog)(CaseID, force) for CaseID in case_list
+        )))
+
+
+# Columns of the csv files that are read, and the sequence fields they become.
+HED_COLUMNS = ['Magnitude of Completeness (M)', 'Start Time (min)', 'End Time (min)']
+CAT_COLUMNS = {
+    'Time (min)': 'arrival_times', # Minutes
+    'Inter-event Time (log10[min])': 'inter_times', # log10(Minutes)
+    'Magnitude (M)': 'mag', # M
+    'Instantaneous Injection Rate (log10[m3/min])': 'vm', # log10(m3/min)
+    'Sequential Volume Change (log10[m3])': 'dVc', # log10(m3)
+    'Sign of Sequential Volume Change (-)': 'sv', # -
+    'Time Since Injection Sign Change (log10[min])': 'dTS', # log10(Minutes)
+    'Cumulative Volume (log10[m3])': 'Vc', # log10(m3)
+    'Cumulative Moment (M)': 'Mo', # M
+    'Pressure (log10[MPa])': 'Pm', # log10(MPa)
+    'Instantaneous Pressure Rate (log10[MPa/min])': 'pm', # log10(MPa/min)
+    'Sequential Pressure Change (log10[MPa])': 'dP', # log10(MPa)
+    'Sign of Pressure Change (-)': 'sp', # -
+    'Cumulative Hydraulic Moment (M)': 'Eh', # M
+    'Sequential Hydraulic Moment Change (M)': 'dEh', # M
+    'Smoothed Causal Seismicity Rate log10[1/min]': 'aRs', # log10(1/min)
+}
+INJ_COLUMNS = {
+    'Time (min)': 'inj_time', # Minutes
+    'Injection Rate (log10[m3/min])': 'inj_rate', # log10(m3/min)
+    'Sequential Volume Change (log10[m3])': 'inj_dvol', # log10(m3)
+    'Sign of Injection Rate (-)': 'inj_sign', # -
+    'Time Since Injection Sign Change (log10[min])': 'inj_tsgn', # log10(Minutes)
+}
+
+
+def _build_catalog(CaseID, force=False):
+    """ Build the sequence of one case, unless it is up to date (worker of build_catalogs)."""
+    if not force and IScases.is_current(CaseID):
+        return 'skipped'
+
+    # Never replace a sequence built from an injection file that is no longer there.
+    root_dir = default_catalogs_dir / CaseID
+    if not (root_dir / (CaseID + '_Inj.csv')).exists() and (root_dir / 'full_sequence.pt').exists():
+        metadata = torch.load(root_dir / 'metadata.pt', weights_only=False)
+        if metadata.get('injection_source') != 'catalog':
+            return 'kept (missing _Inj.csv)'
+    try:
+        IScases.generate_catalog(CaseID)
+    except (OSError, ValueError, KeyError) as error:
+        return f'failed ({error})'
+    return 'built'
@@ -1,10 +1,10 @@
 import pandas as pd
 
-from eq.data import Sequence
+from eq.data import SequenceIS
 
 
 def train_val_test_split_sequence(
-    seq: Sequence,
+    seq: SequenceIS,
     start_ts: pd.Timestamp,
     train_start_ts: pd.Timestamp,
     val_start_ts: pd.Timestamp,
@@ -17,6 +17,9 @@ def train_val_test_split_sequence(
     1) train: Includes events in [start_ts, val_start_ts], t_nll_start = start_ts
     2) val: Includes events in [start_ts, test_start_ts], t_nll_start = val_start_ts
     3) test: Includes events in [start_ts, end_ts], t_nll_start = test_start_ts
+
+    The subsequences share the marks of seq (see SequenceIS.get_subsequence), and are not
+    validated again.
     """
     # Start of the train / val / test intervals as timestamps
     start_ts = pd.Timestamp(start_ts)
@@ -34,10 +37,10 @@ def train_val_test_split_sequence(
     freq = pd.Timedelta(freq)
 
     # Start of the train / val / test intervals as floats
-    seq_train = seq.get_subsequence(seq.t_start, t_val_start)
+    seq_train = seq.get_subsequence(seq.t_start, t_val_start, validate=False)
     seq_train.t_nll_start = t_train_start
-    seq_val = seq.get_subsequence(seq.t_start, t_test_start)
+    seq_val = seq.get_subsequence(seq.t_start, t_test_start, validate=False)
     seq_val.t_nll_start = t_val_start
-    seq_test = seq.get_subsequence(seq.t_start, seq.t_end)
+    seq_test = seq.get_subsequence(seq.t_start, seq.t_end, validate=False)
     seq_test.t_nll_start = t_test_start
     return seq_train, seq_val, seq_test
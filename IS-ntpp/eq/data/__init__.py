@@ -1,4 +1,7 @@
 from .batch import BatchIS
 from .catalog import Catalog, default_catalogs_dir
 from .in_memory_dataset import InMemoryDataset
+from .packed_batch import PackedBatchIS
 from .sequenceIS import SequenceIS
+from .static_batch_loader import StaticBatchLoader
+from .columnar import load_columnar, save_columnar
@@ -1,4 +1,5 @@
-from typing import List, Optional
+import functools
+from typing import Any, Callable, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -183,67 +184,38 @@ class BatchIS(DotDict):
         'mag_completeness',
     }
 
+    # Injection schedule fields, and the value they are padded with.
+    inj_padding_values = {
+        'inj_time': -10,
+        'inj_rate': -10,
+        'inj_dvol': -10,
+        'inj_sign': 0,
+        'inj_tsgn': -10,
+    }
+
     @staticmethod
-    def from_list(sequences: List[SequenceIS]) -> 'BatchIS':
-        """Construct a batch from a list of variable-length sequences."""
+    def from_list(
+        sequences: List[SequenceIS],
+        fields: Optional[List[str]] = None,
+        buffers: Optional['CollateBuffers'] = None,
+    ) -> 'BatchIS':
+        """ Construct a batch from a list of variable-length sequences.
+
+        Args:
+            sequences: List of SequenceIS to collate.
+            fields: Names of the supplementary marks (e.g. mag, vm, sv) to put in the batch.
+                If None, all the marks of the sequences are kept.
+            buffers: If not None, the padded fields are written into these preallocated (and
+                reused) buffers, so the batch is only valid until the next call with them.
+
+        Returns:
+            batch: BatchIS with the padded sequences.
+        """
         batch_size = len(sequences)
         dtype = sequences[0].arrival_times.dtype
         device = sequences[0].arrival_times.device
-        padded_seq_len = max(len(seq.inter_times) for seq in sequences)
-        padded_inj_len = max(len(seq.inj_time) for seq in sequences)
-
-        inter_times = pad_sequence(
-            [seq.inter_times for seq in sequences],
-            padding_value=0,
-            max_len=padded_seq_len,
-        )
-        
-        # Get the injection sequence.
-        inj_time = pad_sequence(
-            [seq.inj_time for seq in sequences],
-            padding_value=-10,
-            max_len=padded_inj_len,
-        )
-        inj_rate = pad_sequence(
-            [seq.inj_rate for seq in sequences],
-            padding_value=-10,
-            max_len=padded_inj_len,
-        )
-        inj_dvol = pad_sequence(
-            [seq.inj_dvol for seq in sequences],
-            padding_value=-10,
-            max_len=padded_inj_len,
-        )
-        inj_sign = pad_sequence(
-            [seq.inj_sign for seq in sequences],
-            padding_value=0,
-            max_len=padded_inj_len,
-        )
-        inj_tsgn = pad_sequence(
-            [seq.inj_tsgn for seq in sequences],
-            padding_value=-10,
-            max_len=padded_inj_len,
-        )
-
-        t_start = torch.zeros(batch_size, dtype=dtype, device=device)
-        t_end = torch.zeros(batch_size, dtype=dtype, device=device)
-        t_nll_start = torch.zeros(batch_size, dtype=dtype, device=device)
-        end_idx = torch.zeros(batch_size, dtype=torch.long, device=device)
-        end_idx2 = torch.zeros(batch_size, dtype=torch.long, device=device)
-        mag_completeness = torch.zeros(batch_size, dtype=dtype, device=device)
-
-        for i, seq in enumerate(sequences):
-            t_start[i] = seq.t_start
-            t_end[i] = seq.t_end
-            t_nll_start[i] = seq.t_nll_start
-            end_idx[i] = len(seq.arrival_times)
-            end_idx2[i] = len(seq.inj_time)
-            mag_completeness[i] = seq.mag_completeness
-
-        # Get index of the first event that happened after t_nll_start
-        arrival_times = torch.cumsum(inter_times, dim=-1) + t_start[:, None]
-        start_idx = get_start_idx(arrival_times, t_nll_start)
-        mask = get_mask(inter_times, start_idx, end_idx)
+        if buffers is None:
+            buffers = CollateBuffers(reuse=False)
 
         # Handle other attributes (e.g., marks, locations)
         other_attr_names = [
@@ -251,13 +223,50 @@ class BatchIS(DotDict):
             for k in sequences[0].keys()
             if k not in sequences[0].default_sequence_attrs
         ]
+        if fields is not None:
+            unknown = [name for name in fields if name not in other_attr_names]
+            if unknown:
+                raise ValueError(f"fields must be a subset of {other_attr_names} (got {unknown})")
+            other_attr_names = [name for name in other_attr_names if name in fields]
+
+        # Sequence lengths and scalar attributes, one tensor each.
+        end_idx = torch.tensor([len(seq.arrival_times) for seq in sequences], device=device)
+        end_idx2 = torch.tensor([len(seq.inj_time) for seq in sequences], device=device)
+        t_start, t_end, t_nll_start, mag_completeness = torch.tensor(
+            [[seq.t_start, seq.t_end, seq.t_nll_start, float(seq.mag_completeness)] for seq in sequences],
+            dtype=dtype,
+            device=device,
+        ).T.unbind(0)
+        padded_seq_len = int(end_idx.max()) + 1
+        padded_inj_len = int(end_idx2.max())
+
+        # One padding operation per group of fields with the same length (and dtype).
+        inter_times = pad_field_group(
+            sequences, ['inter_times'], [0], padded_seq_len, buffers, end_idx + 1
+        )[0]
+        inj_names = list(BatchIS.inj_padding_values)
+        inj_attr = dict(zip(inj_names, pad_field_group(
+            sequences,
+            inj_names,
+            list(BatchIS.inj_padding_values.values()),
+            padded_inj_len,
+            buffers,
+            end_idx2,
+        ).unbind(0)))
         other_attr = {}
-        for name in other_attr_names:
-            values = [seq[name] for seq in sequences]
+        for group in group_fields(sequences[0], other_attr_names):
             # Tensors are padded into shape (batch_size, padded_seq_len, ...)
-            other_attr[name] = pad_sequence(
-                values, padding_value=0, max_len=padded_seq_len
+            padded = pad_field_group(
+                sequences, group, [0] * len(group), padded_seq_len, buffers, end_idx
             )
+            other_attr.update(zip(group, padded.unbind(0)))
+
+        # Get index of the first event that happened after t_nll_start
+        arrival_times = buffers.get('arrival_times', inter_times.shape, dtype, device)
+        torch.cumsum(inter_times, dim=-1, out=arrival_times)
+        arrival_times += t_start[:, None]
+        start_idx = get_start_idx(arrival_times, t_nll_start)
+        mask = get_mask(inter_times, start_idx, end_idx)
 
         return BatchIS(
             inter_times=inter_times,
@@ -269,15 +278,24 @@ class BatchIS(DotDict):
             start_idx=start_idx,
             end_idx=end_idx,
             end_idx2=end_idx2,
-            inj_time=inj_time,
-            inj_rate=inj_rate,
-            inj_dvol=inj_dvol,
-            inj_sign=inj_sign,
-            inj_tsgn=inj_tsgn,
             mag_completeness=mag_completeness,
+            **inj_attr,
             **other_attr,
         )
 
+    @staticmethod
+    def collate_fn(fields: Optional[List[str]] = None, reuse_buffers: bool = False):
+        """ Collate function (for a DataLoader) that builds batches with from_list.
+
+        Args:
+            fields: Names of the supplementary marks to put in each batch (all if None).
+            reuse_buffers: Whether to write every batch into the same preallocated buffers.
+                Only safe if each batch is consumed before the next one is collated
+                (e.g. num_workers=0 and no batches are kept around).
+        """
+        buffers = CollateBuffers() if reuse_buffers else None
+        return functools.partial(BatchIS.from_list, fields=fields, buffers=buffers)
+
     @property
     def batch_size(self):
         return self.arrival_times.shape[0]
@@ -326,6 +344,37 @@ class BatchIS(DotDict):
         """ Convert a batch into a list of variable-length sequences."""
         return [self.get_sequence(idx) for idx in range(self.batch_size)]
 
+    def cached(self, name: str, compute: Callable[[], Any], dependencies: Tuple = ()) -> Any:
+        """ Derived feature of the batch, computed once and reused on later calls.
+
+        The stored value is returned as long as the batch attributes and the dependencies are
+        unchanged (tensors are compared by identity and in-place version counter, other values
+        by equality), so that e.g. a new model buffer value or moving the batch to another device
+        invalidates it. Features that require gradients are never stored.
+
+        Args:
+            name: Identifier of the transform (e.g. 'OracleLite.get_marks').
+            compute: Function (without arguments) computing the feature from the batch.
+            dependencies: Tensors and values besides the batch that the feature depends on
+                (e.g. the model buffers and the list of marks).
+
+        Returns:
+            feature: Output of compute.
+        """
+        cache = self._data.setdefault('_feature_cache', {})
+        state = get_state(self.values()) + get_state(dependencies)
+        if name in cache and same_state(cache[name][0], state):
+            return cache[name][1]
+        feature = compute()
+        values = feature.values() if isinstance(feature, DotDict) else [feature]
+        if not any(isinstance(x, torch.Tensor) and x.requires_grad for x in values):
+            cache[name] = (state, feature)
+        return feature
+
+    def clear_cache(self):
+        """ Remove all the derived features stored by cached."""
+        self._data.pop('_feature_cache', None)
+
 
 
 
@@ -370,3 +419,90 @@ def pad_sequence(
 
     return out_tensor
 
+
+
+class CollateBuffers:
+    """ Preallocated tensors that BatchIS.from_list writes the padded fields into.
+
+    Each named buffer grows when a larger batch comes in and is reused otherwise, so that
+    collating batches of similar sizes allocates no new memory.
+
+    Args:
+        reuse: If False, fresh tensors are returned on every call (no buffering).
+    """
+
+    def __init__(self, reuse: bool = True):
+        self.reuse = reuse
+        self._buffers = {}
+
+    def get(self, name: str, shape, dtype: torch.dtype, device) -> torch.Tensor:
+        """ Contiguous (uninitialized) tensor with the given shape, backed by the named buffer."""
+        if not self.reuse:
+            return torch.empty(shape, dtype=dtype, device=device)
+        numel = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.numel() < numel or buffer.dtype != dtype or buffer.device != torch.device(device):
+            buffer = torch.empty(numel, dtype=dtype, device=device)
+            self._buffers[name] = buffer
+        return buffer[:numel].view(shape)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.element_size() * buffer.numel() for buffer in self._buffers.values())
+
+
+def get_state(values) -> Tuple:
+    """ Snapshot of values for BatchIS.cached: tensors with their in-place version counter."""
+    return tuple(
+        (value, value._version) if isinstance(value, torch.Tensor) else (value, None)
+        for value in values
+    )
+
+
+def same_state(state: Tuple, other: Tuple) -> bool:
+    """ Check if two snapshots (see get_state) hold the same, unmodified values."""
+    if len(state) != len(other):
+        return False
+    for (value, version), (other_value, other_version) in zip(state, other):
+        if version is not None or other_version is not None:
+            if value is not other_value or version != other_version:
+                return False
+        elif value != other_value:
+            return False
+    return True
+
+
+def group_fields(sequence: SequenceIS, names: List[str]) -> List[List[str]]:
+    """ Group the per-event fields of a sequence that share the same dtype and trailing shape."""
+    groups = {}
+    for name in names:
+        value = sequence[name]
+        groups.setdefault((value.dtype, tuple(value.shape[1:])), []).append(name)
+    return list(groups.values())
+
+
+def pad_field_group(
+    sequences: List[SequenceIS],
+    names: List[str],
+    padding_values: List[float],
+    max_len: int,
+    buffers: CollateBuffers,
+    lengths: torch.Tensor,
+) -> torch.Tensor:
+    """ Pad several fields (of equal length, dtype and trailing shape) of all sequences at once.
+
+    Returns:
+        padded: Padded fields, shape [len(names), batch_size, max_len, ...]
+    """
+    first = sequences[0][names[0]]
+    out_shape = (len(names), len(sequences), max_len) + tuple(first.shape[1:])
+    out = buffers.get('/'.join(names), out_shape, first.dtype, first.device)
+    padding = torch.tensor(padding_values, dtype=first.dtype, device=first.device)
+    padding = padding.view((-1,) + (1,) * (out.dim() - 2))
+
+    # The group of each sequence is stacked directly into its slice, and only the tail is padded.
+    for i, (seq, length) in enumerate(zip(sequences, lengths.tolist())):
+        torch.stack([seq[name] for name in names], out=out[:, i, :length])
+        if length < max_len:
+            out[:, i, length:] = padding
+    return out
@@ -0,0 +1,133 @@
+import json
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import torch
+
+from .dot_dict import DotDict
+from .sequenceIS import SequenceIS
+
+# Version tag written to (and checked in) the header of every columnar store.
+COLUMNAR_FORMAT = "columnar-sequence-v1"
+COLUMNAR_HEADER = "header.json"
+
+# Columns that are always stored (and loaded) at their original precision.
+PRIMARY_FIELDS = {
+    'inter_times',
+    'arrival_times',
+    'mag',
+    'inj_time',
+    'inj_rate',
+    'inj_dvol',
+    'inj_sign',
+    'inj_tsgn',
+}
+
+
+def is_columnar(path: Union[str, Path]) -> bool:
+    """ Check if path is a columnar sequence store (see save_columnar)."""
+    return (Path(path) / COLUMNAR_HEADER).exists()
+
+
+def read_columnar_header(path: Union[str, Path]) -> dict:
+    """ Read the JSON header of a columnar sequence store."""
+    with open(Path(path) / COLUMNAR_HEADER) as f:
+        header = json.load(f)
+    if header.get('format') != COLUMNAR_FORMAT:
+        raise ValueError(
+            f"format must be one of ['{COLUMNAR_FORMAT}'] (got {header.get('format')})"
+        )
+    return header
+
+
+def save_columnar(sequence: SequenceIS, path: Union[str, Path], half_precision_marks: bool = False):
+    """ Save a sequence as a columnar store, with one contiguous .npy array per field.
+
+    The store is a directory with a small JSON header (scalars and the dtype / shape of every
+    column) and one file per column, so that load_columnar can memory-map each column and
+    only read the ones that are requested.
+
+    Args:
+        sequence: SequenceIS to save.
+        path: Directory of the store (created if needed).
+        half_precision_marks: Whether to store the supplementary marks (everything except the
+            times, magnitudes and injection schedule) as float16.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    header = {'format': COLUMNAR_FORMAT, 'num_events': len(sequence), 'scalars': {}, 'columns': {}}
+    for key, value in sequence.items():
+        if not isinstance(value, torch.Tensor):
+            header['scalars'][key] = {'value': value, 'dtype': None}
+        elif value.dim() == 0:
+            header['scalars'][key] = {'value': value.item(), 'dtype': str(value.dtype)}
+        else:
+            array = value.detach().cpu().numpy()
+            if half_precision_marks and key not in PRIMARY_FIELDS and array.dtype.kind == 'f':
+                array = array.astype(np.float16)
+            np.save(path / f"{key}.npy", np.ascontiguousarray(array))
+            header['columns'][key] = {
+                'dtype': str(value.dtype),
+                'stored_dtype': str(array.dtype),
+                'shape': list(array.shape),
+            }
+    with open(path / COLUMNAR_HEADER, 'w') as f:
+        json.dump(header, f, indent=2)
+
+
+def load_columnar(
+    path: Union[str, Path],
+    fields: Optional[Iterable[str]] = None,
+    mmap: bool = True,
+    validate: bool = False,
+) -> SequenceIS:
+    """ Load a sequence from a columnar store (see save_columnar).
+
+    Columns are memory-mapped (copy-on-write), so only the pages that are actually used are
+    read from disk and catalogs larger than RAM can be opened. Columns stored as float16 are
+    converted back to their original dtype, which reads them in full.
+
+    Args:
+        path: Directory of the store.
+        fields: Names of the supplementary marks to load (e.g. ['mag', 'vm', 'sv']). The times
+            and the injection schedule are always loaded. If None, all the columns are loaded.
+        mmap: Whether to memory-map the columns instead of reading them into memory.
+        validate: Whether to run the checks of the SequenceIS constructor on the loaded sequence.
+
+    Returns:
+        sequence: SequenceIS backed by the (memory-mapped) columns.
+    """
+    path = Path(path)
+    header = read_columnar_header(path)
+    columns = header['columns']
+    if fields is not None:
+        fields = set(fields)
+        unknown = fields - set(columns)
+        if unknown:
+            raise ValueError(f"fields must be a subset of {sorted(columns)} (got {sorted(unknown)})")
+        columns = {
+            key: value for key, value in columns.items()
+            if key in fields or key in SequenceIS.default_sequence_attrs
+        }
+
+    data = {}
+    for key, scalar in header['scalars'].items():
+        if scalar['dtype'] is None:
+            data[key] = scalar['value']
+        else:
+            data[key] = torch.tensor(scalar['value'], dtype=getattr(torch, scalar['dtype'][6:]))
+    for key, column in columns.items():
+        array = np.load(path / f"{key}.npy", mmap_mode='c' if mmap else None)
+        tensor = torch.from_numpy(array)
+        dtype = getattr(torch, column['dtype'][6:])
+        data[key] = tensor if tensor.dtype == dtype else tensor.to(dtype)
+    if 'arrival_times' not in data:
+        data['arrival_times'] = data['inter_times'].cumsum(dim=-1)[:-1] + data['t_start']
+
+    # The arrival times and t_end are stored, so the sequence is built without the constructor.
+    sequence = SequenceIS.__new__(SequenceIS)
+    DotDict.__init__(sequence, data)
+    if validate:
+        sequence._validate_args()
+    return sequence
@@ -8,6 +8,7 @@ import torch.utils.data
 #from .sequence import Sequence
 from .batch import BatchIS
 from .sequenceIS import SequenceIS
+from .static_batch_loader import StaticBatchLoader
 
 
 class InMemoryDataset(torch.utils.data.Dataset):
@@ -61,11 +62,24 @@ class InMemoryDataset(torch.utils.data.Dataset):
     #        **kwargs,
     #    )
     
-    def get_dataloaderIS(self, batch_size=1, shuffle=False, **kwargs):
+    def get_dataloaderIS(self, batch_size=1, shuffle=False, fields=None, reuse_buffers=False, **kwargs):
+        """ DataLoader of BatchIS, optionally with only the given supplementary marks
+        (e.g. model.required_marks) and reusable collation buffers (see BatchIS.collate_fn)."""
         return torch.utils.data.DataLoader(
             self,
             batch_size=batch_size,
             shuffle=shuffle,
-            collate_fn=BatchIS.from_list,
+            collate_fn=BatchIS.collate_fn(fields=fields, reuse_buffers=reuse_buffers),
+            **kwargs,
+        )
+
+    def get_static_loaderIS(self, batch_size=1, shuffle=False, fields=None, **kwargs):
+        """ StaticBatchLoader that collates the dataset once and reuses the batches on every
+        epoch (e.g. for trainer.fit on a fixed training set)."""
+        return StaticBatchLoader(
+            self,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            fields=fields,
             **kwargs,
         )
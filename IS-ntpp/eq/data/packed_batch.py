@@ -0,0 +1,249 @@
+from typing import List, Optional
+
+import torch
+from torch.nn.utils.rnn import PackedSequence, pack_sequence, pad_packed_sequence
+
+from .batch import BatchIS, get_mask
+from .dot_dict import DotDict
+from .sequenceIS import SequenceIS
+
+
+class PackedBatchIS(DotDict):
+    """ Batch of variable-length sequences packed into flat arrays, without padding.
+
+    The sequences are concatenated, and offsets mark where each of them starts. Every per-event
+    field holds end_idx + 1 entries per sequence (the events and the final survival time t_end),
+    like the rows of the padded BatchIS without their padding, so that the marks are 0 at the
+    survival time. The injection schedules are packed separately.
+
+    Should be created with PackedBatchIS.from_list or PackedBatchIS.from_padded.
+
+    Attributes:
+        inter_times: Inter-event times, shape [num_entries]
+        arrival_times: Arrival times (the last entry of each sequence is t_end), shape [num_entries]
+        offsets: Index of the first entry of each sequence (and of the end), shape [batch_size + 1]
+        segment_ids: Index of the sequence of each entry, shape [num_entries]
+        mask: Binary mask indicating for which events the NLL must be computed, shape [num_entries]
+        start_idx: Index (within its sequence) of the first event for which NLL must be computed,
+            shape [batch_size]
+        end_idx: Index (within its sequence) of the last inter-event time, shape [batch_size]
+        end_idx2: Length of the injection schedule of each sequence, shape [batch_size]
+        inj_offsets: Index of the first injection entry of each sequence, shape [batch_size + 1]
+        inj_segment_ids: Index of the sequence of each injection entry, shape [num_inj_entries]
+        t_start, t_end, t_nll_start, mag_completeness: Scalars of each sequence, shape [batch_size]
+        **kwargs: Injection schedule fields, shape [num_inj_entries], and additional attributes
+            associated with each event (e.g., magnitude), shape [num_entries, ...].
+    """
+
+    default_packed_attrs = BatchIS.default_batch_attrs | {
+        'offsets',
+        'segment_ids',
+        'inj_offsets',
+        'inj_segment_ids',
+    }
+
+    @staticmethod
+    def from_list(sequences: List[SequenceIS], fields: Optional[List[str]] = None) -> 'PackedBatchIS':
+        """ Construct a packed batch from a list of variable-length sequences.
+
+        Args:
+            sequences: List of SequenceIS to pack.
+            fields: Names of the supplementary marks to put in the batch (all if None).
+
+        Returns:
+            batch: PackedBatchIS with the concatenated sequences.
+        """
+        dtype = sequences[0].arrival_times.dtype
+        device = sequences[0].arrival_times.device
+        other_attr_names = [
+            k
+            for k in sequences[0].keys()
+            if k not in sequences[0].default_sequence_attrs
+        ]
+        if fields is not None:
+            unknown = [name for name in fields if name not in other_attr_names]
+            if unknown:
+                raise ValueError(f"fields must be a subset of {other_attr_names} (got {unknown})")
+            other_attr_names = [name for name in other_attr_names if name in fields]
+
+        end_idx = torch.tensor([len(seq.arrival_times) for seq in sequences], device=device)
+        end_idx2 = torch.tensor([len(seq.inj_time) for seq in sequences], device=device)
+        t_start, t_end, t_nll_start, mag_completeness = torch.tensor(
+            [[seq.t_start, seq.t_end, seq.t_nll_start, float(seq.mag_completeness)] for seq in sequences],
+            dtype=dtype,
+            device=device,
+        ).T.unbind(0)
+        offsets = get_offsets(end_idx + 1)
+        inj_offsets = get_offsets(end_idx2)
+
+        inter_times = torch.cat([seq.inter_times for seq in sequences])
+        arrival_times = torch.cat([
+            torch.cumsum(seq.inter_times, dim=-1) + t_start[i] for i, seq in enumerate(sequences)
+        ])
+        inj_attr = {
+            name: torch.cat([seq[name] for seq in sequences]) for name in BatchIS.inj_padding_values
+        }
+
+        # The marks are 0 at the survival time of each sequence, as in the padded batch.
+        is_event = torch.ones(len(inter_times), dtype=torch.bool, device=device)
+        is_event[offsets[1:] - 1] = False
+        other_attr = {}
+        for name in other_attr_names:
+            values = torch.cat([seq[name] for seq in sequences])
+            other_attr[name] = values.new_zeros((len(inter_times),) + values.shape[1:])
+            other_attr[name][is_event] = values
+
+        return PackedBatchIS.from_flat(
+            inter_times=inter_times,
+            arrival_times=arrival_times,
+            offsets=offsets,
+            inj_offsets=inj_offsets,
+            t_start=t_start,
+            t_end=t_end,
+            t_nll_start=t_nll_start,
+            mag_completeness=mag_completeness,
+            **inj_attr,
+            **other_attr,
+        )
+
+    @staticmethod
+    def from_padded(batch: BatchIS) -> 'PackedBatchIS':
+        """ Pack a padded BatchIS (dropping the padding of the events and injection schedules)."""
+        event_valid = get_valid(batch.end_idx + 1, batch.seq_len)
+        inj_valid = get_valid(batch.end_idx2, batch.inj_len)
+        fields = {}
+        for key, value in batch.items():
+            if key in BatchIS.inj_padding_values:
+                fields[key] = value[inj_valid]
+            elif key not in BatchIS.default_batch_attrs or key in ('inter_times', 'arrival_times'):
+                fields[key] = value[event_valid]
+        return PackedBatchIS.from_flat(
+            offsets=get_offsets(batch.end_idx + 1),
+            inj_offsets=get_offsets(batch.end_idx2),
+            t_start=batch.t_start,
+            t_end=batch.t_end,
+            t_nll_start=batch.t_nll_start,
+            mag_completeness=batch.mag_completeness,
+            **fields,
+        )
+
+    @staticmethod
+    def from_flat(offsets: torch.Tensor, inj_offsets: torch.Tensor, **fields) -> 'PackedBatchIS':
+        """ Build a packed batch from its flat fields and offsets, adding the segment ids, mask
+        and the start / end indices of every sequence."""
+        lengths = offsets.diff()
+        inj_lengths = inj_offsets.diff()
+        segment_ids = get_segment_ids(lengths)
+        position = torch.arange(len(segment_ids), device=offsets.device) - offsets[segment_ids]
+
+        # Index of the first event that happened after t_nll_start (0 if there is none), i.e.
+        # the number of earlier (sorted) arrival times.
+        after_start = fields['arrival_times'] > fields['t_nll_start'][segment_ids]
+        num_before = lengths - torch.zeros_like(lengths).index_add_(0, segment_ids, after_start.long())
+        start_idx = torch.where(num_before < lengths, num_before, torch.zeros_like(num_before))
+        end_idx = lengths - 1
+        mask = (start_idx[segment_ids] <= position) & (position < end_idx[segment_ids])
+
+        return PackedBatchIS(
+            offsets=offsets,
+            segment_ids=segment_ids,
+            inj_offsets=inj_offsets,
+            inj_segment_ids=get_segment_ids(inj_lengths),
+            mask=mask.float(),
+            start_idx=start_idx,
+            end_idx=end_idx,
+            end_idx2=inj_lengths,
+            **fields,
+        )
+
+    def to_padded(self) -> BatchIS:
+        """ Convert into the equivalent padded BatchIS (as returned by BatchIS.from_list)."""
+        batch_size = self.batch_size
+        seq_len = int(self.lengths.max())
+        inj_len = int(self.end_idx2.max())
+        event_valid = get_valid(self.lengths, seq_len)
+        inj_valid = get_valid(self.end_idx2, inj_len)
+
+        fields = {}
+        for key, value in self.items():
+            if key in BatchIS.inj_padding_values:
+                padding = BatchIS.inj_padding_values[key]
+                fields[key] = value.new_full((batch_size, inj_len) + value.shape[1:], padding)
+                fields[key][inj_valid] = value
+            elif key not in self.default_packed_attrs or key == 'inter_times':
+                fields[key] = value.new_zeros((batch_size, seq_len) + value.shape[1:])
+                fields[key][event_valid] = value
+
+        # Arrival times are padded with t_end (the cumulative sum of the padded inter-event times).
+        last = self.arrival_times[self.offsets[1:] - 1]
+        arrival_times = last[:, None].repeat(1, seq_len)
+        arrival_times[event_valid] = self.arrival_times
+
+        return BatchIS(
+            arrival_times=arrival_times,
+            t_start=self.t_start,
+            t_end=self.t_end,
+            t_nll_start=self.t_nll_start,
+            mask=get_mask(fields['inter_times'], self.start_idx, self.end_idx),
+            start_idx=self.start_idx,
+            end_idx=self.end_idx,
+            end_idx2=self.end_idx2,
+            mag_completeness=self.mag_completeness,
+            **fields,
+        )
+
+    def pack_sequence(self, values: torch.Tensor) -> PackedSequence:
+        """ Convert flat per-entry values (shape [num_entries, ...]) into an RNN PackedSequence."""
+        return pack_sequence(list(values.split(self.lengths.tolist())), enforce_sorted=False)
+
+    def unpack_sequence(self, packed: PackedSequence) -> torch.Tensor:
+        """ Convert an RNN PackedSequence back into flat per-entry values (see pack_sequence)."""
+        padded, _ = pad_packed_sequence(packed, batch_first=True)
+        return padded[get_valid(self.lengths, padded.shape[1])]
+
+    @property
+    def lengths(self) -> torch.Tensor:
+        return self.offsets.diff()
+
+    @property
+    def batch_size(self):
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return self.batch_size
+
+    def get_sequence(self, idx: int) -> SequenceIS:
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        inj_start, inj_end = int(self.inj_offsets[idx]), int(self.inj_offsets[idx + 1])
+        other_attr = {}
+        for k in self.keys():
+            if k in BatchIS.inj_padding_values:
+                other_attr[k] = self[k][inj_start:inj_end].clone()
+            elif k not in self.default_packed_attrs:
+                other_attr[k] = self[k][start : end - 1].clone()
+        return SequenceIS(
+            inter_times=self.inter_times[start:end].clone(),
+            t_start=float(self.t_start[idx]),
+            t_nll_start=float(self.t_nll_start[idx]),
+            mag_completeness=float(self.mag_completeness[idx]),
+            **other_attr,
+        )
+
+    def to_list(self) -> List[SequenceIS]:
+        """ Convert a packed batch into a list of variable-length sequences."""
+        return [self.get_sequence(idx) for idx in range(self.batch_size)]
+
+
+def get_offsets(lengths: torch.Tensor) -> torch.Tensor:
+    """ Start index of each segment in the concatenated array (and the total length)."""
+    return torch.cat([lengths.new_zeros(1), lengths.cumsum(0)])
+
+
+def get_segment_ids(lengths: torch.Tensor) -> torch.Tensor:
+    """ Index of the segment of every entry in the concatenated array."""
+    return torch.repeat_interleave(torch.arange(len(lengths), device=lengths.device), lengths)
+
+
+def get_valid(lengths: torch.Tensor, max_len: int) -> torch.Tensor:
+    """ Binary mask of the non-padded entries of a padded array, shape [batch_size, max_len]."""
+    return torch.arange(max_len, device=lengths.device)[None, :] < lengths[:, None]
@@ -50,6 +50,15 @@ class SequenceIS(DotDict):
         'mag_completeness',
     }
 
+    # Injection schedule attributes, which have their own (time sorted) samples.
+    inj_attrs = {
+        'inj_time',
+        'inj_rate',
+        'inj_dvol',
+        'inj_sign',
+        'inj_tsgn',
+    }
+
     def __init__(
         self,
         inter_times: Union[torch.Tensor, np.ndarray, list],
@@ -99,8 +108,20 @@ class SequenceIS(DotDict):
     ) -> np.ndarray:
         return np.diff(arrival_times, prepend=[t_start], append=[t_end])
 
-    def get_subsequence(self, start: float, end: float) -> "SequenceIS":
-        """ Select a subset of events in the interval [start, end]."""
+    def get_subsequence(self, start: float, end: float, validate: bool = True) -> "SequenceIS":
+        """ Select a subset of events in the interval [start, end].
+
+        The first and last events (and injection samples) in the interval are found by binary
+        search on the sorted arrival_times and inj_time. The marks and injection schedule of the
+        subsequence are views of the ones of this sequence (only inter_times is new), so they
+        must not be modified in place.
+
+        Args:
+            start: Start of the interval (t_start of the subsequence).
+            end: End of the interval (t_end of the subsequence).
+            validate: Whether to check the subsequence with _validate_args. This can be skipped
+                for slices of a sequence that was already validated.
+        """
         
         # Erroneous input handling.
         if start < self.t_start or end > self.t_end:
@@ -109,17 +130,14 @@ class SequenceIS(DotDict):
             )
         
         # Deal with inter-event times and arrival times.
-        mask_EQ = (self.arrival_times >= start) & (self.arrival_times <= end)
-        new_arrival_times = self.arrival_times[mask_EQ]
+        i_start, i_end = search_interval(self.arrival_times, start, end)
+        new_arrival_times = self.arrival_times[i_start:i_end]
         if len(new_arrival_times) > 0:
-            last_inter_time = torch.tensor(
-                [end - new_arrival_times[-1]],
-                device=self.inter_times.device,
-                dtype=self.inter_times.dtype,
-            )
-            new_inter_times = torch.cat([self.inter_times[:-1][mask_EQ], last_inter_time])
-            first_inter_time = new_arrival_times[0] - start
-            new_inter_times[0] = first_inter_time
+            new_inter_times = torch.cat([
+                (new_arrival_times[0] - start).reshape(1),
+                self.inter_times[i_start + 1 : i_end],
+                (end - new_arrival_times[-1]).reshape(1),
+            ])
         else:
             new_inter_times = torch.tensor(
                 [end - start],
@@ -127,35 +145,29 @@ class SequenceIS(DotDict):
                 dtype=self.inter_times.dtype,
             )
 
-        # Deal with magnitude/supplementary sequence marks.
+        # Deal with magnitude/supplementary sequence marks, and the injection seqeunce attributes.
+        j_start, j_end = search_interval(self.inj_time, start, end)
         other_attr = {}
         for key, value in self.items():
-            if key not in self.default_sequence_attrs:
-                other_attr[key] = value[mask_EQ].contiguous()
-
-        # Deal with the injection seqeunce attributes.
-        mask_INJ = (self.inj_time >= start) & (self.inj_time <= end)
-        new_inj_time = self.inj_time[mask_INJ]
-        new_inj_rate = self.inj_rate[mask_INJ]
-        new_inj_dvol = self.inj_dvol[mask_INJ]
-        new_inj_sign = self.inj_sign[mask_INJ]
-        new_inj_tsgn = self.inj_tsgn[mask_INJ]
-
-        # Return the sub-sequence.
-        return SequenceIS(
-            arrival_times=new_arrival_times,
+            if key in self.inj_attrs:
+                other_attr[key] = value[j_start:j_end]
+            elif key not in self.default_sequence_attrs:
+                other_attr[key] = value[i_start:i_end]
+
+        # Return the sub-sequence (the arrival times are sliced, so the constructor is bypassed).
+        subsequence = SequenceIS.__new__(SequenceIS)
+        DotDict.__init__(subsequence, dict(
             inter_times=new_inter_times,
-            t_start=start,
-            t_end=end,
-            t_nll_start=max(self.t_nll_start, start),
-            inj_time=new_inj_time,
-            inj_rate=new_inj_rate,
-            inj_dvol=new_inj_dvol,
-            inj_sign=new_inj_sign,
-            inj_tsgn=new_inj_tsgn,
+            arrival_times=new_arrival_times,
+            t_start=float(start),
+            t_end=float(end),
+            t_nll_start=max(self.t_nll_start, float(start)),
             mag_completeness=self.mag_completeness,
             **other_attr,
-        )
+        ))
+        if validate:
+            subsequence._validate_args()
+        return subsequence
 
     def state_dict(self) -> dict:
         # These attributes are computed from inter_times and t_start, no need to save them to disk
@@ -188,3 +200,10 @@ class SequenceIS(DotDict):
                     f"Attribute {key} must have shape [{len(self)}, ...] (got {list(value.shape)})"
                 )
 
+
+def search_interval(times: torch.Tensor, start: float, end: float):
+    """ Index range [i_start, i_end) of the entries of the sorted times that lie in [start, end]."""
+    bounds = torch.tensor([start, end], dtype=times.dtype, device=times.device)
+    i_start = int(torch.searchsorted(times, bounds[:1], right=False))
+    i_end = int(torch.searchsorted(times, bounds[1:], right=True))
+    return i_start, max(i_start, i_end)
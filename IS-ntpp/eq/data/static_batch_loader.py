@@ -0,0 +1,103 @@
+from typing import Iterator, List, Optional
+
+import torch
+import torch.utils.data
+
+from .batch import BatchIS
+
+
+class StaticBatchLoader:
+    """ Loader that collates a fixed dataset into BatchIS objects once, and then hands back
+    the same cached batches on every epoch.
+
+    It can be passed to trainer.fit / trainer.test in place of a DataLoader, which otherwise
+    re-collates the (unchanging) training catalogs from scratch on every epoch.
+
+    Args:
+        dataset: Dataset of SequenceIS (e.g. InMemoryDataset or a ConcatDataset of them).
+        batch_size: Number of sequences per batch.
+        shuffle: Whether to reshuffle the order of the batches on every epoch. The sequences
+            within each batch are fixed when the batches are collated.
+        fields: Names of the supplementary marks to put in the batches (see BatchIS.from_list).
+        assert_immutable: Whether to check, at the start of every epoch, that no cached batch
+            was modified in place (e.g. by a model) and raise an error otherwise.
+        seed: Seed of the generator used to reshuffle the batches.
+    """
+
+    def __init__(
+        self,
+        dataset: torch.utils.data.Dataset,
+        batch_size: int = 1,
+        shuffle: bool = False,
+        fields: Optional[List[str]] = None,
+        assert_immutable: bool = False,
+        seed: Optional[int] = None,
+    ):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be a positive integer (got {batch_size})")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.fields = fields
+        self.assert_immutable = assert_immutable
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+
+        sequences = [dataset[i] for i in range(len(dataset))]
+        self.batches = [
+            BatchIS.from_list(sequences[i : i + batch_size], fields=fields)
+            for i in range(0, len(sequences), batch_size)
+        ]
+        self._versions = [self._get_versions(batch) for batch in self.batches]
+
+    @staticmethod
+    def _get_versions(batch: BatchIS) -> dict:
+        """ Identity and version counter (bumped by every in-place operation) of each tensor."""
+        return {
+            key: (id(value), value._version)
+            for key, value in batch.items()
+            if isinstance(value, torch.Tensor)
+        }
+
+    def check_immutable(self):
+        """ Raise an error if a cached batch was modified since it was collated.
+
+        Replacing a tensor by a new one (e.g. when the batch is moved to another device) is not
+        a modification, but writing into a tensor or adding / removing attributes is.
+        """
+        for i, batch in enumerate(self.batches):
+            versions = self._get_versions(batch)
+            if versions.keys() != self._versions[i].keys():
+                added = sorted(versions.keys() - self._versions[i].keys())
+                removed = sorted(self._versions[i].keys() - versions.keys())
+                raise RuntimeError(
+                    f"Cached batch {i} was modified (added attributes {added}, removed {removed})"
+                )
+            for key, (tensor_id, version) in versions.items():
+                old_id, old_version = self._versions[i][key]
+                if tensor_id == old_id and version != old_version:
+                    raise RuntimeError(f"Cached batch {i} was modified in place (attribute {key})")
+            self._versions[i] = versions
+
+    def to(self, device) -> "StaticBatchLoader":
+        """ Move all cached batches to the specified device."""
+        for batch in self.batches:
+            batch.to(device)
+        self._versions = [self._get_versions(batch) for batch in self.batches]
+        return self
+
+    def __iter__(self) -> Iterator[BatchIS]:
+        if self.assert_immutable:
+            self.check_immutable()
+        if self.shuffle:
+            order = torch.randperm(len(self.batches), generator=self.generator).tolist()
+        else:
+            order = range(len(self.batches))
+        for i in order:
+            yield self.batches[i]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)} batches, shuffle={self.shuffle})"
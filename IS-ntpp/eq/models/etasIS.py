@@ -1,15 +1,18 @@
 import math
+import time
 from typing import List, Optional, Union, Tuple
 
 import numpy as np
 import torch
 import torch.nn as nn
-from joblib import Parallel, delayed
+from torch.utils.checkpoint import checkpoint
+from joblib import Parallel, delayed, parallel_backend
 from scipy.stats import poisson
 from tqdm.auto import trange
 
 import eq
-from eq.data.batch import get_mask, pad_sequence
+from eq.data.batch import get_mask
+from eq.data.dot_dict import DotDict
 
 from .tpp_model import TPPModel
 
@@ -30,9 +33,9 @@ def branching_ratio(k=0.001, b=1, alpha=1, M_min=0, M_max=10):
     return branching_ratio
 
 
-def gen_mag(shape=1, b=1, M_min=0, M_max=10):
+def gen_mag(shape=1, b=1, M_min=0, M_max=10, rng=None):
     """ Draw sample from the Gutenberg-Richter distribution."""
-    u = np.random.random(shape)
+    u = (np.random if rng is None else rng).random(shape)
     mag = (
         -1
         / b
@@ -57,9 +60,29 @@ def omori_int(T1, T2, c, p):
         return ((T2 + c) ** (1 - p) - (T1 + c) ** (1 - p)) / (1 - p)
 
 
-def omori_inv(T1, T2, c, p, size=1, t_max=1e10):
+def nearest_neighbour_lags(t, mag_rel, b=1.0, num_neighbours=64):
+    """ Time from each event to its nearest-neighbour parent, shape (N - 1,)
+
+    The parent is the earlier event (among the num_neighbours previous ones) with the smallest
+    magnitude-rescaled time (t_i - t_j) * 10^(-b * m_j), as in Zaliapin et al. (2008) without
+    the spatial term.
+    """
+    num_events = len(t)
+    if num_events < 2:
+        return np.zeros(0)
+    offsets = np.arange(1, min(num_neighbours, num_events - 1) + 1)
+    parents = np.arange(1, num_events)[:, None] - offsets  # (N - 1, W)
+    valid = parents >= 0
+    parents = np.clip(parents, 0, None)
+    lags = t[1:, None] - t[parents]
+    with np.errstate(over='ignore'):
+        eta = np.where(valid & (lags > 0), lags * 10.0 ** (-b * mag_rel[parents]), np.inf)
+    return lags[np.arange(num_events - 1), eta.argmin(-1)]
+
+
+def omori_inv(T1, T2, c, p, size=1, t_max=1e10, rng=None):
     """ Draw sample from Omori's law using inverse transform."""
-    u = np.random.random(size=size)
+    u = (np.random if rng is None else rng).random(size=size)
     F = lambda tau: omori_int(0, tau, c, p) / omori_int(0, t_max, c, p)
     u_prime = u * (F(T2) - F(T1)) + F(T1)
     return (
@@ -67,6 +90,1035 @@ def omori_inv(T1, T2, c, p, size=1, t_max=1e10):
     ) ** (1 / (1 - p)) - c
 
 
+def get_injection_schedule(sequence):
+    """ Get the injection schedule fields of a sequence (or dict) as float64 numpy arrays."""
+    return {
+        key: torch.as_tensor(sequence[key]).cpu().numpy().astype(np.float64)
+        for key in ['inj_time', 'inj_rate', 'inj_sign', 'inj_tsgn']
+    }
+
+
+def hold_injection_schedule(injection, t_start, t_end):
+    """ Extend an injection schedule to cover [t_start, t_end] by holding its first and last states."""
+    inj_time = injection['inj_time']
+    if t_start < inj_time[0]:
+        injection = {key: np.concatenate([value[:1], value]) for key, value in injection.items()}
+        injection['inj_time'][0] = t_start
+    if t_end > inj_time[-1]:
+        last = {key: value[-1:].copy() for key, value in injection.items()}
+        with np.errstate(divide='ignore'):
+            # (the time since the last sign change grows, unless the sign never changed)
+            last['inj_tsgn'] = np.where(
+                np.isfinite(last['inj_tsgn']),
+                np.log10(np.power(10.0, last['inj_tsgn']) + t_end - last['inj_time']),
+                last['inj_tsgn'],
+            )
+        last['inj_time'][:] = t_end
+        injection = {key: np.concatenate([injection[key], last[key]]) for key in injection}
+    return injection
+
+
+def injection_segments(inj_time, inj_rate, inj_sign, inj_tsgn, t_start, t_end, SI, pt, ct, kt):
+    """ Piecewise-integrated immigrant rates of an injection schedule on [t_start, t_end].
+
+    The injection rate 10**inj_rate[i] and sign inj_sign[i] hold on (inj_time[i-1], inj_time[i]]
+    (so that the volume of each segment is 10**inj_dvol[i]), and 10**inj_tsgn[i] is the time since
+    the last sign change at inj_time[i]. Injecting segments (sign 1) have the constant
+    injection-driven rate 10**(rate + SI), and shut-in segments (sign 0) have the trailing rate
+    kt * (dt + ct)**-pt, where dt is the time since shut-in.
+
+    Returns:
+        segments: Dictionary of numpy arrays, with the start of each segment, the rate of the
+            injecting segments, the time since shut-in (+ ct) at the start of the shut-in segments,
+            whether each segment is trailing, the cumulative integrated rate, and pt and kt.
+    """
+    seg_start = np.clip(inj_time[:-1], t_start, t_end)
+    seg_end = np.clip(inj_time[1:], t_start, t_end)
+    rate, sign = inj_rate[1:], inj_sign[1:]
+    is_trailing = sign == 0
+    is_driven = sign == 1
+
+    # Time since shut-in at the start of each segment (zero if the sign never changed).
+    time_since_change = np.where(np.isfinite(inj_tsgn[1:]), np.power(10.0, inj_tsgn[1:]), 0.0)
+    offset = np.clip(time_since_change - (inj_time[1:] - seg_start), 0, None) + ct
+    driven_rate = np.where(is_driven, np.power(10.0, rate + SI), 0.0)
+    weight = driven_rate * (seg_end - seg_start)
+    trail_int = omori_int(0, seg_end - seg_start, offset, pt)
+    weight = np.where(is_trailing, kt * trail_int, weight)
+    return dict(
+        start=seg_start,
+        driven_rate=driven_rate,
+        offset=offset,
+        is_trailing=is_trailing,
+        cum_weight=np.cumsum(weight),
+        pt=pt,
+        kt=kt,
+    )
+
+
+def sample_segment_events(rng, num_sims, segments):
+    """ Draw the injection-driven and trailing immigrants of num_sims simulations.
+
+    The events are drawn without thinning, by inverting the piecewise-integrated rates of
+    injection_segments, and are returned as flat arrays of simulation ids and arrival times.
+    """
+    cum_weight = segments['cum_weight']
+    total = cum_weight[-1] if len(cum_weight) > 0 else 0.0
+    counts = rng.poisson(total, size=num_sims)
+    sim_id = np.repeat(np.arange(num_sims), counts)
+
+    # Find the segment of each event, and its integrated rate since the start of the segment.
+    u = rng.random(len(sim_id)) * total
+    seg = np.minimum(np.searchsorted(cum_weight, u, side='right'), len(cum_weight) - 1)
+    residual = u - np.concatenate([[0.0], cum_weight[:-1]])[seg]
+
+    # Constant injection-driven rate, or power-law trailing rate.
+    is_trailing = segments['is_trailing'][seg]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dt = residual / segments['driven_rate'][seg]
+        offset = segments['offset'][seg]
+        pt, kt = segments['pt'], segments['kt']
+        if abs(1 - pt) < 1e-6:
+            dt_trail = offset * np.exp(residual / kt) - offset
+        else:
+            dt_trail = (
+                offset ** (1 - pt) + (1 - pt) * residual / kt
+            ) ** (1 / (1 - pt)) - offset
+    times = segments['start'][seg] + np.where(is_trailing, dt_trail, dt)
+    return sim_id, times
+
+
+def injection_marks(times, inj_time, inj_rate, inj_sign, inj_tsgn):
+    """ Injection marks (vm, sv, dTS, Vc) of events at the given times, as in IScases catalogs."""
+    idx = np.clip(np.searchsorted(inj_time, times, side='left'), 1, len(inj_time) - 1)
+    time_since_change = np.power(10.0, inj_tsgn[idx]) - (inj_time[idx] - times)
+    volume = np.concatenate([[0.0], np.cumsum(np.power(10.0, inj_rate[1:]) * np.diff(inj_time))])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return dict(
+            vm=inj_rate[idx],
+            sv=inj_sign[idx],
+            dTS=np.where(np.isfinite(inj_tsgn[idx]), np.log10(np.clip(time_since_change, 0, None)), -np.inf),
+            Vc=np.log10(np.interp(times, inj_time, volume)),
+        )
+
+
+def schedule_fields(injection, t_start, t_end, mag_completeness):
+    """ Injection schedule fields (inj_*) of [t_start, t_end] and magnitude of completeness of
+    the sequences generated by the samplers. The schedule is empty if injection is None."""
+    if injection is None:
+        fields = {key: np.zeros(0) for key in eq.data.SequenceIS.inj_attrs}
+    else:
+        inj_time = injection['inj_time']
+        inj_mask = (inj_time >= t_start) & (inj_time <= t_end)
+        inj_dvol = np.concatenate([[-np.inf], injection['inj_rate'][1:] + np.log10(np.diff(inj_time))])
+        fields = {key: value[inj_mask] for key, value in injection.items()}
+        fields['inj_dvol'] = inj_dvol[inj_mask]
+    fields['mag_completeness'] = mag_completeness
+    return fields
+
+
+def past_schedule(past_seq, t_start, t_end):
+    """ Injection schedule of past_seq held over [t_start, t_end] (None if it has none)."""
+    if past_seq is None or 'inj_time' not in past_seq or len(past_seq.inj_time) == 0:
+        return None
+    injection = get_injection_schedule(past_seq)
+    before = injection['inj_time'] <= t_start
+    if before.any():
+        # State at t_start, held from the last earlier sample.
+        head = hold_injection_schedule(
+            {key: value[before] for key, value in injection.items()}, t_start, t_start
+        )
+        injection = {key: np.concatenate([head[key][-1:], value[~before]]) for key, value in injection.items()}
+    return hold_injection_schedule(injection, t_start, t_end)
+
+
+def sample_decaying_events(rng, num_sims, amplitudes, rates, t_start, t_end):
+    """ Draw the events of num_sims Poisson processes with the intensity
+    sum_k amplitudes[k] * exp(-rates[k] * (t - t_start)) on (t_start, t_end].
+
+    Used for the aftershocks of past events, whose Omori rates are summarized by the
+    sum-of-exponentials state at t_start (see ETASIntensityIndex), so that the past
+    parents do not need to be enumerated.
+    """
+    duration = t_end - t_start
+    mass = amplitudes / rates * -np.expm1(-rates * duration)  # (K,)
+    total = mass.sum()
+    if not total > 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    counts = rng.poisson(total, size=num_sims)
+    sim_id = np.repeat(np.arange(num_sims), counts)
+    component = rng.choice(len(rates), size=len(sim_id), p=mass / total)
+
+    # Inverse cdf of the exponential distribution truncated to [0, duration]
+    u = rng.random(len(sim_id))
+    rate = rates[component]
+    return sim_id, t_start - np.log1p(u * np.expm1(-rate * duration)) / rate
+
+
+def simulate_branching(
+    seed_seq, num_sims, t_start, t_end, mu, k, alpha, c, p, b, M_c,
+    past_times=None, past_mags=None, t_max=1e10, max_length=None, segments=None,
+    past_components=None,
+):
+    """ Simulate many ETAS catalogs at once with the branching (cluster) representation.
+
+    The events of all simulations are held in flat arrays with a simulation-id column, so that
+    each generation of every simulation is drawn with a few vectorized calls.
+
+    Args:
+        seed_seq: np.random.SeedSequence of this group of simulations.
+        num_sims: Number of catalogs to simulate.
+        t_start, t_end: Interval on which the catalogs are simulated.
+        mu, k, alpha, c, p, b, M_c: ETAS parameters, Richter b-value and magnitude of completeness.
+        past_times, past_mags: Events before t_start shared by all simulations (or None).
+        t_max: Maximum time since parent at which an aftershock can be produced.
+        max_length: If not None, simulations with more than this many events are discarded.
+        segments: If not None, injection-driven and trailing immigrants are drawn from these
+            segments (see injection_segments) in addition to the background events.
+        past_components: If not None, (amplitudes, rates) of the sum-of-exponentials rate of
+            the aftershocks of past events (see sample_decaying_events), an alternative to
+            past_times and past_mags.
+
+    Returns:
+        sim_id: Simulation index of each event in (t_start, t_end], sorted by simulation and time.
+        times: Arrival times of the events.
+        mags: Magnitudes of the events.
+        valid: Whether each simulation was kept (False if it exceeded max_length), shape (num_sims,)
+    """
+    rng = np.random.default_rng(seed_seq)
+    sims = np.arange(num_sims)
+    omori_int_max = omori_int(0, t_max, c, p)
+    k_prime = k * omori_int_max
+
+    # Background events of all the simulations.
+    num_back = rng.poisson(mu * (t_end - t_start), size=num_sims)
+    parent_sim = np.repeat(sims, num_back)
+    parent_times = rng.uniform(t_start, t_end, len(parent_sim))
+    if segments is not None:
+        immigrant_sim, immigrant_times = sample_segment_events(rng, num_sims, segments)
+        parent_sim = np.concatenate([parent_sim, immigrant_sim])
+        parent_times = np.concatenate([parent_times, immigrant_times])
+    if past_components is not None:
+        immigrant_sim, immigrant_times = sample_decaying_events(
+            rng, num_sims, *past_components, t_start, t_end
+        )
+        parent_sim = np.concatenate([parent_sim, immigrant_sim])
+        parent_times = np.concatenate([parent_times, immigrant_times])
+    parent_mags = gen_mag(len(parent_sim), b=b, M_min=M_c, rng=rng)
+    num_generated = np.bincount(parent_sim, minlength=num_sims)
+    all_sim, all_times, all_mags = [parent_sim], [parent_times], [parent_mags]
+
+    # The past catalog is a parent of every simulation, but is not part of the output.
+    if past_times is not None and len(past_times) > 0:
+        parent_sim = np.concatenate([np.repeat(sims, len(past_times)), parent_sim])
+        parent_times = np.concatenate([np.tile(past_times, num_sims), parent_times])
+        parent_mags = np.concatenate([np.tile(past_mags, num_sims), parent_mags])
+
+    valid = np.ones(num_sims, dtype=bool)
+    while len(parent_sim) > 0:
+        # Expected number of offspring of each parent within the forecast interval.
+        TAU1 = np.clip(t_start - parent_times, 0, None)
+        TAU2 = t_end - parent_times
+        prod = productivity(parent_mags, k_prime, alpha, M_c)
+        prod_in_interval = prod * omori_int(TAU1, TAU2, c, p) / omori_int_max
+
+        N_aftershock = rng.poisson(prod_in_interval)
+        parent_idx = np.repeat(np.arange(len(parent_sim)), N_aftershock)
+        parent_sim = parent_sim[parent_idx]
+        parent_times = parent_times[parent_idx] + omori_inv(
+            TAU1[parent_idx], TAU2[parent_idx], c, p, size=len(parent_idx), t_max=t_max, rng=rng
+        )
+        parent_mags = gen_mag(len(parent_idx), b=b, M_min=M_c, rng=rng)
+
+        # Stop the simulations whose event sequences are too long
+        num_generated += np.bincount(parent_sim, minlength=num_sims)
+        if max_length is not None:
+            valid &= num_generated <= max_length
+            keep = valid[parent_sim]
+            parent_sim, parent_times, parent_mags = parent_sim[keep], parent_times[keep], parent_mags[keep]
+        all_sim.append(parent_sim)
+        all_times.append(parent_times)
+        all_mags.append(parent_mags)
+
+    sim_id, times, mags = [np.concatenate(x) for x in [all_sim, all_times, all_mags]]
+    keep = valid[sim_id] & (times > t_start) & (times <= t_end)
+    sim_id, times, mags = sim_id[keep], times[keep], mags[keep]
+    order = np.lexsort((times, sim_id))
+    return sim_id[order], times[order], mags[order], valid
+
+
+def omori_rate_dense(t_select, t, productivity, c, p):
+    """ Aftershock intensity at times t_select, summed over all previous events at times t.
+
+    Builds the full (B, S, L) pairwise tensors, so memory grows as O(S * L).
+    """
+    # delta_t[0, i, j] = t_i - t_j
+    # prev_mask[0, i, j] = float(t_i > t_j)
+    delta_t = t_select.unsqueeze(-1) - t.unsqueeze(-2)  # (B, S, L)
+    prev_mask = (delta_t > 0).float()  # (B, S, L)
+
+    # omori[0, i, j] = contribution of event t_j on intensity at time t_i
+    omori = (delta_t * prev_mask + c).pow(-p)  # (B, S, L)
+    return (omori * productivity.unsqueeze(-2) * prev_mask).sum(-1)  # (B, S)
+
+
+def causal_row_blocks(t_select, t, max_memory_mb, tensors_per_pair=8):
+    """ Split the target events into row blocks of the causal (lower triangular) pairwise matrix.
+
+    Args:
+        t_select: Sorted arrival times at which the intensity is evaluated, shape (B, S)
+        t: Sorted arrival times of the (potential) parent events, shape (B, L)
+        max_memory_mb: Memory budget (in MB) for the pairwise tensors of a single block.
+        tensors_per_pair: Number of (B, rows, cols) intermediate tensors held per block.
+
+    Returns:
+        blocks: List of (row_start, row_end, num_cols), where only the first num_cols
+            parents can precede any of the targets in t_select[:, row_start:row_end].
+    """
+    batch_size, num_rows = t_select.shape
+    bytes_per_row = batch_size * t.shape[-1] * t.element_size() * tensors_per_pair
+    rows_per_block = max(1, int(max_memory_mb * 2**20 // max(bytes_per_row, 1)))
+
+    # Parent times are sorted, so the latest target of each block bounds its number of parents.
+    row_starts = list(range(0, num_rows, rows_per_block))
+    row_ends = [min(r0 + rows_per_block, num_rows) for r0 in row_starts]
+    t_last = torch.stack(
+        [t_select[:, r0:r1].detach().max(-1)[0] for r0, r1 in zip(row_starts, row_ends)], dim=-1
+    )  # (B, num_blocks)
+    num_cols = torch.searchsorted(t.detach().contiguous(), t_last.contiguous()).max(0)[0]
+    return list(zip(row_starts, row_ends, num_cols.tolist()))
+
+
+def omori_rate(t_select, t, productivity, c, p, max_memory_mb=None):
+    """ Aftershock intensity at times t_select, summed over all previous events at times t.
+
+    Args:
+        t_select: Sorted arrival times at which the intensity is evaluated, shape (B, S)
+        t: Sorted arrival times of the (potential) parent events, shape (B, L)
+        productivity: Expected number of aftershocks of each parent event, shape (B, L)
+        c: The c parameter of Omori's law.
+        p: The p parameter of Omori's law.
+        max_memory_mb: If not None, the intensity is computed exactly in row blocks over
+            the causal lower triangle, with the pairwise tensors of each block capped to
+            this memory budget (in MB). Blocks are recomputed during the backward pass,
+            so the peak memory stays bounded with autograd too.
+
+    Returns:
+        rate_omori: Aftershock intensity at each time in t_select, shape (B, S)
+    """
+    if max_memory_mb is None:
+        return omori_rate_dense(t_select, t, productivity, c, p)
+
+    rate_blocks = []
+    for row_start, row_end, num_cols in causal_row_blocks(t_select, t, max_memory_mb):
+        args = (
+            t_select[:, row_start:row_end],
+            t[:, :num_cols],
+            productivity[:, :num_cols],
+            c,
+            p,
+        )
+        if torch.is_grad_enabled():
+            rate_blocks.append(checkpoint(omori_rate_dense, *args, use_reentrant=False))
+        else:
+            rate_blocks.append(omori_rate_dense(*args))
+    return torch.cat(rate_blocks, dim=-1)  # (B, S)
+
+
+def soe_omori_rates(c, p, t_span, num_terms=32, tol=1e-6):
+    """ Decay rates of the sum-of-exponentials (SOE) approximation of Omori's law.
+
+    Uses the Laplace representation (t + c)^-p = 1/Gamma(p) * int s^(p-1) exp(-s (t + c)) ds,
+    discretised with the trapezoidal rule on a log-spaced grid of decay rates s_k. The grid
+    covers s (t + c) in [tol^(1/p), 40] for all 0 <= t <= t_span, so it only depends on the
+    (detached) parameter values and the length of the catalog.
+
+    Args:
+        c: The c parameter of Omori's law.
+        p: The p parameter of Omori's law.
+        t_span: Longest time lag at which the kernel must be approximated.
+        num_terms: Number of exponentials K.
+        tol: Target relative truncation error at the longest lag.
+
+    Returns:
+        rates: Log-spaced decay rates s_k, shape (K,)
+    """
+    c, p = float(c), float(p)
+    log_s_min = math.log(tol) / p - math.log(float(t_span) + c)
+    log_s_max = math.log(40.0 / c)
+    return torch.logspace(log_s_min, log_s_max, num_terms, base=math.e, dtype=torch.float64)
+
+
+def soe_omori_log_weights(c, p, rates):
+    """ Log-weights of the SOE approximation (t + c)^-p ~= sum_k w_k exp(-s_k t).
+
+    The weights are differentiable w.r.t. c and p (the rates s_k are fixed).
+    """
+    log_rates = rates.log()
+    step = log_rates[1] - log_rates[0]
+    c, p = c.double(), p.double()
+    return step.log() + p * log_rates - rates * c - torch.lgamma(p)  # (K,)
+
+
+def soe_error_bound(c, p, rates, t_span, num_points=512):
+    """ Maximum relative error of the SOE Omori kernel on [0, t_span].
+
+    The error is evaluated on a dense log-spaced grid of time lags (plus t = 0).
+    """
+    with torch.no_grad():
+        c, p = torch.as_tensor(c).double(), torch.as_tensor(p).double()
+        lags = torch.cat([
+            torch.zeros(1, dtype=torch.float64),
+            torch.logspace(-3, math.log10(float(t_span)), num_points, dtype=torch.float64) * c,
+        ]).clamp_max(float(t_span))
+        log_w = soe_omori_log_weights(c, p, rates)
+        approx = torch.logsumexp(log_w - rates * lags.unsqueeze(-1), dim=-1).exp()
+        exact = (lags + c).pow(-p)
+        return ((approx - exact).abs() / exact).max().item()
+
+
+def omori_rate_soe(t_select, t, productivity, c, p, rates, target_mask=None):
+    """ Aftershock intensity at times t_select with the SOE approximation of Omori's law.
+
+    Each exponential term obeys the recursive Hawkes update
+        A_k(t_i) = exp(-s_k (t_i - t_{i-1})) * (A_k(t_{i-1}) + productivity_{i-1}),
+    which is evaluated for all events at once as a log-space prefix sum, so the cost is
+    O(N * K) instead of O(N^2). Only strictly earlier events contribute (as in the exact kernel).
+
+    Args:
+        t_select: Sorted arrival times at which the intensity is evaluated, shape (B, S)
+        t: Sorted arrival times of the (potential) parent events, shape (B, L)
+        productivity: Expected number of aftershocks of each parent event, shape (B, L)
+        c: The c parameter of Omori's law.
+        p: The p parameter of Omori's law.
+        rates: Decay rates from soe_omori_rates, shape (K,)
+        target_mask: Optional mask of the actual (non-padded) entries of t_select, shape (B, S)
+
+    Returns:
+        rate_omori: Aftershock intensity at each time in t_select (0 for targets without
+            earlier parents and for padding), shape (B, S)
+    """
+    dtype = t_select.dtype
+    t, t_select = t.double(), t_select.double()
+    log_w = soe_omori_log_weights(c, p, rates)  # (K,)
+
+    # log_cum[b, j, k] = log sum_{l <= j} productivity_l exp(s_k t_l)
+    log_prod = productivity.double().clamp_min(1e-300).log()
+    log_cum = torch.logcumsumexp(log_prod.unsqueeze(-1) + rates * t.unsqueeze(-1), dim=-2)  # (B, L, K)
+
+    # Number of parents strictly before each target time.
+    num_prev = torch.searchsorted(t.detach().contiguous(), t_select.detach().contiguous())  # (B, S)
+    has_prev = num_prev > 0
+    idx = (num_prev - 1).clamp_min(0).unsqueeze(-1).expand(-1, -1, rates.shape[0])
+    log_A = log_cum.gather(-2, idx) - rates * t_select.unsqueeze(-1)  # (B, S, K)
+
+    # Targets without parents (e.g. the zero padding of t_select) would otherwise give inf * 0.
+    # Their log_A is replaced by a finite value before the sum (an all -inf row would give NaN
+    # gradients), and their rate is set to 0 afterwards.
+    valid = has_prev if target_mask is None else has_prev & target_mask.bool()
+    log_A = torch.where(valid.unsqueeze(-1), log_A, torch.zeros_like(log_A))
+    log_rate = torch.logsumexp(log_w + log_A, dim=-1)
+    rate = torch.where(valid, log_rate.exp(), torch.zeros_like(log_rate))
+    return rate.to(dtype)  # (B, S)
+
+
+def omori_rate_params(t_select, t, productivity, c, p):
+    """ Dense aftershock intensity for P parameter sets sharing the same events.
+
+    Args:
+        t_select: Arrival times at which the intensity is evaluated, shape (B, S)
+        t: Arrival times of the (potential) parent events, shape (B, L)
+        productivity: Productivity of each parent for each parameter set, shape (P, B, L)
+        c: The c parameter of Omori's law, shape (P, 1, 1)
+        p: The p parameter of Omori's law, shape (P, 1, 1)
+
+    Returns:
+        rate_omori: Aftershock intensity for each parameter set, shape (P, B, S)
+    """
+    # The time differences and causal mask are shared by all the parameter sets.
+    delta_t = t_select.unsqueeze(-1) - t.unsqueeze(-2)  # (B, S, L)
+    prev_mask = (delta_t > 0).float()  # (B, S, L)
+    omori = (delta_t * prev_mask + c.unsqueeze(-1)).pow(-p.unsqueeze(-1)) * prev_mask  # (P, B, S, L)
+    return torch.einsum('pbsl,pbl->pbs', omori, productivity)
+
+
+def etas_nll_params(params, features, max_memory_mb=64.0):
+    """ ETAS negative log-likelihood for a batch of parameter sets.
+
+    Args:
+        params: (Clamped) parameter sets, ordered as ETAS_IS.param_names, shape (P, 9)
+        features: Event-only quantities returned by ETAS_IS.get_event_features.
+        max_memory_mb: Memory budget (in MB) for the pairwise tensors of each row block,
+            shared by all P parameter sets.
+
+    Returns:
+        nll: NLL of each sequence for each parameter set, shape (P, B)
+    """
+    f = features
+    mu, p, c, k, alpha, SI, pt, ct, kt = [x.view(-1, 1, 1) for x in params.unbind(-1)]
+    num_params = params.shape[0]
+    t, t_select = f.t, f.t_select
+
+    # Intensity rate from the earthquake aftershock process, one block of target events at a time.
+    productivity = k * 10 ** (alpha * f.mag_rel)  # (P, B, L)
+    rate_blocks = []
+    blocks = causal_row_blocks(t_select, t, max_memory_mb, tensors_per_pair=4 * num_params + 4)
+    for row_start, row_end, num_cols in blocks:
+        args = (
+            t_select[:, row_start:row_end],
+            t[:, :num_cols],
+            productivity[..., :num_cols],
+            c,
+            p,
+        )
+        if torch.is_grad_enabled():
+            rate_blocks.append(checkpoint(omori_rate_params, *args, use_reentrant=False))
+        else:
+            rate_blocks.append(omori_rate_params(*args))
+    rate_omori = torch.cat(rate_blocks, dim=-1)  # (P, B, S)
+
+    # Intensity rates from the injection driven and shut-in trailing seismicity processes.
+    rate_drive = torch.pow(10, f.v_select + SI) * f.v_mask  # (P, B, S)
+    rate_trail = kt * (f.dt_trail + ct).pow(-pt) * f.t_mask  # (P, B, S)
+    log_intensity = (
+        torch.log(mu + rate_omori + rate_drive + rate_trail) * f.intensity_mask
+    ).sum(-1)  # (P, B)
+
+    # Integrated intensity (cumulative number of events).
+    one_minus_p = 1 - p
+    omori_int = (
+        (f.t_end - t + c).pow(one_minus_p)
+        - ((f.t_nll_start - t).clamp_min(0.0) + c).pow(one_minus_p)
+    ) / one_minus_p  # (P, B, L)
+    one_minus_pt = 1 - pt.view(-1, 1)
+    trail_int = ct.view(-1, 1).pow(one_minus_pt) - (ct.view(-1, 1) + f.dt_trail_max).pow(one_minus_pt)
+    integral = (f.t_end - f.t_nll_start).squeeze(-1) * mu.view(-1, 1)
+    integral = integral + (omori_int * productivity * f.survival_mask).sum(-1)
+    integral = integral + torch.pow(10, f.Vc_max + SI.view(-1, 1))
+    integral = integral + (-kt.view(-1, 1) / one_minus_pt) * trail_int  # (P, B)
+
+    return (-log_intensity + integral) / f.end_idx  # (P, B)
+
+
+def subsample_targets(intensity_mask, num_targets, generator=None):
+    """ Sample target events uniformly without replacement, separately in each sequence.
+
+    Args:
+        intensity_mask: Float mask of the target events, shape (B, S)
+        num_targets: Number of target events drawn per sequence (all of them if fewer).
+        generator: Optional torch.Generator used for the draws.
+
+    Returns:
+        select_idx: Sorted column of each sampled target (0 for padding), shape (B, n)
+        sample_mask: Float mask indicating what entries are actual samples, shape (B, n)
+        weight: Inverse inclusion probability N_b / n_b of each sequence, shape (B,)
+    """
+    valid = intensity_mask.bool()
+    num_valid = valid.sum(-1)  # (B,)
+    num_drawn = num_valid.clamp(max=num_targets)  # (B,)
+    num_samples = max(int(num_drawn.max()), 1) if valid.shape[0] > 0 else 1
+
+    # The n smallest random keys among the valid targets form a uniform sample without replacement.
+    keys = torch.rand(valid.shape, generator=generator, device=valid.device)
+    keys = torch.where(valid, keys, torch.full_like(keys, 2.0))
+    select_idx = keys.topk(min(num_samples, keys.shape[-1]), dim=-1, largest=False)[1]
+    sample_mask = torch.arange(select_idx.shape[-1], device=valid.device) < num_drawn.unsqueeze(-1)
+    select_idx = torch.where(sample_mask, select_idx, torch.full_like(select_idx, keys.shape[-1]))
+    select_idx = select_idx.sort(-1)[0].clamp(max=keys.shape[-1] - 1)
+    weight = num_valid.to(intensity_mask.dtype) / num_drawn.clamp_min(1).to(intensity_mask.dtype)
+    return select_idx, sample_mask.float(), weight
+
+
+def omori_rate_sampled(t_select, t, productivity, c, p, num_recent, rates, num_tail=16, generator=None):
+    """ Unbiased estimate of the aftershock intensity from a subset of the parent events.
+
+    The num_recent latest parents of each target are summed exactly. The older parents are
+    importance sampled from the sum-of-exponentials (SOE) approximation of their contributions,
+    productivity_j * sum_k w_k exp(-s_k (t - t_j)) ~= productivity_j * (t - t_j + c)^-p: an
+    exponential term k is drawn in proportion to its share of the tail intensity, and then a
+    parent in proportion to its term in the cumulative (log-space) SOE state. Each draw is
+    weighted by the ratio of the exact Omori kernel to its SOE approximation, so the estimate
+    is unbiased, and its variance only comes from the (small) error of the approximation.
+
+    Args:
+        t_select: Sorted arrival times at which the intensity is evaluated, shape (B, S)
+        t: Sorted arrival times of the (potential) parent events, shape (B, L)
+        productivity: Expected number of aftershocks of each parent event, shape (B, L)
+        c: The c parameter of Omori's law.
+        p: The p parameter of Omori's law.
+        num_recent: Number of latest parents of each target that are summed exactly.
+        rates: Decay rates of the SOE proposal, from soe_omori_rates, shape (K,)
+        num_tail: Number of older parents drawn (with replacement) for each target.
+        generator: Optional torch.Generator used for the draws.
+
+    Returns:
+        rate_omori: Estimated aftershock intensity at each time in t_select, shape (B, S)
+        rate_var: Estimated variance of rate_omori, shape (B, S)
+    """
+    num_prev = torch.searchsorted(t.detach().contiguous(), t_select.detach().contiguous())  # (B, S)
+
+    # Exact contribution of the latest parents, t_j with num_prev - num_recent <= j < num_prev.
+    offsets = torch.arange(-num_recent, 0, device=t.device)
+    recent_idx = num_prev.unsqueeze(-1) + offsets  # (B, S, R)
+    recent_mask = recent_idx >= 0
+    recent_idx = recent_idx.clamp_min(0).flatten(1)
+    delta_t = t_select.unsqueeze(-1) - t.gather(-1, recent_idx).view(recent_mask.shape)
+    recent_mask = recent_mask & (delta_t > 0)
+    omori = (torch.where(recent_mask, delta_t, torch.zeros_like(delta_t)) + c).pow(-p)
+    rate_recent = (
+        omori * productivity.gather(-1, recent_idx).view(recent_mask.shape) * recent_mask
+    ).sum(-1)  # (B, S)
+
+    # SOE proposal for the older parents, t_j with j < num_old = num_prev - num_recent.
+    # log_cum[b, j, k] = log sum_{l <= j} productivity_l exp(s_k t_l)
+    with torch.no_grad():
+        B, S = t_select.shape
+        K = rates.shape[0]
+        t64, t_select64 = t.detach().double(), t_select.detach().double()
+        log_w = soe_omori_log_weights(c.detach(), p.detach(), rates)  # (K,)
+        log_prod = productivity.detach().double().clamp_min(1e-300).log()
+        log_cum = torch.logcumsumexp(log_prod.unsqueeze(-1) + rates * t64.unsqueeze(-1), dim=-2)  # (B, L, K)
+        num_old = (num_prev - num_recent).clamp_min(0)  # (B, S)
+        has_tail = num_old > 0
+        last_idx = (num_old - 1).clamp_min(0).unsqueeze(-1).expand(-1, -1, K)
+        log_total = log_cum.gather(-2, last_idx)  # (B, S, K)
+        log_terms = log_w + log_total - rates * t_select64.unsqueeze(-1)  # (B, S, K)
+        log_tail = torch.logsumexp(log_terms, dim=-1)  # (B, S), SOE intensity of the tail
+
+        # Draw an exponential term, and then a parent from the cumulative state of that term.
+        probs = torch.softmax(log_terms, dim=-1).flatten(0, 1)  # (B * S, K)
+        term = torch.multinomial(probs, num_tail, replacement=True, generator=generator)
+        term = term.view(B, S, num_tail)
+        u = torch.rand(B, S, num_tail, generator=generator, device=t.device, dtype=torch.float64)
+        log_target = u.clamp_min(1e-300).log() + log_total.gather(-1, term)  # (B, S, T)
+        queries = torch.full((B, K, S * num_tail), math.inf, dtype=torch.float64, device=t.device)
+        queries.scatter_(1, term.flatten(1).unsqueeze(1), log_target.flatten(1).unsqueeze(1))
+        tail_idx = torch.searchsorted(log_cum.transpose(1, 2).contiguous(), queries, right=True)
+        tail_idx = tail_idx.gather(1, term.flatten(1).unsqueeze(1)).squeeze(1)  # (B, S * T)
+        tail_idx = torch.minimum(tail_idx, (num_old - 1).clamp_min(0).repeat_interleave(num_tail, -1))
+
+        # Proposal probability of each draw, relative to its SOE kernel value.
+        tail_shape = (B, S, num_tail)
+        tail_dt64 = (t_select64.unsqueeze(-1) - t64.gather(-1, tail_idx).view(tail_shape)).clamp_min(0.0)
+        log_soe = torch.logsumexp(log_w - rates * tail_dt64.unsqueeze(-1), dim=-1)  # (B, S, T)
+        log_scale = (log_tail.unsqueeze(-1) - log_soe - log_prod.gather(-1, tail_idx).view(tail_shape))
+        scale = torch.where(has_tail.unsqueeze(-1), log_scale.exp(), torch.zeros_like(log_scale))
+
+    tail_dt = (t_select.unsqueeze(-1) - t.gather(-1, tail_idx).view(tail_shape)).clamp_min(0.0)
+    tail_terms = (
+        (tail_dt + c).pow(-p) * productivity.gather(-1, tail_idx).view(tail_shape) * scale.to(t.dtype)
+    )
+    rate_tail = tail_terms.mean(-1)  # (B, S)
+    rate_var = tail_terms.detach().var(-1) / num_tail if num_tail > 1 else torch.zeros_like(rate_tail)
+    return rate_recent + rate_tail, rate_var
+
+
+def golden_section_search(fn, lower, upper, num_iter=40):
+    """ Maximize a unimodal scalar function on [lower, upper] with golden-section search."""
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = lower, upper
+    x1, x2 = b - ratio * (b - a), a + ratio * (b - a)
+    f1, f2 = fn(x1), fn(x2)
+    for _ in range(num_iter):
+        if f1 >= f2:
+            b, x2, f2 = x2, x1, f1
+            x1 = b - ratio * (b - a)
+            f1 = fn(x1)
+        else:
+            a, x1, f1 = x1, x2, f2
+            x2 = a + ratio * (b - a)
+            f2 = fn(x2)
+    return (x1, f1) if f1 >= f2 else (x2, f2)
+
+
+def power_law_int(X, Y, p):
+    """ Integral of (s)^-p from Y to X, which is also valid for p = 1."""
+    one_minus_p = 1 - p
+    if abs(one_minus_p) < 1e-6:
+        return X.log() - Y.log()
+    return (X.pow(one_minus_p) - Y.pow(one_minus_p)) / one_minus_p
+
+
+def etas_e_step(
+    params, features, max_memory_mb=64.0, c_grid=None, min_parent_prob=1e-3, max_parents=None, soe_terms=32
+):
+    """ Expectation step of the ETAS EM algorithm (stochastic declustering).
+
+    Computes the probability that each target event is a background event, an aftershock of
+    each of its parents, injection-driven (SI term) or trailing seismicity (pt/ct/kt term).
+
+    The pairwise probabilities are only computed for the max_parents latest parents of each
+    target (in row blocks within the memory budget). The older parents are aggregated with the
+    sum-of-exponentials (SOE) approximation of Omori's law (see omori_rate_soe): their total
+    intensity comes from the prefix state over the parents, their expected offspring from the
+    matching suffix state over the targets, and their sums of log(t_i - t_j + c) from the
+    derivatives of the SOE weights w.r.t. p and c (to second order in the offset of each
+    candidate c from the current one). The cost is O(S * max_parents + (S + L) * soe_terms)
+    instead of O(S * L).
+
+    Args:
+        params: (Clamped) parameter values, ordered as ETAS_IS.param_names, shape (9,)
+        features: Event-only quantities returned by ETAS_IS.get_event_features.
+        max_memory_mb: Memory budget (in MB) for the pairwise tensors of each row block.
+        c_grid: If not None, candidate values of Omori's c for which the expected sum of
+            log(t_i - t_j + c) over all triggering pairs is accumulated, shape (G,)
+        min_parent_prob: Parent probabilities below this value are left out of the returned
+            sparse parent matrix (they are still included in all the sums).
+        max_parents: Number of latest parents of each target with pairwise probabilities
+            (None = all parents, without the SOE aggregation).
+        soe_terms: Number of exponentials used for the older parents.
+
+    Returns:
+        branching: DotDict with
+            prob_background, prob_aftershock, prob_injection, prob_trailing: probabilities of
+                each component for the target events, shape (B, S)
+            prob_parent: sparse COO tensor with the probability that event j (parents, L)
+                triggered target i (rows of t_select, S), shape (B, S, L). Only the latest
+                max_parents parents of each target are included.
+            offspring: expected number of triggered events of each parent, shape (B, L)
+            log_delta_sums: expected sums of log(t_i - t_j + c) for each c in c_grid, shape (G,)
+    """
+    f = features
+    mu, p, c, k, alpha, SI, pt, ct, kt = params.unbind(-1)
+    t, t_select = f.t, f.t_select
+    B, S = t_select.shape
+    L = t.shape[-1]
+    productivity = k * 10 ** (alpha * f.mag_rel)  # (B, L)
+    rate_drive = torch.pow(10, f.v_select + SI) * f.v_mask  # (B, S)
+    rate_trail = kt * (f.dt_trail + ct).pow(-pt) * f.t_mask  # (B, S)
+    c_grid = torch.as_tensor([] if c_grid is None else c_grid, dtype=t.dtype)  # (G,)
+    num_prev = torch.searchsorted(t.contiguous(), t_select.contiguous())  # (B, S)
+    window = L if max_parents is None else min(max_parents, L)
+
+    # Intensity of the older parents (outside the window), from the SOE prefix state.
+    has_tail = max_parents is not None and window < L
+    if has_tail:
+        t64, t_select64 = t.double(), t_select.double()
+        c64, p64 = c.double(), p.double()
+        rates = soe_omori_rates(c64, p64, (t64.max() - t64.min()).clamp_min(1.0), soe_terms)
+        log_w = soe_omori_log_weights(c64, p64, rates)  # (K,)
+        log_prod = productivity.double().clamp_min(1e-300).log()
+        log_cum = torch.logcumsumexp(log_prod.unsqueeze(-1) + rates * t64.unsqueeze(-1), dim=-2)  # (B, L, K)
+        num_old = (num_prev - window).clamp_min(0)  # (B, S)
+        old_mask = (num_old > 0) & f.intensity_mask.bool()
+        last_idx = (num_old - 1).clamp_min(0).unsqueeze(-1).expand(-1, -1, rates.shape[0])
+        log_terms = log_w + log_cum.gather(-2, last_idx) - rates * t_select64.unsqueeze(-1)  # (B, S, K)
+        log_terms = torch.where(old_mask.unsqueeze(-1), log_terms, torch.full_like(log_terms, -math.inf))
+        terms = log_terms.exp()  # w_k * A_k(t_i), (B, S, K)
+        rate_old = terms.sum(-1).to(t.dtype)  # (B, S)
+    else:
+        rate_old = torch.zeros_like(t_select)
+
+    # The intensity of each target only needs its window of parents, so rows are independent.
+    rate_recent = torch.zeros_like(t_select)
+    offspring = torch.zeros_like(t)
+    log_delta_sums = torch.zeros(len(c_grid), dtype=t.dtype)
+    parent_idx, parent_prob = [], []
+    bytes_per_row = B * window * t.element_size() * (8 + len(c_grid))
+    block_rows = max(1, int(max_memory_mb * 2**20 // bytes_per_row))
+    for row_start in range(0, S, block_rows):
+        rows = slice(row_start, min(row_start + block_rows, S))
+        num_prev_rows = num_prev[:, rows]  # (B, r)
+        num_cols = min(window, int(num_prev_rows.max())) if num_prev_rows.numel() > 0 else 0
+        if num_cols == 0:
+            continue
+        cols = num_prev_rows.unsqueeze(-1) + torch.arange(-num_cols, 0, device=t.device)  # (B, r, n)
+        col_mask = cols >= 0
+        cols = cols.clamp_min(0)
+        delta_t = t_select[:, rows].unsqueeze(-1) - t.gather(-1, cols.flatten(1)).view(cols.shape)
+        prev_mask = col_mask & (delta_t > 0)
+        delta_t = torch.where(prev_mask, delta_t, torch.zeros_like(delta_t))
+        parent_prod = productivity.gather(-1, cols.flatten(1)).view(cols.shape)
+        trigger = (delta_t + c).pow(-p) * parent_prod * prev_mask
+        rate_recent[:, rows] = trigger.sum(-1)
+
+        # The full intensity of each target is known once its window is complete.
+        intensity = mu + rate_recent[:, rows] + rate_old[:, rows] + rate_drive[:, rows] + rate_trail[:, rows]
+        prob = trigger * (f.intensity_mask[:, rows] / intensity).unsqueeze(-1)  # (B, r, n)
+        offspring.scatter_add_(-1, cols.flatten(1), prob.flatten(1))
+        if len(c_grid) > 0:
+            log_delta = torch.log(delta_t.unsqueeze(-1) + c_grid)  # (B, r, n, G)
+            log_delta_sums += torch.einsum('brn,brng->g', prob, log_delta)
+        idx = (prob > min_parent_prob).nonzero()
+        parent_prob.append(prob[idx[:, 0], idx[:, 1], idx[:, 2]])
+        parent_idx.append(torch.stack([idx[:, 0], idx[:, 1] + row_start, cols[idx[:, 0], idx[:, 1], idx[:, 2]]], -1))
+
+    rate_omori = rate_recent + rate_old
+    intensity = mu + rate_omori + rate_drive + rate_trail
+    if has_tail:
+        g = (f.intensity_mask / intensity).double()  # (B, S)
+
+        # Expected sums of log(dt + c_grid) over the older parents, from the derivatives of the
+        # SOE weights w.r.t. p and c: K * log(dt + c) = -dK/dp, K / (dt + c) = -dK/dc / p and
+        # K / (dt + c)^2 = d2K/dc2 / (p (p + 1)), expanding log(dt + c_grid) to second order.
+        K_log = (terms * (torch.digamma(p64) - rates.log())).sum(-1)  # (B, S)
+        K_inv = (terms * rates).sum(-1) / p64  # (B, S)
+        K_inv2 = (terms * rates**2).sum(-1) / (p64 * (p64 + 1))  # (B, S)
+        c_offset = c_grid.double() - c64
+        log_delta_sums += (
+            (g * K_log).sum() + c_offset * (g * K_inv).sum() - c_offset**2 / 2 * (g * K_inv2).sum()
+        ).to(t.dtype)
+
+        # Expected offspring of each parent from the targets for which it is an older parent,
+        # i.e. the targets i with num_old_i > j (a suffix of the sorted targets).
+        # log_suffix[b, i, k] = log sum_{i' >= i} g_i' exp(-s_k t_i')
+        num_old_sorted = torch.where(f.intensity_mask.bool(), num_old, torch.full_like(num_old, L))
+        log_g = g.clamp_min(1e-300).log() + torch.where(old_mask, 0.0, -math.inf)
+        log_suffix = torch.logcumsumexp(
+            (log_g.unsqueeze(-1) - rates * t_select64.unsqueeze(-1)).flip(-2), dim=-2
+        ).flip(-2)  # (B, S, K)
+        log_suffix = torch.cat([log_suffix, torch.full_like(log_suffix[:, :1], -math.inf)], dim=-2)
+        parents = torch.arange(L, device=t.device).expand(B, -1).contiguous()
+        first_target = torch.searchsorted(num_old_sorted.contiguous(), parents + 1)  # (B, L)
+        log_suffix = log_suffix.gather(-2, first_target.unsqueeze(-1).expand(-1, -1, rates.shape[0]))
+        offspring += torch.logsumexp(
+            log_prod.unsqueeze(-1) + log_w + rates * t64.unsqueeze(-1) + log_suffix, dim=-1
+        ).exp().to(t.dtype)
+
+    parent_idx = torch.cat(parent_idx) if parent_idx else torch.zeros(0, 3, dtype=torch.long)
+    parent_prob = torch.cat(parent_prob) if parent_prob else torch.zeros(0, dtype=t.dtype)
+    return DotDict(
+        prob_background=mu * f.intensity_mask / intensity,
+        prob_aftershock=rate_omori * f.intensity_mask / intensity,
+        prob_injection=rate_drive * f.intensity_mask / intensity,
+        prob_trailing=rate_trail * f.intensity_mask / intensity,
+        prob_parent=torch.sparse_coo_tensor(
+            parent_idx.T, parent_prob, (B, S, L), check_invariants=False
+        ),
+        offspring=offspring,
+        log_delta_sums=log_delta_sums,
+    )
+
+
+class ETASIntensityIndex:
+    """ Query index for the intensity and compensator of ETAS_IS at arbitrary times.
+
+    Built once for fixed parameters and a sequence. The Omori kernel is replaced by its
+    truncated sum-of-exponentials approximation (see soe_omori_rates), so the aftershock state
+    after every event is precomputed with a prefix scan over the sorted events, and each query
+    only needs a searchsorted for the last previous event plus O(K) work. The injection-driven
+    and trailing terms are evaluated on the injection schedule of the sequence (inj_* fields)
+    with the closed-form segment integrals of injection_segments.
+
+    Args:
+        model: ETAS_IS model (its current parameters are used).
+        sequence: Sequence of induced seismicity.
+        t_max: Largest query time (sets the truncation of the kernel). Defaults to t_end.
+        num_terms: Number of exponential terms of the kernel approximation.
+        tol: Relative error at which the kernel approximation is truncated.
+        injection: If not None, injection schedule (with the inj_* fields) used instead of the
+            one of the sequence, e.g. a planned schedule after the end of the sequence.
+    """
+
+    def __init__(self, model, sequence, t_max=None, num_terms=32, tol=1e-6, injection=None):
+        with torch.no_grad():
+            mu, p, c, k, alpha, SI, pt, ct, kt = [
+                param.detach().double() for param in model.get_params()
+            ]
+            self.t_start = float(sequence.t_start)
+            t_max = float(sequence.t_end) if t_max is None else t_max
+            self.t = sequence.arrival_times.double()
+            mag_rel = sequence.mag.double() - float(sequence.mag_completeness)
+            prod = k * 10 ** (alpha * mag_rel)  # (N,)
+
+            # state[j, k] = sum over events i <= j of prod_i * exp(-rate_k * (t_j - t_i))
+            rates = soe_omori_rates(c, p, max(t_max - self.t_start, 1.0), num_terms, tol)  # (K,)
+            self.rates = rates
+            self.weights = soe_omori_log_weights(c, p, rates).exp()  # (K,)
+            log_terms = prod.log().unsqueeze(-1) + rates * self.t.unsqueeze(-1)  # (N, K)
+            self.state = (log_terms.logcumsumexp(0) - rates * self.t.unsqueeze(-1)).exp()
+            self.cum_prod = prod.cumsum(0)  # (N,)
+            self.mu = float(mu)
+
+            self.segments = None
+            if injection is None and 'inj_time' in sequence:
+                injection = sequence
+            if injection is not None and len(injection['inj_time']) > 1:
+                injection = hold_injection_schedule(
+                    get_injection_schedule(injection), self.t_start, t_max
+                )
+                self.inj_time = injection['inj_time']
+                self.segments = injection_segments(
+                    *injection.values(), self.t_start, t_max,
+                    SI=float(SI), pt=float(pt), ct=float(ct), kt=float(kt),
+                )
+
+    def _omori_terms(self, times):
+        """ Last event before each time, and its decayed state at that time, shape (Q, K)."""
+        idx = torch.searchsorted(self.t, times.contiguous(), right=False) - 1  # (Q,)
+        has_prev = idx >= 0
+        idx = idx.clamp_min(0)
+        if len(self.t) == 0:
+            return idx, torch.zeros(len(times), len(self.rates), dtype=times.dtype), has_prev
+        lag = (times - self.t[idx]).clamp_min(0.0).unsqueeze(-1)  # (Q, 1)
+        decayed = self.state[idx] * torch.exp(-self.rates * lag) * has_prev.unsqueeze(-1)
+        return idx, decayed, has_prev
+
+    def omori_state(self, times) -> torch.Tensor:
+        """ Aftershock rate of the events before each time, as amplitudes of exponential terms.
+
+        The aftershock rate at times + s (without the events after times) is the sum over k of
+        omori_state(times)[:, k] * exp(-rates[k] * s).
+
+        Args:
+            times: Query times, shape (Q,)
+
+        Returns:
+            amplitudes: Amplitude of each exponential term (decay rates self.rates), shape (Q, K)
+        """
+        times = torch.as_tensor(times, dtype=torch.float64).flatten()
+        _, decayed, _ = self._omori_terms(times)
+        return decayed * self.weights
+
+    def _injection_segment(self, times):
+        """ Injection segment of each time and the time elapsed since its start."""
+        seg = np.searchsorted(self.inj_time, times, side='left') - 1
+        seg = np.clip(seg, 0, len(self.inj_time) - 2)
+        return seg, np.clip(times - self.segments['start'][seg], 0, None)
+
+    def intensity(self, times) -> torch.Tensor:
+        """ Intensity at the given times (excluding events at exactly these times), shape (Q,)."""
+        times = torch.as_tensor(times, dtype=torch.float64).flatten()
+        intensity = self.mu + self.omori_state(times).sum(-1)
+        if self.segments is not None:
+            seg, elapsed = self._injection_segment(times.numpy())
+            sg = self.segments
+            rate_trail = sg['kt'] * (sg['offset'][seg] + elapsed) ** (-sg['pt'])
+            rate_inj = np.where(sg['is_trailing'][seg], rate_trail, sg['driven_rate'][seg])
+            intensity = intensity + torch.from_numpy(rate_inj)
+        return intensity
+
+    def compensator(self, times) -> torch.Tensor:
+        """ Integrated intensity from t_start to the given times, shape (Q,)."""
+        times = torch.as_tensor(times, dtype=torch.float64).flatten()
+        idx, decayed, has_prev = self._omori_terms(times)
+        # Integral of prod_j * exp(-rate_k * (s - t_j)) from t_j to the query time, summed over j
+        cum_prod = self.cum_prod[idx] * has_prev if len(self.t) > 0 else torch.zeros_like(times)
+        omori = ((cum_prod.unsqueeze(-1) - decayed) * self.weights / self.rates).sum(-1)
+        compensator = self.mu * (times - self.t_start).clamp_min(0.0) + omori
+        if self.segments is not None:
+            seg, elapsed = self._injection_segment(times.numpy())
+            sg = self.segments
+            previous = np.concatenate([[0.0], sg['cum_weight']])[seg]
+            trail_int = sg['kt'] * omori_int(0, elapsed, sg['offset'][seg], sg['pt'])
+            partial = np.where(sg['is_trailing'][seg], trail_int, sg['driven_rate'][seg] * elapsed)
+            compensator = compensator + torch.from_numpy(previous + partial)
+        return compensator
+
+    def integral(self, t1, t2) -> torch.Tensor:
+        """ Integrated intensity between each pair of times (e.g. expected counts in bins), shape (Q,)."""
+        return self.compensator(t2) - self.compensator(t1)
+
+
+class ETASLikelihood(torch.autograd.Function):
+    """ Fused ETAS negative log-likelihood with analytic gradients.
+
+    The forward pass walks over row blocks of the causal pairwise matrix once, computing the
+    Omori intensity together with the row sums needed for its derivatives. Since the full
+    intensity of each target event is known once its row is complete, all the gradients are
+    accumulated in the same pass and the pairwise tensors never have to be kept for backprop.
+
+    Usage:
+        nll = ETASLikelihood.apply(mu, p, c, k, alpha, SI, pt, ct, kt, features, max_memory_mb)
+
+    where the parameters are the (clamped) scalar model parameters, and features are the
+    event-only quantities returned by ETAS_IS.get_event_features.
+    """
+
+    @staticmethod
+    def forward(ctx, mu, p, c, k, alpha, SI, pt, ct, kt, features, max_memory_mb):
+        f = features
+        ln10 = math.log(10)
+        t, t_select, mag_rel = f.t, f.t_select, f.mag_rel
+        E = 10 ** (alpha * mag_rel)  # (B, L), productivity = k * E
+
+        # Omori intensity and its row sums, one block of target events at a time.
+        # R_E = sum_j K_ij E_j, R_a = sum_j K_ij E_j m_j ln10,
+        # R_p = sum_j K_ij E_j ln(dt_ij + c), R_c = sum_j K_ij E_j / (dt_ij + c)
+        # where K_ij = (dt_ij + c)^-p for previous events.
+        row_sums = [torch.zeros_like(t_select) for _ in range(4)]
+        E_mag = E * mag_rel * ln10
+        for row_start, row_end, num_cols in causal_row_blocks(t_select, t, max_memory_mb):
+            if num_cols == 0:
+                continue
+            delta_t = t_select[:, row_start:row_end].unsqueeze(-1) - t[:, :num_cols].unsqueeze(-2)
+            prev_mask = delta_t > 0
+            x = torch.where(prev_mask, delta_t, torch.zeros_like(delta_t)) + c
+            log_x = x.log()
+            omori = torch.exp(-p * log_x) * prev_mask
+            E_block, E_mag_block = E[:, :num_cols], E_mag[:, :num_cols]
+            row_sums[0][:, row_start:row_end] = torch.einsum('brn,bn->br', omori, E_block)
+            row_sums[1][:, row_start:row_end] = torch.einsum('brn,bn->br', omori, E_mag_block)
+            row_sums[2][:, row_start:row_end] = torch.einsum('brn,bn->br', omori * log_x, E_block)
+            row_sums[3][:, row_start:row_end] = torch.einsum('brn,bn->br', omori / x, E_block)
+        R_E, R_a, R_p, R_c = row_sums
+
+        # Intensity at each target event, and its components.
+        rate_drive = 10 ** (f.v_select + SI) * f.v_mask  # (B, S)
+        log_trail_x = (f.dt_trail + ct).log()
+        trail = torch.exp(-pt * log_trail_x) * f.t_mask  # (B, S)
+        intensity = mu + k * R_E + rate_drive + kt * trail  # (B, S)
+        log_intensity = (intensity.log() * f.intensity_mask).sum(-1)  # (B,)
+        g = f.intensity_mask / intensity  # d log_intensity / d intensity
+
+        grad_log_intensity = torch.stack([
+            g.sum(-1),  # mu
+            -(g * k * R_p).sum(-1),  # p
+            -(g * k * p * R_c).sum(-1),  # c
+            (g * R_E).sum(-1),  # k
+            (g * k * R_a).sum(-1),  # alpha
+            (g * rate_drive * ln10).sum(-1),  # SI
+            -(g * kt * trail * log_trail_x).sum(-1),  # pt
+            -(g * kt * pt * trail / (f.dt_trail + ct)).sum(-1),  # ct
+            (g * trail).sum(-1),  # kt
+        ], dim=-1)  # (B, 9)
+
+        # Integrated Omori intensity (from max(t_j, t_nll_start) to t_end) and its derivatives.
+        one_minus_p = 1 - p
+        X = f.t_end - t + c  # (B, L)
+        Y = (f.t_nll_start - t).clamp_min(0.0) + c  # (B, L)
+        X_q, Y_q = X.pow(one_minus_p), Y.pow(one_minus_p)
+        omori_int = (X_q - Y_q) / one_minus_p
+        d_omori_int_dc = X.pow(-p) - Y.pow(-p)
+        d_omori_int_dp = omori_int / one_minus_p - (X_q * X.log() - Y_q * Y.log()) / one_minus_p
+        S_E = f.survival_mask * E  # (B, L)
+
+        # Integrated trailing seismicity intensity and its derivatives.
+        one_minus_pt = 1 - pt
+        ct_q = ct.pow(one_minus_pt)
+        ct_max_q = (ct + f.dt_trail_max).pow(one_minus_pt)
+        trail_int = ct_q - ct_max_q
+        d_trail_int_dq = (ct_q * ct.log() - ct_max_q * (ct + f.dt_trail_max).log()) / one_minus_pt
+        d_trail_int_dq = d_trail_int_dq - trail_int / one_minus_pt**2
+
+        rate_inj_int = 10 ** (f.Vc_max + SI)
+        integral = (f.t_end - f.t_nll_start).squeeze(-1) * mu
+        integral = integral + k * (omori_int * S_E).sum(-1)
+        integral = integral + rate_inj_int
+        integral = integral + (-kt / one_minus_pt) * trail_int
+        grad_integral = torch.stack([
+            (f.t_end - f.t_nll_start).squeeze(-1),  # mu
+            k * (d_omori_int_dp * S_E).sum(-1),  # p
+            k * (d_omori_int_dc * S_E).sum(-1),  # c
+            (omori_int * S_E).sum(-1),  # k
+            k * (omori_int * S_E * mag_rel * ln10).sum(-1),  # alpha
+            rate_inj_int * ln10,  # SI
+            kt * d_trail_int_dq,  # pt
+            -kt * (ct.pow(-pt) - (ct + f.dt_trail_max).pow(-pt)),  # ct
+            -trail_int / one_minus_pt,  # kt
+        ], dim=-1)  # (B, 9)
+
+        end_idx = f.end_idx.to(t.dtype).unsqueeze(-1)
+        ctx.save_for_backward((grad_integral - grad_log_intensity) / end_idx)
+        return (-log_intensity + integral) / f.end_idx  # (B,)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        (grad_nll,) = ctx.saved_tensors  # (B, 9)
+        grads = (grad_output.unsqueeze(-1) * grad_nll).sum(0)
+        return (*grads.unbind(), None, None)
+
+
 class ETAS_IS(TPPModel):
     """ Epidemic-type aftershock sequence model (Ogata, 1988).
 
@@ -83,12 +1135,39 @@ class ETAS_IS(TPPModel):
         richter_b: Fixed b value of the Gutenberg-Richter distribution for magnitudes.
         report_params: Whether to report the model parameters in the PyTorch Lightning progress bar during training.
         learning_rate: Learning rate use for optimization.
+        pairwise_memory_mb: If not None, the Omori intensity is evaluated exactly in blocks of
+            target events, with the pairwise tensors of each block capped to this many MB.
+        omori_kernel: Evaluation of the Omori kernel. Possible choices {'exact', 'soe'}, where 'soe'
+            approximates (t + c)^-p with a sum of exponentials for O(N) intensity evaluation.
+        soe_terms: Number of exponentials used by the 'soe' Omori kernel.
+        fused_likelihood: Whether to compute the NLL with the fused ETASLikelihood op, which returns
+            analytic gradients and never keeps the pairwise tensors (requires the 'exact' kernel).
+        stochastic_targets: If not None, training_step uses the stochastic NLL (see stochastic_loss)
+            with this many target events subsampled per sequence and step.
+        stochastic_parents: Number of latest parents summed exactly for each sampled target by the
+            stochastic NLL, the older ones being importance sampled (None = all parents exactly).
+        stochastic_tail_samples: Number of importance sampled older parents per sampled target.
+        em_parents: Number of latest parents of each event with pairwise branching probabilities
+            in the EM fit and get_branching, the older ones being aggregated with the SOE kernel
+            (None = all parents exactly, the default). Setting it is an opt-in approximation: the
+            cost drops from O(L^2) to O(L * em_parents) per E-step, but the probabilities of the
+            aggregated parents are only accurate to ~1e-4 relative error (and the sums of log
+            delays to ~1e-3) with the default soe_terms, so the EM estimates differ slightly
+            from the exact ones. Use it for catalogs with many thousands of events.
         
         Note that this code is a hack job.
         The SI & trailing seismicity parts are poorly implemented.
         This will only be valid for the special cases I've given it.
     """
 
+    # Names of the (clamped) model parameters, in the order used by get_params.
+    param_names = ["mu", "p", "c", "k", "alpha", "SI", "pt", "ct", "kt"]
+    # Clamping range of each parameter (as applied by the parameter properties).
+    param_bounds = [
+        (0.0, 1e-3), (0.1, 3.0), (1e-1, 1e+4), (0.0, 1e+4), (1e-3, 1e+1),
+        (-20.0, +20.0), (0.1, 5.0), (1e-1, 1e+4), (0.0, 1e+6),
+    ]
+
     def __init__(
         self,
         base_rate_init: float = 0.0001,
@@ -100,10 +1179,26 @@ class ETAS_IS(TPPModel):
         trail_p_init: float = 2.08,
         trail_c_init: float = 10.0,
         trail_k_init: float = 0.01,
+        richter_b: float = 1.0,
         report_params: bool = True,
         learning_rate: float = 5e-2,
+        pairwise_memory_mb: Optional[float] = None,
+        omori_kernel: str = 'exact',
+        soe_terms: int = 32,
+        fused_likelihood: bool = False,
+        stochastic_targets: Optional[int] = None,
+        stochastic_parents: Optional[int] = None,
+        stochastic_tail_samples: int = 16,
+        em_parents: Optional[int] = None,
     ):
         super().__init__()
+
+        # Check for valid Omori kernel flags.
+        if omori_kernel not in ['exact', 'soe']:
+            raise ValueError(
+                f"omori_kernel must be one of ['exact', 'soe'] " f"(got {omori_kernel})"
+            )
+
         self.log_mu = nn.Parameter(torch.tensor(math.log(base_rate_init)))
         self.log_p = nn.Parameter(torch.tensor(math.log(omori_p_init)))
         self.log_c = nn.Parameter(torch.tensor(math.log(omori_c_init)))
@@ -113,8 +1208,17 @@ class ETAS_IS(TPPModel):
         self.log_pt = nn.Parameter(torch.tensor(math.log(trail_p_init)))
         self.log_ct = nn.Parameter(torch.tensor(math.log(trail_c_init)))
         self.log_kt = nn.Parameter(torch.tensor(math.log(trail_k_init)))
+        self.b = richter_b
         self.report_params = report_params
         self.learning_rate = learning_rate
+        self.pairwise_memory_mb = pairwise_memory_mb
+        self.omori_kernel = omori_kernel
+        self.soe_terms = soe_terms
+        self.fused_likelihood = fused_likelihood
+        self.stochastic_targets = stochastic_targets
+        self.stochastic_parents = stochastic_parents
+        self.stochastic_tail_samples = stochastic_tail_samples
+        self.em_parents = em_parents
 
     @property
     def mu(self):
@@ -155,87 +1259,731 @@ class ETAS_IS(TPPModel):
         print('Trailing Seismicity')
         print(self.pt.data, self.ct.data, self.kt.data)
 
-    def loss(self, batch: eq.data.BatchIS, forecasting=False, forecast_count=0, add_rate_misfit=False) -> torch.Tensor:
-        """ Compute negative log-likelihood (NLL) for a batch of event sequences.
+    def get_params(self) -> List[torch.Tensor]:
+        """ Get the (clamped) model parameters, in the order of param_names."""
+        return [getattr(self, param_name) for param_name in self.param_names]
+
+    def clamp_params(self, params: torch.Tensor) -> torch.Tensor:
+        """ Clamp parameter sets of shape (..., 9) to the ranges used by the model."""
+        lower, upper = [
+            torch.tensor(bound, dtype=params.dtype, device=params.device)
+            for bound in zip(*self.param_bounds)
+        ]
+        return torch.max(torch.min(params, upper), lower)
+
+    def loss_params(self, batch: eq.data.BatchIS, params: torch.Tensor) -> torch.Tensor:
+        """ Compute the NLL of a batch of event sequences for many parameter sets at once.
+
+        Used for likelihood grids, multi-start fits and bootstrap: the event-only quantities
+        (selected events, time differences, injection masks) are shared by all parameter sets.
 
         Args:
             batch: BatchIS of padded event sequences.
+            params: Parameter sets in natural units, ordered as param_names, shape (P, 9).
+                Values are clamped to the same ranges as the model parameters.
 
         Returns:
-            nll: NLL of each sequence, shape (batch_size,)
+            nll: NLL of each sequence for each parameter set, shape (P, batch_size)
         """
-        # Intensity rate from the background process.
-        rate_backg = self.mu
+        f = self.get_event_features(batch)
+        params = self.clamp_params(params.to(f.t.dtype))
+        return etas_nll_params(params, f, self.pairwise_memory_mb or 64.0)
+
+    def set_params(self, params: torch.Tensor):
+        """ Set the raw model parameters from (clamped) values ordered as param_names, shape (9,)."""
+        params = self.clamp_params(torch.as_tensor(params, dtype=self.log_mu.dtype))
+        with torch.no_grad():
+            for raw_param, param_name, value in zip(self.parameters(), self.param_names, params):
+                if param_name == 'SI':
+                    raw_param.copy_(value)
+                else:
+                    raw_param.copy_(value.clamp_min(1e-30).log())
+
+    def get_branching(self, batch: eq.data.BatchIS, min_parent_prob: float = 1e-3) -> DotDict:
+        """ Get the branching (stochastic declustering) probabilities of every target event.
+
+        See etas_e_step for the returned probabilities.
+        """
+        with torch.no_grad():
+            f = self.get_event_features(batch)
+            params = torch.stack(self.get_params())
+            return etas_e_step(
+                params,
+                f,
+                self.pairwise_memory_mb or 64.0,
+                min_parent_prob=min_parent_prob,
+                max_parents=self.em_parents,
+                soe_terms=self.soe_terms,
+            )
 
-        # Prep for aftershock intensity decay.
+    def _fit_em(self, batch, max_iter, tol, verbose, num_c_grid=17):
+        """ Expectation-maximization fit (see fit)."""
+        t0 = time.time()
+        history = []
+        max_memory_mb = self.pairwise_memory_mb or 64.0
+        ln10 = math.log(10)
+        with torch.no_grad():
+            f = self.get_event_features(batch)
+            mask = f.survival_mask  # (B, L)
+            X_end = f.t_end - f.t  # (B, L)
+            X_start = (f.t_nll_start - f.t).clamp_min(0.0)  # (B, L)
+            c_width = 1.0
+            loss = self.loss(batch).mean().item()
+            num_iter, converged = 0, False
+            for num_iter in range(1, max_iter + 1):
+                mu, p, c, k, alpha, SI, pt, ct, kt = [float(x) for x in self.get_params()]
+
+                # E-step (with the candidate values of c for the M-step).
+                c_lower, c_upper = self.param_bounds[2]
+                c_grid = (c * torch.exp(torch.linspace(-c_width, c_width, num_c_grid))).clamp(c_lower, c_upper)
+                params = torch.stack(self.get_params())
+                branching = etas_e_step(
+                    params,
+                    f,
+                    max_memory_mb,
+                    c_grid=c_grid.tolist(),
+                    max_parents=self.em_parents,
+                    soe_terms=self.soe_terms,
+                )
+                num_background = branching.prob_background.sum()
+                num_aftershock = branching.prob_aftershock.sum()
+                num_injection = branching.prob_injection.sum()
+                num_trailing = branching.prob_trailing.sum()
+                offspring = branching.offspring
+
+                # M-step: background rate and seismogenic index in closed form.
+                mu = num_background / (f.t_end - f.t_nll_start).sum()
+                SI = torch.log10(num_injection.clamp_min(1e-30)) - torch.log10(torch.pow(10, f.Vc_max).sum())
+
+                # M-step: Omori c (over the grid) and p (1-D solves), then alpha (1-D solve)
+                # and k (closed form). Each coordinate update increases the expected
+                # complete-data log-likelihood, also when a parameter reaches its bound.
+                E = 10 ** (alpha * f.mag_rel) * mask
+
+                def omori_objective(p_value, c_value, log_delta_sum):
+                    omori_int = power_law_int(X_end + c_value, X_start + c_value, p_value)
+                    return float(-p_value * log_delta_sum - k * (E * omori_int).sum())
+
+                scores, p_values = [], []
+                for c_value, log_delta_sum in zip(c_grid.tolist(), branching.log_delta_sums):
+                    p_value, score = golden_section_search(
+                        lambda x: omori_objective(x, c_value, log_delta_sum), *self.param_bounds[1]
+                    )
+                    scores.append(score)
+                    p_values.append(p_value)
+                best = int(np.argmax(scores))
+                p, c = p_values[best], float(c_grid[best])
+                # The grid is centred on the current c, and is refined once c stops moving.
+                c_width = c_width / 2 if best == num_c_grid // 2 else min(2 * c_width, 1.0)
+
+                omori_int = power_law_int(X_end + c, X_start + c, p) * mask
+                offspring_mag = (offspring * f.mag_rel).sum() * ln10
+
+                def alpha_objective(alpha_value):
+                    E = 10 ** (alpha_value * f.mag_rel)
+                    return float(alpha_value * offspring_mag - k * (E * omori_int).sum())
+
+                alpha = golden_section_search(alpha_objective, *self.param_bounds[4])[0]
+                k = num_aftershock / (10 ** (alpha * f.mag_rel) * omori_int).sum()
+
+                # M-step: trailing seismicity ct and pt (1-D solves), and kt (closed form).
+                trail_weight = branching.prob_trailing
+
+                def trail_objective(pt_value, ct_value):
+                    trail_int = power_law_int(ct_value + f.dt_trail_max, torch.tensor(ct_value), pt_value)
+                    log_trail = (trail_weight * torch.log(f.dt_trail + ct_value)).sum()
+                    return float(-pt_value * log_trail - kt * trail_int.sum())
+
+                log_ct_bounds = [math.log(x) for x in self.param_bounds[7]]
+                ct = math.exp(golden_section_search(lambda x: trail_objective(pt, math.exp(x)), *log_ct_bounds)[0])
+                pt = golden_section_search(lambda x: trail_objective(x, ct), *self.param_bounds[6])[0]
+                trail_int = power_law_int(ct + f.dt_trail_max, torch.tensor(ct), pt)
+                kt = num_trailing / trail_int.sum()
+
+                self.set_params(torch.tensor([float(x) for x in [mu, p, c, k, alpha, SI, pt, ct, kt]]))
+                new_loss = self.loss(batch).mean().item()
+                history.append(new_loss)
+                if verbose:
+                    print(f"EM iteration {num_iter}: loss = {new_loss:.6f}")
+                converged = abs(loss - new_loss) < tol
+                loss = new_loss
+                if converged:
+                    break
+
+            branching = self.get_branching(batch)
+
+        return dict(
+            method='em',
+            loss=loss,
+            num_iter=num_iter,
+            num_evals=num_iter + 1,
+            converged=converged,
+            history=history,
+            time=time.time() - t0,
+            branching=branching,
+        )
+
+    def get_soe_rates(self, t_span):
+        """ Decay rates of the SOE Omori kernel for lags up to t_span."""
+        return soe_omori_rates(self.c.detach(), self.p.detach(), t_span, self.soe_terms)
+
+    def soe_error_bound(self, t_span) -> float:
+        """ Maximum relative error of the SOE Omori kernel for lags up to t_span."""
+        rates = self.get_soe_rates(t_span)
+        return soe_error_bound(self.c.detach(), self.p.detach(), rates, t_span)
+
+    def get_omori_rate(self, t_select, t, productivity, target_mask=None):
+        """ Aftershock intensity at times t_select, using the selected Omori kernel.
+
+        target_mask optionally marks the actual (non-padded) entries of t_select.
+        """
+        if self.omori_kernel == 'soe':
+            t_span = (t.detach().max() - t.detach().min()).clamp_min(1.0)
+            rates = self.get_soe_rates(t_span).to(t.device)
+            return omori_rate_soe(t_select, t, productivity, self.c, self.p, rates, target_mask)
+        return omori_rate(t_select, t, productivity, self.c, self.p, self.pairwise_memory_mb)
+
+    @property
+    def required_marks(self) -> List[str]:
+        """ Supplementary marks read from a batch by get_event_features."""
+        return ['mag', 'vm', 'sv', 'dTS', 'Vc']
+
+    def get_event_features(self, batch: eq.data.BatchIS) -> DotDict:
+        """ Get the event-only quantities of the NLL, which do not depend on the model parameters.
+
+        They are cached on the batch (see BatchIS.cached), so that training on the same batches
+        every epoch only computes them once.
+
+        Args:
+            batch: BatchIS of padded event sequences.
+
+        Returns:
+            features: DotDict with the selected target events (shape (B, S)), the parent events
+                (shape (B, L)) and the per-sequence quantities (shape (B,) or (B, 1)).
+        """
+        return batch.cached('ETAS_IS.get_event_features', lambda: self._get_event_features(batch))
+
+    def _get_event_features(self, batch: eq.data.BatchIS) -> DotDict:
+        """ Compute the quantities returned by get_event_features."""
         # t_select - arrival times of events for which intensity must be computed, shape (B, S)
         # (where S = L if t_start == t_nll_start, and S <= L otherwise)
-        # delta_t[0, i, j] = t_i - t_j
-        # prev_mask[0, i, j] = float(t_i < t_j)
+        # (the selection indices are computed once and shared by all the selected fields)
         t = batch.arrival_times
-        t_select, intensity_mask = masked_select_per_row(t, batch.mask)
-        delta_t = t_select.unsqueeze(-1) - t.unsqueeze(-2)  # (B, S, L)
-        prev_mask = (delta_t > 0).float()  # (B, S, L)
+        (t_select, v_select, sv_select, dTS_select), intensity_mask = masked_select_fields(
+            batch.mask, t, batch.vm, batch.sv, batch.dTS
+        )
+        dt_trail = torch.pow(10, dTS_select.clamp(-10,10) )
+
+        # survival_mask[0, j] = float(t_j is an event, rather than t_end or padding)
+        survival_mask = get_mask(
+            batch.inter_times,
+            start_idx=torch.zeros_like(batch.start_idx),
+            end_idx=batch.end_idx,
+        )
+        return DotDict(
+            t=t,  # (B, L)
+            mag_rel=batch.mag - batch.mag_completeness.unsqueeze(-1),  # (B, L)
+            survival_mask=survival_mask,  # (B, L)
+            t_select=t_select,  # (B, S)
+            intensity_mask=intensity_mask,  # (B, S)
+            v_select=v_select.clamp(-10,10),  # (B, S)
+            v_mask=(sv_select==1).float(),  # (B, S)
+            dt_trail=dt_trail,  # (B, S)
+            t_mask=(sv_select==0).float(),  # (B, S)
+            dt_trail_max=torch.max(dt_trail,dim=-1)[0],  # (B,)
+            Vc_max=torch.max(batch.Vc,dim=-1)[0],  # (B,)
+            t_end=batch.t_end.unsqueeze(-1),  # (B, 1)
+            t_nll_start=batch.t_nll_start.unsqueeze(-1),  # (B, 1)
+            end_idx=batch.end_idx,  # (B,)
+        )
+
+    def loss(
+        self, batch: eq.data.BatchIS, forecasting=False, forecast_count=0, add_rate_misfit=False, stochastic=False
+    ) -> torch.Tensor:
+        """ Compute negative log-likelihood (NLL) for a batch of event sequences.
+
+        Args:
+            batch: BatchIS of padded event sequences.
+            stochastic: Whether to return the unbiased subsampled estimate of the NLL
+                (see stochastic_loss) instead of the exact one.
+
+        Returns:
+            nll: NLL of each sequence, shape (batch_size,)
+        """
+        if stochastic:
+            return self.stochastic_loss(batch).nll
+        f = self.get_event_features(batch)
+        if self.fused_likelihood:
+            if self.omori_kernel != 'exact':
+                raise ValueError("fused_likelihood requires omori_kernel='exact'")
+            max_memory_mb = self.pairwise_memory_mb or 64.0
+            return ETASLikelihood.apply(*self.get_params(), f, max_memory_mb)
+
+        # Intensity rate from the background process.
+        rate_backg = self.mu
 
         # Intensity rate from the earthquake aftershock process.
-        # omori[0, i, j] = contribution of event t_j on intensity at time t_i
         # productivity[0, j] = expected number of aftershocks after event t_j
-        omori = (delta_t * prev_mask + self.c).pow(-self.p)  # (B, S, L)
-        productivity = self.k * 10 ** (self.alpha * (batch.mag - batch.mag_completeness))  # (B, L)
-        rate_omori = (omori * productivity.unsqueeze(-2) * prev_mask).sum(-1)
+        t = f.t
+        productivity = self.k * 10 ** (self.alpha * f.mag_rel)  # (B, L)
+        rate_omori = self.get_omori_rate(f.t_select, t, productivity, f.intensity_mask)  # (B, S)
 
         # Intensity rate from the injection driven process.
-        v_select = masked_select_per_row(batch.vm, batch.mask)[0]
-        v_mask = (masked_select_per_row(batch.sv, batch.mask)[0]==1).float()
-        rate_drive = torch.pow(10, v_select.clamp(-10,10) + self.SI ) * v_mask
+        rate_drive = torch.pow(10, f.v_select + self.SI ) * f.v_mask
 
         # Intensity rate from the shut-in trailing seismicity process.
-        dt_trail =  torch.pow(10, masked_select_per_row(batch.dTS, batch.mask)[0].clamp(-10,10) )
-        t_mask = (masked_select_per_row(batch.sv, batch.mask)[0]==0).float()
-        trail = (dt_trail  + self.ct).pow(-self.pt)
+        trail = (f.dt_trail  + self.ct).pow(-self.pt)
         #idx = (batch.dTS>0).nonzero()
         #temp=idx[:,1]-1
         #temp[temp<0]=0
         #idx[:,1]=temp
         k_trail = self.kt
-        rate_trail = k_trail * trail * t_mask
+        rate_trail = k_trail * trail * f.t_mask
 
         # Get the cumulative log intensity for each component process.
         log_intensity = (
-            torch.log(rate_backg + rate_omori + rate_drive + rate_trail) * intensity_mask
+            torch.log(rate_backg + rate_omori + rate_drive + rate_trail) * f.intensity_mask
         ).sum(-1)
 
 
         # Prep for cumulative number of aftershock events.
         # omori_int[0, j] = integral of the omori law from max(t_j, t_nll_start) to t_end
         one_minus_p = 1 - self.p
-        t_end = batch.t_end.unsqueeze(-1)  # (B, 1)
-        t_nll_start = batch.t_nll_start.unsqueeze(-1)  # (B, 1)
         omori_int = (
-            (t_end - t + self.c).pow(one_minus_p)
-            - ((t_nll_start - t).clamp_min(0.0) + self.c).pow(one_minus_p)
+            (f.t_end - t + self.c).pow(one_minus_p)
+            - ((f.t_nll_start - t).clamp_min(0.0) + self.c).pow(one_minus_p)
         ) / one_minus_p  # (B, L)
-        survival_mask = get_mask(
-            batch.inter_times,
-            start_idx=torch.zeros_like(batch.start_idx),
-            end_idx=batch.end_idx,
-        )
 
         # Prep for cumulative number of trailing seismicity events.
         one_minus_pt = 1 - self.pt
-        trail_int = (self.ct).pow(one_minus_pt) - (self.ct + torch.max(dt_trail,dim=-1)[0] ).pow(one_minus_pt)
+        trail_int = (self.ct).pow(one_minus_pt) - (self.ct + f.dt_trail_max ).pow(one_minus_pt)
 
         # Integrated intensity (cumulative number of events).
         integral = (batch.t_end - batch.t_nll_start) * self.mu
-        integral += (omori_int * productivity * survival_mask).sum(-1)
-        integral += torch.pow(10, torch.max(batch.Vc,dim=-1)[0] + self.SI )
+        integral += (omori_int * productivity * f.survival_mask).sum(-1)
+        integral += torch.pow(10, f.Vc_max + self.SI )
         integral += (-k_trail/one_minus_pt) * trail_int
 
         # Return the negative log-likelihood.
         return (-log_intensity + integral) / (batch.end_idx)  # (B,)
 
+    def stochastic_loss(
+        self,
+        batch: eq.data.BatchIS,
+        num_targets: Optional[int] = None,
+        num_parents: Optional[int] = None,
+        num_tail_samples: Optional[int] = None,
+        generator: Optional[torch.Generator] = None,
+    ) -> DotDict:
+        """ Unbiased stochastic estimate of the NLL, for catalogs too long for the exact one.
+
+        The log-intensity sum is estimated from a uniform sample of num_targets target events per
+        sequence (Horvitz-Thompson weighting). The Omori intensity of each sampled target sums its
+        num_parents latest parents exactly and importance samples the older ones from the SOE
+        approximation of their contributions, see omori_rate_sampled. The compensator has a closed
+        form that is linear in the number of events, so it is computed exactly.
+
+        With num_parents=None the estimate is exactly unbiased. With parent sampling the intensity
+        is unbiased but its logarithm is not: the second-order (delta method) bias is corrected and
+        reported as log_intensity_bias, and the remaining (higher-order) bias is negligible as long
+        as the SOE proposal is accurate (its relative spread is ~1e-5 on the shipped catalogs).
+
+        Args:
+            batch: BatchIS of padded event sequences.
+            num_targets: Number of target events sampled per sequence (default stochastic_targets).
+            num_parents: Number of latest parents summed exactly (default stochastic_parents).
+            num_tail_samples: Number of importance sampled older parents (default stochastic_tail_samples).
+            generator: Optional torch.Generator used for the draws.
+
+        Returns:
+            result: DotDict with the estimated NLL of each sequence (nll), its estimated standard
+                deviation (nll_std), the corrected log-intensity bias (log_intensity_bias), all of
+                shape (batch_size,), and the number of sampled targets (num_targets).
+        """
+        num_targets = num_targets if num_targets is not None else self.stochastic_targets
+        num_parents = num_parents if num_parents is not None else self.stochastic_parents
+        if num_tail_samples is None:
+            num_tail_samples = self.stochastic_tail_samples
+        if num_targets is None or num_targets < 1:
+            raise ValueError(f"num_targets must be a positive integer (got {num_targets})")
+        if num_parents is not None and num_tail_samples < 1:
+            raise ValueError(f"num_tail_samples must be a positive integer (got {num_tail_samples})")
+        f = self.get_event_features(batch)
+
+        # Uniform sample of the target events of each sequence.
+        select_idx, sample_mask, weight = subsample_targets(f.intensity_mask, num_targets, generator)
+        t_select, v_select, v_mask, dt_trail, t_mask = [
+            gather_per_row(x, select_idx, sample_mask)
+            for x in [f.t_select, f.v_select, f.v_mask, f.dt_trail, f.t_mask]
+        ]
+
+        # Intensity at the sampled targets (exact, or unbiased with sampled older parents).
+        t = f.t
+        productivity = self.k * 10 ** (self.alpha * f.mag_rel)  # (B, L)
+        if num_parents is None:
+            rate_omori = self.get_omori_rate(t_select, t, productivity, sample_mask)
+            rate_var = torch.zeros_like(rate_omori)
+        else:
+            t_span = (t.detach().max() - t.detach().min()).clamp_min(1.0)
+            rates = self.get_soe_rates(t_span).to(t.device)
+            rate_omori, rate_var = omori_rate_sampled(
+                t_select, t, productivity, self.c, self.p, num_parents, rates, num_tail_samples, generator
+            )
+        rate_drive = torch.pow(10, v_select + self.SI) * v_mask
+        rate_trail = self.kt * (dt_trail + self.ct).pow(-self.pt) * t_mask
+        intensity = self.mu + rate_omori + rate_drive + rate_trail  # (B, n)
+
+        # E[log(x)] ~ log(E[x]) - Var[x] / (2 E[x]^2), so add back the second order term.
+        log_bias = rate_var / (2 * intensity.detach() ** 2) * sample_mask
+        log_intensity_terms = (torch.log(intensity) + log_bias) * sample_mask
+        log_intensity = weight * log_intensity_terms.sum(-1)  # (B,)
+
+        # Variance of the target sampling (finite population) plus that of the parent sampling.
+        num_drawn = sample_mask.sum(-1).clamp_min(1)
+        num_valid = weight * num_drawn
+        terms = log_intensity_terms.detach()
+        terms_mean = terms.sum(-1, keepdim=True) / num_drawn.unsqueeze(-1)
+        terms_var = ((terms - terms_mean) ** 2 * sample_mask).sum(-1) / (num_drawn - 1).clamp_min(1)
+        log_intensity_var = num_valid**2 * (1 - 1 / weight) * terms_var / num_drawn
+        log_intensity_var = log_intensity_var + weight**2 * (
+            rate_var / intensity.detach() ** 2 * sample_mask
+        ).sum(-1)
+
+        # Integrated intensity (cumulative number of events), as in loss.
+        one_minus_p = 1 - self.p
+        omori_int = (
+            (f.t_end - t + self.c).pow(one_minus_p)
+            - ((f.t_nll_start - t).clamp_min(0.0) + self.c).pow(one_minus_p)
+        ) / one_minus_p  # (B, L)
+        one_minus_pt = 1 - self.pt
+        trail_int = (self.ct).pow(one_minus_pt) - (self.ct + f.dt_trail_max).pow(one_minus_pt)
+        integral = (batch.t_end - batch.t_nll_start) * self.mu
+        integral += (omori_int * productivity * f.survival_mask).sum(-1)
+        integral += torch.pow(10, f.Vc_max + self.SI)
+        integral += (-self.kt / one_minus_pt) * trail_int
+
+        return DotDict(
+            nll=(-log_intensity + integral) / batch.end_idx,  # (B,)
+            nll_std=log_intensity_var.sqrt() / batch.end_idx,  # (B,)
+            log_intensity_bias=weight * log_bias.detach().sum(-1) / batch.end_idx,  # (B,)
+            num_targets=sample_mask.sum(-1),  # (B,)
+        )
+
+    def project_params(self):
+        """ Move the raw (log-space) parameters back into the clamping range of the model.
+
+        Outside of the clamping range the NLL is flat in a parameter, so this keeps optimizers
+        (and the saved state_dict) at the values the model actually uses.
+        """
+        with torch.no_grad():
+            for raw_param, (lower, upper) in zip(self.parameters(), self.param_bounds):
+                if raw_param is self.SeismogenicIndex:
+                    raw_param.clamp_(lower, upper)
+                else:
+                    raw_param.clamp_(math.log(lower) if lower > 0 else None, math.log(upper))
+
+    def _run_lbfgs(self, objective, history, max_iter, tol, verbose):
+        """ Minimize objective over the raw parameters with L-BFGS (see fit), returns the number of iterations."""
+        params = list(self.parameters())
+        optimizer = torch.optim.LBFGS(
+            params,
+            lr=1,
+            max_iter=20,
+            tolerance_grad=tol,
+            tolerance_change=tol * 1e-3,
+            history_size=20,
+            line_search_fn='strong_wolfe',
+        )
+
+        def closure():
+            optimizer.zero_grad()
+            loss = objective()
+            loss.backward()
+            return loss
+
+        # Outer loop so that the parameters are projected back into range between runs.
+        num_iter = 0
+        while num_iter < max_iter:
+            # The last run is capped so that the total never exceeds max_iter.
+            group = optimizer.param_groups[0]
+            group['max_iter'] = min(20, max_iter - num_iter)
+            group['max_eval'] = group['max_iter'] * 5 // 4
+            optimizer.step(closure)
+            self.project_params()
+            num_iter = optimizer.state[params[0]]['n_iter']
+            loss = objective().item()
+            history.append(loss)
+            if verbose:
+                print(f"Iteration {num_iter}: loss = {loss:.6f}")
+            if len(history) > 1 and abs(history[-2] - history[-1]) < tol:
+                break
+        return num_iter
+
+    def _grad_hessian(self, loss):
+        """ Gradient and Hessian of a scalar loss w.r.t. the raw parameters, shapes (9,) and (9, 9)."""
+        params = list(self.parameters())
+        grads = torch.autograd.grad(loss, params, create_graph=True)
+        grad = torch.stack(grads).detach()
+        hessian = torch.zeros(len(params), len(params), dtype=grad.dtype)  # (9, 9)
+        for i, g in enumerate(grads):
+            # Parameters sitting on their clamp have a constant (zero) gradient.
+            if g.requires_grad:
+                row = torch.autograd.grad(g, params, retain_graph=True, allow_unused=True)
+                hessian[i] = torch.stack([torch.zeros_like(g) if h is None else h for h in row])
+        return grad, hessian
+
+    def init_from_sequence(
+        self, sequence: eq.data.SequenceIS, estimate_speedup: bool = True, verbose: bool = False
+    ) -> dict:
+        """ Set data-driven starting values of the parameters, from moments of a sequence.
+
+        All the estimates come from one vectorized pass over the event marks:
+        the fraction of triggered events n from the coefficient of variation of the inter-event
+        times (n = 1 - 1/CV^2), Omori's c from the mean inter-event time and p from the
+        Hill estimator of the times to the nearest-neighbour parents (see
+        nearest_neighbour_lags) above c, alpha from the regression of the
+        (log) number of events that follow each event within 10c on its magnitude, the
+        seismogenic index from the non-triggered events while injecting and the cumulative
+        volume (Vc), the trailing seismicity kernel likewise from the times since shut-in (dTS),
+        and the background rate from the events of the shut-in periods, once the trailing
+        seismicity has decayed.
+        Finally, k is set from n with the estimated c, p and alpha.
+
+        The expected speedup is estimated from a reference fit (see fit) started at the new
+        values: Adam moves each raw parameter by about learning_rate per epoch of full-batch
+        training, so the number of epochs to convergence from a starting point is about its
+        largest raw (log-scale) distance to the fitted optimum divided by the learning rate.
+
+        Args:
+            sequence: SequenceIS with the vm, sv, dTS, Vc and mag marks, as used by loss.
+            estimate_speedup: Whether to estimate the number of epochs saved (runs a fit).
+            verbose: Whether to print the starting values and the report.
+
+        Returns:
+            report: Dictionary with the starting values (params) and the NLL before and after.
+                If estimate_speedup, also the NLL of the reference fit (loss_fit), the expected
+                numbers of epochs to convergence from the previous and the new starting values
+                (epochs_default, epochs_init), and their difference (expected_epochs_saved).
+        """
+        t = sequence.arrival_times.cpu().numpy().astype(np.float64)
+        sv = sequence.sv.cpu().numpy()
+        Vc = sequence.Vc.cpu().numpy().astype(np.float64)
+        with np.errstate(over='ignore'):
+            dt_trail = np.power(10.0, sequence.dTS.cpu().numpy().astype(np.float64))
+        mag_rel = sequence.mag.cpu().numpy() - float(sequence.mag_completeness)
+        lower, upper = np.array(self.param_bounds).T
+        batch = eq.data.BatchIS.from_list([sequence])
+        with torch.no_grad():
+            loss_before = float(self.loss(batch).mean())
+            raw_before = torch.stack([x.detach().clone() for x in self.parameters()])
+
+        # Omori kernel and fraction of triggered events, from the inter-event times.
+        inter_times = np.diff(t)
+        inter_times = inter_times[inter_times > 0]
+        if len(inter_times) > 1:
+            cv2 = inter_times.var() / inter_times.mean() ** 2
+            c = np.clip(inter_times.mean(), lower[2], upper[2])
+            lags = nearest_neighbour_lags(t, mag_rel, self.b)
+            tail = lags[lags > c]
+            p = 1 + len(tail) / max(np.log(tail / c).sum(), 1e-10)
+            num_following = np.searchsorted(t, t + 10 * c, side='right') - np.arange(len(t)) - 1
+            alpha = np.polyfit(mag_rel, np.log10(num_following + 0.5), 1)[0] if mag_rel.std() > 0 else 0.0
+        else:
+            cv2, c, p, alpha = 1.0, self.c.item(), self.p.item(), self.alpha.item()
+        n = np.clip(1 - 1 / max(cv2, 1e-10), 0.0, 0.95)
+        p = np.clip(p, 1.05, upper[1])
+        alpha = np.clip(alpha, lower[4], upper[4])
+        mean_prod = np.mean(np.power(10.0, alpha * mag_rel)) if len(t) > 0 else 1.0
+        k = n * (p - 1) * c ** (p - 1) / mean_prod
+
+        # Trailing seismicity kernel, from the times since shut-in of the shut-in events.
+        is_shut_in = (sv == 0) & np.isfinite(dt_trail)
+        lags = dt_trail[is_shut_in]
+        if len(lags) > 1:
+            ct = np.clip(np.median(lags), lower[7], upper[7])
+            tail = lags[lags > ct]
+            pt = np.clip(1 + len(tail) / max(np.log(tail / ct).sum(), 1e-10), 1.05, upper[6])
+            lag_threshold = np.median(lags)
+        else:
+            ct, pt, lag_threshold = self.ct.item(), self.pt.item(), 0.0
+
+        # Background rate, from the shut-in events after the trailing seismicity has decayed.
+        injection = hold_injection_schedule(
+            get_injection_schedule(sequence), sequence.t_start, sequence.t_end
+        )
+        inj_time, inj_sign, inj_tsgn = injection['inj_time'], injection['inj_sign'], injection['inj_tsgn']
+        seg_start = np.clip(inj_time[:-1], sequence.t_start, sequence.t_end)
+        seg_end = np.clip(inj_time[1:], sequence.t_start, sequence.t_end)
+        seg_len = seg_end - seg_start
+        # (time since shut-in at the start of each segment, infinite if never injected)
+        lag_start = np.where(
+            np.isfinite(inj_tsgn[1:]),
+            np.power(10.0, inj_tsgn[1:]) - (inj_time[1:] - seg_start),
+            np.inf,
+        )
+        exposure = seg_len - np.clip(lag_threshold - lag_start, 0, seg_len)
+        exposure = exposure[inj_sign[1:] == 0].sum()
+        num_late = ((sv == 0) & ~(dt_trail <= lag_threshold)).sum()
+        mu = (1 - n) * num_late / exposure if exposure > 0 else self.mu.item()
+
+        # Trailing productivity, from the other non-triggered shut-in events.
+        num_trail = max((1 - n) * is_shut_in.sum() - mu * exposure, 1.0)
+        dt_trail_max = lags.max() if len(lags) > 0 else 0.0
+        kt = num_trail * (pt - 1) / max(ct ** (1 - pt) - (ct + dt_trail_max) ** (1 - pt), 1e-30)
+
+        # Seismogenic index, from the non-triggered events while injecting.
+        num_driven = max((1 - n) * (sv == 1).sum() - mu * (seg_len * (inj_sign[1:] == 1)).sum(), 1.0)
+        SI = np.log10(num_driven) - Vc.max() if len(Vc) > 0 else self.SI.item()
+
+        values = [mu, p, c, k, alpha, SI, pt, ct, kt]
+        self.set_params(torch.tensor([float(x) for x in values]))
+        with torch.no_grad():
+            loss_init = float(self.loss(batch).mean())
+            raw_init = torch.stack([x.detach() for x in self.parameters()])
+            params = {name: getattr(self, name).item() for name in self.param_names}
+        report = dict(params=params, loss_before=loss_before, loss_init=loss_init)
+        if verbose:
+            self.print_params()
+            print(f"NLL {loss_before:.4f} -> {loss_init:.4f}")
+
+        if estimate_speedup:
+            report['loss_fit'] = self.fit(batch)['loss']
+            with torch.no_grad():
+                raw_opt = torch.stack([x.detach().clone() for x in self.parameters()])
+                for param, value in zip(self.parameters(), raw_init):
+                    param.copy_(value)
+            epochs_default = int(math.ceil((raw_before - raw_opt).abs().max().item() / self.learning_rate))
+            epochs_init = int(math.ceil((raw_init - raw_opt).abs().max().item() / self.learning_rate))
+            report.update(
+                epochs_default=epochs_default,
+                epochs_init=epochs_init,
+                expected_epochs_saved=epochs_default - epochs_init,
+            )
+            if verbose:
+                print(f"Expected epochs to convergence: {epochs_default} -> {epochs_init}")
+        return report
+
+    def fit(
+        self,
+        batch: eq.data.BatchIS,
+        method: str = 'lbfgs',
+        max_iter: int = 200,
+        tol: float = 1e-6,
+        verbose: bool = False,
+    ) -> dict:
+        """ Fit the model to a (static) batch with a deterministic full-batch optimizer.
+
+        A much faster alternative to training with Adam through a PyTorch Lightning Trainer.
+        The raw model parameters are optimized in place, so the state_dict has the same layout
+        as after training with the Trainer.
+
+        Args:
+            batch: BatchIS of padded event sequences to fit.
+            method: Optimizer. Possible choices {'lbfgs', 'newton', 'em'}, where 'newton' is a damped
+                Newton method with the Hessian computed by autograd, and 'em' is the
+                expectation-maximization (stochastic declustering) algorithm.
+            max_iter: Maximum number of optimizer iterations.
+            tol: Convergence tolerance on the gradient (max-norm) and on the change of the loss.
+            verbose: Whether to print the loss at every iteration.
+
+        Returns:
+            diagnostics: Dictionary with the final loss and gradient norm, the number of
+                iterations and loss evaluations, the loss history, whether the optimizer
+                converged, and the run time (seconds). For 'em', it also holds the final
+                branching probabilities (see get_branching) instead of the gradient norm.
+        """
+        if method not in ['lbfgs', 'newton', 'em']:
+            raise ValueError(f"method must be one of ['lbfgs', 'newton', 'em'] (got {method})")
+        if method == 'em':
+            return self._fit_em(batch, max_iter=max_iter, tol=tol, verbose=verbose)
+
+        params = list(self.parameters())
+        history = []
+        num_evals = 0
+        t0 = time.time()
+        self.project_params()
+
+        def objective():
+            nonlocal num_evals
+            num_evals += 1
+            return self.loss(batch).mean()
+
+        if method == 'lbfgs':
+            num_iter = self._run_lbfgs(objective, history, max_iter, tol, verbose)
+        else:
+            damping = 1e-3
+            num_iter = 0
+            loss = objective()
+            while num_iter < max_iter:
+                grad, hessian = self._grad_hessian(loss)
+                if grad.abs().max() < tol:
+                    break
+
+                # Levenberg-Marquardt damped Newton step, accepted only if the loss decreases.
+                start = [param.detach().clone() for param in params]
+                while True:
+                    step = -torch.linalg.solve(
+                        hessian + damping * torch.eye(len(params), dtype=hessian.dtype), grad
+                    )
+                    with torch.no_grad():
+                        for param, param_start, param_step in zip(params, start, step):
+                            param.copy_(param_start + param_step)
+                    self.project_params()
+                    new_loss = objective()
+                    if torch.isfinite(new_loss) and new_loss <= loss:
+                        damping = max(damping / 10, 1e-9)
+                        break
+                    damping *= 10
+                    if damping > 1e+9:
+                        with torch.no_grad():
+                            for param, param_start in zip(params, start):
+                                param.copy_(param_start)
+                        new_loss = loss
+                        break
+                num_iter += 1
+                change = (loss - new_loss).abs().item()
+                loss = new_loss
+                history.append(loss.item())
+                if verbose:
+                    print(f"Iteration {num_iter}: loss = {history[-1]:.6f}")
+                if change < tol:
+                    break
+
+        # Final diagnostics.
+        self.zero_grad()
+        loss = objective()
+        grads = torch.autograd.grad(loss, params, allow_unused=True)
+        grad_norm = max(float(g.abs().max()) for g in grads if g is not None)
+        diagnostics = dict(
+            method=method,
+            loss=loss.item(),
+            grad_norm=grad_norm,
+            num_iter=num_iter,
+            num_evals=num_evals,
+            converged=grad_norm < tol or (len(history) > 1 and abs(history[-2] - history[-1]) < tol),
+            history=history,
+            time=time.time() - t0,
+        )
+        if verbose:
+            print(
+                f"{method} finished after {num_iter} iterations ({diagnostics['time']:.2f} s): "
+                f"loss = {diagnostics['loss']:.6f}, |grad| = {grad_norm:.2e}"
+            )
+        return diagnostics
+
     def training_step(self, batch, batch_idx):
-        loss = self.loss(batch).mean()
+        if self.stochastic_targets is not None:
+            result = self.stochastic_loss(batch)
+            loss = result.nll.mean()
+            self.log(
+                "train_fit_loss_std",
+                result.nll_std.mean(),
+                on_step=False,
+                on_epoch=True,
+                batch_size=batch.batch_size,
+            )
+        else:
+            loss = self.loss(batch).mean()
         self.log(
             "train_fit_loss",
             loss,
@@ -244,7 +1992,7 @@ class ETAS_IS(TPPModel):
             batch_size=batch.batch_size,
         )
         if self.report_params:
-            for param_name in ["mu", "p", "c", "k", "alpha", "SI", "pt", "ct", "kt"]:
+            for param_name in self.param_names:
                 self.log(
                     f"params/{param_name}",
                     getattr(self, param_name).item(),
@@ -253,16 +2001,184 @@ class ETAS_IS(TPPModel):
                     prog_bar=True,
                     batch_size=batch.batch_size,
                 )
+            if self.omori_kernel == 'soe':
+                t_span = float((batch.t_end - batch.t_start).max())
+                self.log(
+                    "params/soe_error",
+                    self.soe_error_bound(t_span),
+                    on_step=False,
+                    on_epoch=True,
+                    batch_size=batch.batch_size,
+                )
         return loss
 
-    def evaluate_intensity(
+    def get_intensity_index(
+        self,
+        sequence: eq.data.SequenceIS,
+        t_max: Optional[float] = None,
+        tol: float = 1e-6,
+        injection: Optional[Union[eq.data.SequenceIS, dict]] = None,
+    ) -> ETASIntensityIndex:
+        """ Get the query index for the intensity and compensator of a sequence (see ETASIntensityIndex)."""
+        return ETASIntensityIndex(
+            self, sequence, t_max=t_max, num_terms=self.soe_terms, tol=tol, injection=injection
+        )
+
+    def forecast_expected(
+        self,
+        duration: float,
+        past_seq: Optional[eq.data.SequenceIS] = None,
+        t_start: float = 0.0,
+        injection: Optional[Union[eq.data.SequenceIS, dict]] = None,
+        num_bins: int = 1000,
+        mag_completeness: float = 0.0,
+        M_max: float = 10,
+        max_iter: int = 500,
+        tol: float = 1e-8,
+        t_max: float = 1e10,
+    ) -> DotDict:
+        """ Deterministic forecast of the expected seismicity rate and event counts.
+
+        Solves the renewal equation of the expected rate, i.e. the background, injection-driven,
+        trailing and past-event forcing plus the Omori kernel convolved with the expected
+        (Gutenberg-Richter weighted) productivity of the forecast events. The expected counts
+        in the time bins are found by fixed-point iteration with FFT-based convolutions.
+
+        Args:
+            duration: Length of the forecast interval.
+            past_seq: If provided, the forecast starts at past_seq.t_end and includes the
+                aftershocks of the past events.
+            t_start: Start of the forecast interval, used if past_seq is not provided.
+            injection: Injection schedule of the forecast interval (inj_* fields). Defaults to
+                the schedule of past_seq (with its last state held).
+            num_bins: Number of time bins of the forecast interval.
+            mag_completeness: magnitude of completeness, used if past_seq is not provided.
+            M_max: Maximum magnitude of the Gutenberg-Richter distribution (as in gen_mag).
+            max_iter: Maximum number of fixed-point iterations.
+            tol: Convergence tolerance on the change of the expected counts.
+            t_max: Maximum duration of the aftershock sequences, used (as in sample) to check
+                that the branching ratio is below one. An explosive process raises an error.
+
+        Returns:
+            forecast: DotDict with the bin edges (num_bins + 1), and the expected counts, mean
+                rate and cumulative expected counts in each bin (num_bins)
+        """
+        with torch.no_grad():
+            if past_seq is not None:
+                t_start = float(past_seq.t_end)
+                M_c = float(past_seq.mag_completeness)
+            else:
+                M_c = float(mag_completeness)
+                past_seq = eq.data.SequenceIS(
+                    inter_times=torch.zeros(1, dtype=torch.float64),
+                    t_start=t_start,
+                    mag=torch.zeros(0),
+                    mag_completeness=M_c,
+                )
+
+            # Determine the branching ratio (and assert that it is smaller than one)
+            branch = branching_ratio(
+                k=float(self.k) * omori_int(0, t_max, float(self.c), float(self.p)),
+                b=float(self.b), alpha=float(self.alpha), M_min=M_c, M_max=M_max,
+            )
+            if branch > 1:
+                raise ValueError(
+                    f"The process is explosive: branching ratio {branch:.2f} is > 1."
+                )
+            edges = torch.linspace(t_start, t_start + duration, num_bins + 1, dtype=torch.float64)
+            dt = duration / num_bins
+
+            # Forcing: expected counts in each bin without triggering by the forecast events.
+            index = self.get_intensity_index(past_seq, t_max=edges[-1].item(), injection=injection)
+            forcing = index.integral(edges[:-1], edges[1:])  # (num_bins,)
+
+            # Offspring expected in bin n + d of a parent in the middle of bin n.
+            mu, p, c, k, alpha = [param.detach().double() for param in self.get_params()[:5]]
+            b, M_rel = self.b, M_max - M_c
+            if abs(b - alpha.item()) < 1e-6:
+                mean_prod = b * math.log(10) * M_rel / (1 - 10 ** (-b * M_rel))
+            else:
+                mean_prod = b / (b - alpha) * (1 - 10 ** (-(b - alpha) * M_rel)) / (1 - 10 ** (-b * M_rel))
+            lag = (torch.arange(num_bins + 1, dtype=torch.float64) - 0.5).clamp_min(0.0) * dt
+            kernel = k * mean_prod * (
+                power_law_int(lag[1:] + c, lag[:-1] + c, p.item())
+            )  # (num_bins,)
+
+            # Fixed-point iteration counts = forcing + kernel * counts (causal convolution).
+            n_fft = 2 * num_bins
+            kernel_fft = torch.fft.rfft(kernel, n=n_fft)
+            counts = forcing
+            for num_iter in range(1, max_iter + 1):
+                triggered = torch.fft.irfft(torch.fft.rfft(counts, n=n_fft) * kernel_fft, n=n_fft)
+                new_counts = forcing + triggered[:num_bins].clamp_min(0.0)
+                change = (new_counts - counts).abs().max()
+                counts = new_counts
+                if change < tol * counts.sum().clamp_min(1.0):
+                    break
+
+        return DotDict(
+            edges=edges,
+            counts=counts,
+            rate=counts / dt,
+            cumulative=counts.cumsum(0),
+            num_iter=num_iter,
+        )
+
+    def evaluate_compensator(
         self,
         sequence: eq.data.SequenceIS,
         num_grid_points: int = 10, # Ngp
         eps: float = 1e-10,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Evaluate the cumulative survival function of seismicity (i.e., the compensator) for a given sequence.
+
+        Args:
+            sequence: Sequence of induced seismicity.
+            num_grid_points: Number of evenly-spaced interpolation points between events to evaluate the intensity on.
+            eps: Smallest amount of time after an event to to evaluate the intensity on.
+        Returns:
+            grid: The (interpolated) arrival times that the compensator was evaluated on.
+            compensator: The estimated compensator.
+        """
+        grid = self.get_grid(sequence, num_grid_points, eps)
+        compensator = self.get_intensity_index(sequence).compensator(grid)
+        return grid.float(), compensator.float()
+
+    @staticmethod
+    def get_grid(sequence: eq.data.SequenceIS, num_grid_points: int = 10, eps: float = 1e-10) -> torch.Tensor:
+        """ Evenly-spaced times between consecutive events (and t_end), as used by evaluate_*.
+
+        The points are interpolated between the event times themselves (not accumulated from
+        the inter-event times), so the last point of each interval is exactly the next event
+        time, which is then not counted as its own parent.
+        """
+        # Special case handling (evaluate only on the event times).
+        if num_grid_points == 0:
+            num_grid_points = 1
+            eps = 1
+        t = sequence.arrival_times.double()
+        t_prev = torch.cat([torch.tensor([sequence.t_start], dtype=torch.float64), t])  # (L,)
+        t_next = torch.cat([t, torch.tensor([sequence.t_end], dtype=torch.float64)])  # (L,)
+        weight = torch.linspace(eps, 1, num_grid_points, dtype=torch.float64)[:, None]  # (Ngp, 1)
+        # (lerp is exact at weight == 1)
+        grid = torch.lerp(t_prev.expand(num_grid_points, -1), t_next.expand(num_grid_points, -1), weight)
+        return grid.T.reshape(-1)  # (Ngp*L)
+
+    def evaluate_intensity(
+        self,
+        sequence: eq.data.SequenceIS,
+        num_grid_points: int = 0, # Ngp
+        eps: float = 1e-10,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """ Evaluate the rate of seismicity (i.e., the intensity) for a given sequence.
-            
+
+        By default (num_grid_points == 0), the intensity is only evaluated at the event times,
+        with the exact Omori kernel and the injection marks of the events (vm, sv, dTS), as in
+        loss. Otherwise, it is evaluated on the grid with the query index of get_intensity_index,
+        which uses the sum-of-exponentials approximation of the Omori kernel and the injection
+        schedule of the sequence (inj_* fields) instead of the event marks, so its values at the
+        event times can differ slightly from the ones with num_grid_points == 0.
+
         Args:
         sequence: Sequence of induced seismicity.
             num_grid_points: Number of evenly-spaced interpolation points between events to evaluate the intensity on.
@@ -271,29 +2187,32 @@ class ETAS_IS(TPPModel):
             grid: The (interpolated) arrival times that the intensity was evaluated on.
             intensity: The estimated intensity.
         """
+        if num_grid_points > 0:
+            grid = self.get_grid(sequence, num_grid_points, eps)
+            intensity = self.get_intensity_index(sequence).intensity(grid)
+            return grid.float(), intensity.float()
+
         # Intensity rate from the background process.
         rate_backg = self.mu
         
         # Prep for aftershock intensity decay.
         t = sequence.arrival_times.unsqueeze(0)
         fake_mask = torch.ones_like(t)
-        t_select, intensity_mask = masked_select_per_row(t, fake_mask)
-        delta_t = t_select.unsqueeze(-1) - t.unsqueeze(-2)  # (B, S, L)
-        prev_mask = (delta_t > 0).float()  # (B, S, L)
+        (t_select, v_select, sv_select, dTS_select), intensity_mask = masked_select_fields(
+            fake_mask, t, sequence.vm.unsqueeze(0), sequence.sv.unsqueeze(0), sequence.dTS.unsqueeze(0)
+        )
 
         # Intensity rate from the earthquake aftershock process.
-        omori = (delta_t * prev_mask + self.c).pow(-self.p)  # (B, S, L)
         productivity = self.k * 10 ** (self.alpha * (sequence.mag - sequence.mag_completeness))  # (B, L)
-        rate_omori = (omori * productivity.unsqueeze(-2) * prev_mask).sum(-1)
+        rate_omori = self.get_omori_rate(t_select, t, productivity.expand_as(t))  # (B, S)
 
         # Intensity rate from the injection driven process.
-        v_select = masked_select_per_row(sequence.vm.unsqueeze(0), fake_mask)[0]
-        v_mask = (masked_select_per_row(sequence.sv.unsqueeze(0), fake_mask)[0]==1).float()
+        v_mask = (sv_select==1).float()
         rate_drive = torch.pow(10, v_select.clamp(-10,10) + self.SI ) * v_mask
 
         # Intensity rate from the shut-in trailing seismicity process.
-        dt_trail =  torch.pow(10, masked_select_per_row(sequence.dTS.unsqueeze(0), fake_mask)[0].clamp(-10,10) )
-        t_mask = (masked_select_per_row(sequence.sv.unsqueeze(0), fake_mask)[0]==0).float()
+        dt_trail =  torch.pow(10, dTS_select.clamp(-10,10) )
+        t_mask = (sv_select==0).float()
         trail = (dt_trail  + self.ct).pow(-self.pt)
         k_trail = self.kt
         rate_trail = k_trail * trail * t_mask
@@ -304,6 +2223,158 @@ class ETAS_IS(TPPModel):
         # Return the intensity.
         return (t.squeeze(0), intensity.squeeze(0))
 
+    def forecast_rolling(
+        self,
+        sequence: eq.data.SequenceIS,
+        origins: Union[torch.Tensor, np.ndarray, list],
+        horizon: float,
+        num_samples: int = 1000,
+        random_state: int = 123,
+        max_length: Optional[int] = 50_000,
+        use_injection: bool = True,
+    ) -> DotDict:
+        """ Rolling-origin forecasts of a sequence, each conditioned on the events before its origin.
+
+        The aftershock rates of the past events at all the origins are read from a single
+        ETASIntensityIndex (sum-of-exponentials state), so each window is simulated with
+        simulate_branching without rescanning the catalog before its origin.
+
+        Args:
+            sequence: Sequence of induced seismicity.
+            origins: Forecast origin times.
+            horizon: Length of the forecast window after each origin.
+            num_samples: Number of simulated catalogs for each origin.
+            random_state: Random seed, specified for reproducibility.
+            max_length: If not None, simulations with more than this many events are discarded.
+            use_injection: If True, the injection-driven and trailing immigrants of each window
+                are drawn from the injection schedule of the sequence.
+
+        Returns:
+            forecast: DotDict with the origins (O,), the simulated event counts (O, num_samples),
+                where discarded simulations have count -1, the largest simulated magnitude
+                (O, num_samples), NaN if there are no events, and the observed counts (O,)
+        """
+        origins = np.sort(np.asarray(origins, dtype=np.float64))
+        M_c = float(sequence.mag_completeness)
+        params = {name: float(getattr(self, name).detach()) for name in ['mu', 'k', 'alpha', 'c', 'p']}
+        params.update(b=float(self.b), M_c=M_c, max_length=max_length)
+        SI, pt, ct, kt = [float(getattr(self, name).detach()) for name in ['SI', 'pt', 'ct', 'kt']]
+
+        # Aftershock rate of the events before each origin, as amplitudes of exponential terms.
+        index = self.get_intensity_index(sequence, t_max=float(origins[-1]) + horizon)
+        amplitudes = index.omori_state(origins).numpy()  # (O, K)
+        rates = index.rates.numpy()
+
+        injection = None
+        if use_injection and 'inj_time' in sequence:
+            injection = get_injection_schedule(sequence)
+            inj_time = injection['inj_time']
+
+        counts = np.zeros((len(origins), num_samples), dtype=np.int64)
+        max_mag = np.full((len(origins), num_samples), np.nan)
+        seeds = np.random.SeedSequence(random_state).spawn(len(origins))
+        for i, t_start in enumerate(origins):
+            t_end = t_start + horizon
+            segments = None
+            if injection is not None:
+                # Only the part of the schedule inside the window is needed.
+                lo = max(np.searchsorted(inj_time, t_start) - 1, 0)
+                hi = np.searchsorted(inj_time, t_end) + 1
+                window = {key: value[lo:hi] for key, value in injection.items()}
+                window = hold_injection_schedule(window, t_start, t_end)
+                segments = injection_segments(
+                    *window.values(), t_start, t_end, SI=SI, pt=pt, ct=ct, kt=kt
+                )
+            sim_id, times, mags, valid = simulate_branching(
+                seeds[i], num_samples, t_start, t_end, segments=segments,
+                past_components=(amplitudes[i], rates), **params,
+            )
+            counts[i] = np.where(valid, np.bincount(sim_id, minlength=num_samples), -1)
+            np.fmax.at(max_mag[i], sim_id, mags)
+
+        arrival_times = sequence.arrival_times.double().numpy()
+        observed = np.searchsorted(arrival_times, origins + horizon, side='right') - np.searchsorted(
+            arrival_times, origins, side='right'
+        )
+        return DotDict(origins=origins, counts=counts, max_mag=max_mag, observed=observed)
+
+    def sample_injection(
+        self,
+        injection: Union[eq.data.SequenceIS, dict],
+        batch_size: int,
+        t_start: Optional[float] = None,
+        t_end: Optional[float] = None,
+        past_seq: Optional[eq.data.SequenceIS] = None,
+        random_state: int = 123,
+        max_length: Optional[int] = 50_000,
+        t_max: float = 1e10,
+        n_jobs: int = 1,
+        chunk_size: int = 1000,
+        return_sequences: bool = False,
+        mag_completeness: float = 0.0,
+    ) -> Union[eq.data.BatchIS, List[eq.data.SequenceIS]]:
+        """ Generate a sample from the model under a (planned) injection schedule.
+
+        Unlike sample and sample_thinning, the injection-driven (SI) and shut-in trailing
+        (pt, ct, kt) immigrants are simulated as well. They are drawn by inverting the
+        piecewise-integrated rates of the schedule (see injection_segments), and the branching
+        cascade of all the immigrants is then simulated with simulate_branching.
+
+        Args:
+            injection: Injection schedule with the fields inj_time, inj_rate, inj_sign and
+                inj_tsgn (e.g., a SequenceIS). The first and last injection states are held
+                before and after the schedule.
+            batch_size: Number of sequences to generate.
+            t_start: Start of the simulated interval. Defaults to past_seq.t_end if past_seq
+                is provided, and to the first injection time otherwise.
+            t_end: End of the simulated interval. Defaults to the last injection time.
+            past_seq: If provided, events are sampled conditioned on the past sequence.
+            random_state: Random seed, specified for reproducibility.
+            max_length: If not None, discards samples with more than this many events.
+            t_max: Maximum time since parent at which an aftershock can be produced.
+            n_jobs: Number of jobs that run sampling in parallel. -1 uses all cores.
+            chunk_size: Number of sequences simulated together.
+            return_sequences: If True, returns samples as List[eq.data.SequenceIS].
+                If False, returns samples as eq.data.BatchIS.
+            mag_completeness: magnitude of completeness, used if past_seq is not provided.
+
+        Returns:
+            batch: Sequences generated from the model, with the injection fields of the schedule
+                and the injection marks (vm, sv, dTS, Vc) of each event.
+        """
+        injection = get_injection_schedule(injection)
+        inj_time = injection['inj_time']
+        if past_seq is not None:
+            t_start = float(past_seq.t_end)
+            M_c = float(past_seq.mag_completeness)
+        else:
+            M_c = float(mag_completeness)
+        t_start = float(inj_time[0]) if t_start is None else t_start
+        t_end = float(inj_time[-1]) if t_end is None else t_end
+        if t_start >= t_end:
+            raise ValueError(f"t_start must be < t_end (got {t_start} and {t_end})")
+
+        injection = hold_injection_schedule(injection, t_start, t_end)
+
+        # Determine the branching ratio (and assert that it is smaller than one)
+        branch = branching_ratio(
+            k=float(self.k.detach()) * omori_int(0, t_max, float(self.c.detach()), float(self.p.detach())),
+            b=float(self.b), alpha=float(self.alpha.detach()), M_min=M_c, M_max=10,
+        )
+        if branch > 1:
+            raise ValueError(
+                f"The process is explosive: branching ratio {branch:.2f} is > 1."
+            )
+
+        sequences = self._sample_vectorized(
+            batch_size, t_start, t_end, past_seq, random_state, max_length, t_max, n_jobs,
+            chunk_size, M_c, injection=injection,
+        )
+        if return_sequences:
+            return sequences
+        else:
+            return eq.data.BatchIS.from_list(sequences)
+
     def sample_thinning(
         self,
         batch_size: int,
@@ -315,6 +2386,8 @@ class ETAS_IS(TPPModel):
         n_jobs: int = -1,
         return_sequences: bool = False,
         verbose: bool = False,
+        mag_completeness: float = 0.0,
+        memory_window: Optional[float] = None,
     ) -> Union[eq.data.BatchIS, List[eq.data.SequenceIS]]:
         """ Generate a sample from the model (conditional or unconditional).
 
@@ -332,17 +2405,80 @@ class ETAS_IS(TPPModel):
             n_jobs: Number of jobs that run sampling in parallel. -1 uses all cores.
             return_sequences: if true, returns samples as list[eq.data.sequence].
                 if false, returns samples as eq.data.batch.
+            mag_completeness: magnitude of completeness, used if past_seq is not provided.
+            memory_window: if not None, only events at most this long before a candidate point
+                contribute to its intensity (truncated power-law kernel, exact kernel only).
+                Keeps the cost of each candidate bounded for long sequences.
         """
         p, c, mu, k, alpha = [
             param.cpu().detach().numpy()
             for param in [self.p, self.c, self.mu, self.k, self.alpha]
         ]
+        if past_seq is not None:
+            M_c = float(past_seq.mag_completeness)
+        else:
+            M_c = float(mag_completeness)
+        # (the samples start at the end of past_seq, see sample_single_seq)
+        t_sample = float(past_seq.t_end) if past_seq is not None else t_start
+        fields = schedule_fields(
+            past_schedule(past_seq, t_sample, t_sample + duration), t_sample, t_sample + duration, M_c
+        )
 
-        def get_intensity(t: float, t_past: np.ndarray, mag_past: np.ndarray):
-            """Compute the intesity at time t given past events and magnitudes."""
-            omori = (t - t_past + c) ** (-p)
-            productivity = k * 10 ** (alpha * (mag_past - float(self.M_c)))
-            return (omori * productivity).sum() + mu
+        # The SOE kernel keeps a running sum of each exponential term instead of the full past.
+        if self.omori_kernel == 'soe':
+            t_first = float(past_seq.t_start) if past_seq is not None else t_start
+            t_span = (float(past_seq.t_end) if past_seq is not None else t_start) + duration - t_first
+            soe_rates = self.get_soe_rates(max(t_span, 1.0))
+            soe_weights = soe_omori_log_weights(self.c.detach(), self.p.detach(), soe_rates).exp().numpy()
+            soe_rates = soe_rates.numpy()
+
+        class EventBuffer:
+            """Growable float64 buffers of arrival times and productivities (amortized O(1) append)."""
+
+            def __init__(self, times: np.ndarray, prods: np.ndarray):
+                self.size = len(times)
+                capacity = max(2 * self.size, 1024)
+                self.times = np.empty(capacity, dtype=np.float64)
+                self.prods = np.empty(capacity, dtype=np.float64)
+                self.times[:self.size] = times
+                self.prods[:self.size] = prods
+                self.start = 0  # first event inside the memory window
+
+            def append(self, t: float, prod: float):
+                if self.size == len(self.times):
+                    self.times = np.concatenate([self.times, np.empty_like(self.times)])
+                    self.prods = np.concatenate([self.prods, np.empty_like(self.prods)])
+                self.times[self.size] = t
+                self.prods[self.size] = prod
+                self.size += 1
+
+        def get_intensity(t: float, events: EventBuffer, state=None):
+            """Compute the intesity at time t given the past events (or the SOE kernel state)."""
+            if state is not None:
+                # Decay the exponential terms from the last event to time t.
+                return (soe_weights * state['A'] * np.exp(-soe_rates * (t - state['t']))).sum() + mu
+            if memory_window is not None:
+                # Events leave the truncated window in order, so a moving pointer suffices.
+                while events.start < events.size and t - events.times[events.start] > memory_window:
+                    events.start += 1
+            t_past = events.times[events.start:events.size]
+            prod_past = events.prods[events.start:events.size]
+            return (prod_past * (t - t_past + c) ** (-p)).sum() + mu
+
+        def init_state(t: float, events: EventBuffer):
+            """Initialize the SOE kernel state at time t (None for the exact kernel)."""
+            if self.omori_kernel != 'soe':
+                return None
+            t_past = events.times[:events.size]
+            decay = np.exp(-soe_rates * (t - t_past)[:, None])  # (N, K)
+            return dict(A=(events.prods[:events.size, None] * decay).sum(0), t=t)
+
+        def update_state(state, t: float, prod: float):
+            """Add a new event at time t to the SOE kernel state."""
+            if state is not None:
+                state['A'] = state['A'] * np.exp(-soe_rates * (t - state['t']))
+                state['A'] += prod
+                state['t'] = t
 
         def bernoulli(success_proba: float):
             if success_proba < 0 or success_proba > 1:
@@ -354,59 +2490,65 @@ class ETAS_IS(TPPModel):
             np.random.seed(seed)
             if past_seq is not None:
                 # Recompute the arrival times in float64 precision
-                past_tau = past_seq.inter_times.cpu().numpy().copy()
+                past_tau = past_seq.inter_times.cpu().numpy().astype(np.float64)
                 arrival_times = np.cumsum(past_tau[:-1]) + past_seq.t_start
-                magnitudes = past_seq.mag.cpu().numpy().copy()
+                magnitudes = past_seq.mag.cpu().numpy().astype(np.float64)
                 t_start = float(past_seq.t_end)
             else:
                 arrival_times = np.array([], dtype=np.float64)
                 magnitudes = np.array([], dtype=np.float64)
                 t_start = t_start
+            num_past = len(arrival_times)
+            events = EventBuffer(arrival_times, k * 10 ** (alpha * (magnitudes - M_c)))
+            new_magnitudes = []
             t_current = t_start
             t_end = t_start + duration
+            state = init_state(t_current, events)
             # upper bound on the intensity - used to generate candidate events
-            upper_bound = get_intensity(t_current, arrival_times, magnitudes)
-            tau_current = 0.0
-            inter_times = []
+            # (the intensity only decreases between events, so the intensity right after the
+            # last candidate or event is a tight upper bound until the next event)
+            upper_bound = get_intensity(t_current, events, state)
             while True:
                 tau = np.random.exponential(1.0 / upper_bound)
-                tau_current += tau
                 t_current = t_current + tau
                 if t_current > t_end:
                     break
 
-                lambda_current = get_intensity(t_current, arrival_times, magnitudes)
+                lambda_current = get_intensity(t_current, events, state)
                 p_accept = lambda_current / upper_bound
                 if verbose:
                     print(
                         f"\nCandidate event at {t_current:.3f}, acceptance prob = {p_accept:.2f}",
                         end="",
                     )
-                if bernoulli(p_accept):
-                    arrival_times = np.append(arrival_times, t_current)
-                    magnitudes = np.append(
-                        magnitudes,
-                        gen_mag(b=float(self.b), M_min=float(self.M_c)),
-                    )
-                    inter_times.append(tau_current)
-                    tau_current = 0.0
-                    if verbose:
-                        print(f" -> accepted (mag = {magnitudes[-1]:.2f})", end="")
                 # Update the upper bound for the next event
-                upper_bound = get_intensity(t_current, arrival_times, magnitudes)
-                if len(inter_times) > max_length:
+                upper_bound = lambda_current
+                if bernoulli(min(p_accept, 1.0)):
+                    mag = gen_mag(b=float(self.b), M_min=M_c)[0]
+                    prod = k * 10 ** (alpha * (mag - M_c))
+                    events.append(t_current, prod)
+                    new_magnitudes.append(mag)
+                    if state is not None:
+                        update_state(state, t_current, prod)
+                        upper_bound = get_intensity(t_current, events, state)
+                    else:
+                        upper_bound += prod * c ** (-p)
+                    if verbose:
+                        print(f" -> accepted (mag = {mag:.2f})", end="")
+                if len(new_magnitudes) > max_length:
                     print(
                         "Stopping generation since max_length exceeded (likely explosive process)."
                     )
                     return None
 
+            new_times = events.times[num_past:events.size]
+            inter_times = np.diff(new_times, prepend=t_start, append=t_end)
             # Use max to avoid numerical errors
-            inter_times = np.append(inter_times, max(duration - np.sum(inter_times), 0))
-            valid_idx = (arrival_times > t_start) & (arrival_times <= t_end)
+            inter_times[-1] = max(inter_times[-1], 0)
             return dict(
                 inter_times=inter_times,
                 t_start=t_start,
-                mag=magnitudes[valid_idx],
+                mag=np.array(new_magnitudes, dtype=np.float64),
             )
 
         sequences = []
@@ -421,15 +2563,73 @@ class ETAS_IS(TPPModel):
                 for seed in trange(random_state, num_seq_to_generate + random_state)
             )
             filtered = [
-                eq.data.SequenceIS(**seq) for seq in new_sequences if seq is not None
+                eq.data.SequenceIS(**seq, **fields) for seq in new_sequences if seq is not None
             ]
             sequences.extend(filtered)
+            # Discarded sequences are replaced with new seeds
+            random_state += num_seq_to_generate
 
         if return_sequences:
             return sequences
         else:
             return eq.data.BatchIS.from_list(sequences)
 
+    def _sample_vectorized(
+        self, batch_size, t_start, t_end, past_seq, random_state, max_length, t_max, n_jobs,
+        chunk_size, M_c, injection=None, schedule=None,
+    ):
+        """ Simulate sequences in groups with simulate_branching (see sample and sample_injection).
+
+        The returned sequences carry the injection schedule (of injection, which drives the
+        simulation, or else of schedule) over [t_start, t_end] and the magnitude of completeness.
+        """
+        params = {name: float(getattr(self, name).detach()) for name in ['mu', 'k', 'alpha', 'c', 'p']}
+        params.update(b=float(self.b), M_c=M_c, t_max=t_max, max_length=max_length)
+        if injection is not None:
+            SI, pt, ct, kt = [float(getattr(self, name).detach()) for name in ['SI', 'pt', 'ct', 'kt']]
+            params['segments'] = injection_segments(
+                *injection.values(), t_start, t_end, SI=SI, pt=pt, ct=ct, kt=kt
+            )
+        if past_seq is not None:
+            # Recompute the arrival times in float64 precision
+            past_tau = past_seq.inter_times.cpu().numpy().astype(np.float64)
+            params['past_times'] = np.cumsum(past_tau[:-1]) + float(past_seq.t_start)
+            params['past_mags'] = past_seq.mag.cpu().numpy().astype(np.float64)
+
+        # The injection fields of the returned sequences cover [t_start, t_end]
+        fields = schedule_fields(injection if injection is not None else schedule, t_start, t_end, M_c)
+
+        seed_seq = np.random.SeedSequence(random_state)
+        sequences = []
+        # The workers only run numpy code, so each of them is limited to a single thread
+        with parallel_backend('loky', inner_max_num_threads=1):
+            while len(sequences) < batch_size:
+                num_remaining = batch_size - len(sequences)
+                chunks = [min(chunk_size, num_remaining - i) for i in range(0, num_remaining, chunk_size)]
+                results = Parallel(n_jobs=min(n_jobs, len(chunks)) if n_jobs > 0 else n_jobs)(
+                    delayed(simulate_branching)(child, num_sims, t_start, t_end, **params)
+                    for child, num_sims in zip(seed_seq.spawn(len(chunks)), chunks)
+                )
+                for sim_id, times, mags, valid in results:
+                    marks = dict(mag=mags)
+                    if injection is not None:
+                        marks.update(injection_marks(times, *injection.values()))
+                    bounds = np.searchsorted(sim_id, np.arange(len(valid) + 1))
+                    for i in np.flatnonzero(valid):
+                        arrival_times = times[bounds[i]:bounds[i + 1]]
+                        seq_marks = {key: value[bounds[i]:bounds[i + 1]] for key, value in marks.items()}
+                        seq_marks.update(fields)
+                        sequences.append(
+                            eq.data.SequenceIS(
+                                inter_times=np.diff(arrival_times, prepend=t_start, append=t_end),
+                                t_start=t_start,
+                                **seq_marks,
+                            )
+                        )
+                    if (~valid).any():
+                        print(f"Exceeded {max_length} events, discarded {(~valid).sum()} sequences")
+        return sequences[:batch_size]
+
     def sample(
         self,
         batch_size: int,
@@ -441,6 +2641,9 @@ class ETAS_IS(TPPModel):
         t_max: float = 1e10,  # maximum duration of the aftershock sequence. Important for p close to 1.
         n_jobs: int = -1,
         return_sequences: bool = False,
+        mag_completeness: float = 0.0,
+        vectorized: bool = False,
+        chunk_size: int = 1000,
     ) -> Union[eq.data.BatchIS, List[eq.data.SequenceIS]]:
         """ Generate a sample from the model (conditional or unconditional).
 
@@ -456,18 +2659,27 @@ class ETAS_IS(TPPModel):
             n_jobs: Number of jobs that run sampling in parallel. -1 uses all cores.
             return_sequences: If True, returns samples as List[eq.data.SequenceIS].
                 If False, returns samples as eq.data.BatchIS.
+            mag_completeness: magnitude of completeness, used if past_seq is not provided.
+            vectorized: If True, simulates the sequences in groups of chunk_size with
+                simulate_branching (one task per group, with np.random.Generator streams
+                spawned from random_state), instead of one task per sequence.
+            chunk_size: Number of sequences simulated together when vectorized is True.
 
         Returns:
-            batch: Sequences generated from the model.
+            batch: Sequences generated from the model, with the magnitude of completeness and
+                the injection schedule of past_seq held over the interval (empty if there is none).
         """
-        p, c, mu, k, alpha, b, M_c = [
+        p, c, mu, k, alpha = [
             param.cpu().detach().numpy()
-            for param in [self.p, self.c, self.mu, self.k, self.alpha, self.b, self.M_c]
+            for param in [self.p, self.c, self.mu, self.k, self.alpha]
         ]
+        b = float(self.b)
         if past_seq is not None:
             t_start = float(past_seq.t_end)
+            M_c = float(past_seq.mag_completeness)
         else:
             t_start = t_start
+            M_c = float(mag_completeness)
 
         # Determine the branching ratio (and assert that it is smaller than one)
         branch = branching_ratio(k=k, b=b, alpha=alpha, M_min=M_c, M_max=10)
@@ -476,6 +2688,10 @@ class ETAS_IS(TPPModel):
                 f"The process is explosive: branching ratio {branch:.2f} is > 1."
             )
 
+        # Injection schedule (of past_seq, held) and magnitude of completeness of the samples.
+        schedule = past_schedule(past_seq, t_start, t_start + duration)
+        fields = schedule_fields(schedule, t_start, t_start + duration, M_c)
+
         def sample_single_seq(seed):
             np.random.seed(seed)
             if past_seq is not None:
@@ -506,7 +2722,6 @@ class ETAS_IS(TPPModel):
                 if len(parent_catalog) > 0
                 else background_catalog
             )
-            offspring_catalog = []
             whole_catalog = []
             generation = 0
 
@@ -535,46 +2750,29 @@ class ETAS_IS(TPPModel):
                     prod * omori_int(TAU1, TAU2, c, p) / omori_int(0, t_max, c, p)
                 )
 
-                # to streamline things we only consider the events that do have aftershocks
+                # Each offspring is drawn with the time window of its own parent, so the whole
+                # generation is sampled at once by repeating the parents by their offspring counts
                 N_aftershock = np.random.poisson(prod_in_interval)
-                I = N_aftershock != 0
-                short_parent_catalog = parent_catalog[I, :]
-                short_N_aftershock = N_aftershock[I]
-
-                for ieq, iNaft, itau1, itau2 in zip(
-                    short_parent_catalog, short_N_aftershock, TAU1[I], TAU2[I]
-                ):
-
-                    # The cdf follows of the time distributions follows the integral of
-                    # omori's law normalized by the integral out to infinity. Provided the
-                    # temporal decay (p-value) is greater than 1 (p>1), the integral converges
-                    # the inverse cdf can be used to generate random times:
-
-                    t_parent = ieq[0]  # parent event time
-
-                    dti = omori_inv(itau1, itau2, c, p, size=iNaft, t_max=t_max)
-                    t_aftershock = t_parent + dti  # new arrival time
-
-                    aftershock_catalog = []
-                    aftershock_catalog.append(t_aftershock)
-
-                    # ...and magnitudes
-                    m_aftershock = gen_mag(iNaft, b=b, M_min=M_c)
-                    aftershock_catalog.append(m_aftershock)
-
-                    aftershock_catalog = np.column_stack(aftershock_catalog)
+                parent_idx = np.repeat(np.arange(len(parent_catalog)), N_aftershock)
+                num_offspring = len(parent_idx)
+                if num_offspring == 0:
+                    break
 
-                    # Tack on the aftershock sequence to the catalog of offsprings
-                    offspring_catalog.append(aftershock_catalog)
+                # The cdf follows of the time distributions follows the integral of
+                # omori's law normalized by the integral out to infinity. Provided the
+                # temporal decay (p-value) is greater than 1 (p>1), the integral converges
+                # the inverse cdf can be used to generate random times:
+                dti = omori_inv(
+                    TAU1[parent_idx], TAU2[parent_idx], c, p, size=num_offspring, t_max=t_max
+                )
+                t_aftershock = parent_catalog[parent_idx, 0] + dti  # new arrival time
 
-                if not offspring_catalog:
-                    break
+                # ...and magnitudes
+                m_aftershock = gen_mag(num_offspring, b=b, M_min=M_c)
+                offspring_catalog = np.column_stack((t_aftershock, m_aftershock))
 
-                # make offspring catalog
-                offspring_catalog = np.vstack(offspring_catalog)
                 generation += 1
                 parent_catalog = offspring_catalog
-                offspring_catalog = []
                 # Stop generation if the event sequence is too long
                 num_generated += len(parent_catalog)
                 if max_length is not None and num_generated > max_length:
@@ -596,8 +2794,19 @@ class ETAS_IS(TPPModel):
                 inter_times=inter_times,
                 t_start=t_start,
                 mag=fc_magnitudes,
+                **fields,
             )
 
+        if vectorized:
+            sequences = self._sample_vectorized(
+                batch_size, t_start, t_start + duration, past_seq, random_state, max_length,
+                t_max, n_jobs, chunk_size, M_c, schedule=schedule,
+            )
+            if return_sequences:
+                return sequences
+            else:
+                return eq.data.BatchIS.from_list(sequences)
+
         sequences = []
         # Keep generating sequences in groups of size (batch_size - len(sequences)) until batch_size is reached
         # Some sequences might be too long because of explosiveness - these are filtered out
@@ -620,6 +2829,256 @@ class ETAS_IS(TPPModel):
             return eq.data.BatchIS.from_list(sequences)
 
 
+class ETASOnlineFitter:
+    """ Online (warm-started) re-fitting of ETAS_IS as new events stream in.
+
+    The NLL of the events seen so far is summarized by its second-order expansion around the
+    last estimate (cached value, gradient and Hessian w.r.t. the raw parameters). An update
+    only computes the terms of the new events, i.e. their intensities (with all the previous
+    events as parents, in causal row blocks) and the increments of the compensator, and runs
+    a few warm-started L-BFGS steps on the sum. The expansion is then moved to the new
+    estimate.
+
+    Note that the NLL of the previous events is therefore approximate (the Omori sums depend
+    non-linearly on p, c and alpha, so they cannot be cached exactly), and its error grows with
+    the distance from the point of expansion. If an update moves any raw parameter by more
+    than trust_radius, the fitter falls back to refresh(), which refits on the full catalog
+    and recomputes the expansion exactly.
+
+    Args:
+        model: ETAS_IS model, updated in place.
+        sequence: Sequence of induced seismicity observed so far.
+        refit: Whether to fit the model to the sequence first (otherwise its current
+            parameters are used as the estimate).
+        max_iter: Maximum number of optimizer iterations of each update.
+        tol: Convergence tolerance on the gradient (max-norm) and on the change of the loss.
+        trust_radius: Largest change of a raw parameter for which an update keeps the
+            expansion (otherwise the model is refitted on the full catalog).
+    """
+
+    event_fields = ['mag', 'vm', 'sv', 'dTS', 'Vc']
+
+    def __init__(self, model, sequence, refit=True, max_iter=20, tol=1e-6, trust_radius=0.25):
+        self.model = model
+        self.max_iter = max_iter
+        self.tol = tol
+        self.trust_radius = trust_radius
+        self.chunks = [sequence]
+        self.refresh(refit=refit)
+
+    @property
+    def sequence(self) -> eq.data.SequenceIS:
+        """ Full sequence observed so far."""
+        if len(self.chunks) > 1:
+            chunks = self.chunks
+            first, last = chunks[0], chunks[-1]
+            arrival_times = torch.cat([chunk.arrival_times for chunk in chunks])
+            fields = {
+                key: torch.cat([chunk[key] for chunk in chunks])
+                for key in first.keys()
+                if key not in first.default_sequence_attrs or key.startswith('inj_')
+            }
+            # (computed in torch, so the inter-event times keep the dtype of the chunks)
+            inter_times = torch.diff(
+                arrival_times,
+                prepend=arrival_times.new_tensor([first.t_start]),
+                append=arrival_times.new_tensor([last.t_end]),
+            )
+            self.chunks = [
+                eq.data.SequenceIS(
+                    inter_times=inter_times,
+                    t_start=first.t_start,
+                    t_nll_start=first.t_nll_start,
+                    mag_completeness=first.mag_completeness,
+                    **fields,
+                )
+            ]
+        return self.chunks[0]
+
+    def refresh(self, refit=True) -> dict:
+        """ (Re)fit the model on the full sequence, and compute the exact expansion of its NLL."""
+        model = self.model
+        sequence = self.sequence
+        batch = eq.data.BatchIS.from_list([sequence])
+        diagnostics = model.fit(batch, tol=self.tol) if refit else {}
+
+        # Cached sufficient statistics of the events seen so far.
+        nll = model.loss(batch).sum() * batch.end_idx.sum()
+        grad, hessian = model._grad_hessian(nll)
+        self.set_expansion(nll.detach(), grad, hessian)
+        self.t = sequence.arrival_times
+        self.mag_rel = sequence.mag - sequence.mag_completeness
+        self.t_end = sequence.t_end
+        self.Vc_max = batch.Vc.max()
+        self.dt_trail_max = torch.pow(10, sequence.dTS.clamp(-10, 10)).max()
+        return diagnostics
+
+    def set_expansion(self, nll, grad, hessian, min_curvature=1e-3):
+        """ Cache the expansion of the NLL of the events seen so far at the current parameters.
+
+        The Hessian is projected onto the positive definite matrices (eigenvalues of at least
+        min_curvature times the largest one), so the expansion is convex and bounded below even
+        for parameters sitting on their clamp, where the NLL is flat.
+        """
+        eigvals, eigvecs = torch.linalg.eigh(0.5 * (hessian + hessian.T))
+        eigvals = eigvals.clamp_min(min_curvature * eigvals.abs().max().clamp_min(1e-12))
+        self.nll, self.grad = nll, grad
+        self.hessian = eigvecs @ torch.diag(eigvals) @ eigvecs.T
+        self.raw_params = torch.cat([param.detach().reshape(1) for param in self.model.parameters()])
+
+    def update(self, new_seq: eq.data.SequenceIS, verbose: bool = False) -> dict:
+        """ Append the events of new_seq (which starts at the current t_end) and update the fit.
+
+        Returns:
+            diagnostics: Dictionary with the updated parameters, the (approximate) mean NLL and
+                gradient norm, the number of iterations and loss evaluations, the loss history,
+                whether the optimizer converged, whether the model was refitted on the full
+                catalog (refreshed), the number of events and the run time (seconds).
+        """
+        t0 = time.time()
+        model = self.model
+        if abs(new_seq.t_start - self.t_end) > 1e-6 * max(abs(self.t_end), 1.0):
+            raise ValueError(f"new_seq must start at t_end = {self.t_end} (got {new_seq.t_start})")
+
+        # Event-only quantities of the new events (targets) and of all the parents.
+        t = torch.cat([self.t, new_seq.arrival_times]).unsqueeze(0)  # (1, L)
+        mag_rel = torch.cat([self.mag_rel, new_seq.mag - self.chunks[0].mag_completeness]).unsqueeze(0)
+        t_select = new_seq.arrival_times.unsqueeze(0)  # (1, S)
+        v_select = new_seq.vm.clamp(-10, 10).unsqueeze(0)
+        v_mask = (new_seq.sv == 1).float().unsqueeze(0)
+        t_mask = (new_seq.sv == 0).float().unsqueeze(0)
+        dt_trail = torch.pow(10, new_seq.dTS.clamp(-10, 10)).unsqueeze(0)
+        Vc_max = torch.cat([self.Vc_max.reshape(1), new_seq.Vc]).max()
+        dt_trail_max = torch.cat([self.dt_trail_max.reshape(1), dt_trail.flatten()]).max()
+        t_old, t_new = self.t_end, new_seq.t_end
+        num_events = t.shape[-1]
+        num_evals = 0
+
+        def objective():
+            nonlocal num_evals
+            num_evals += 1
+
+            # Second-order expansion of the NLL of the previous events.
+            delta = torch.cat([param.reshape(1) for param in model.parameters()]) - self.raw_params
+            nll = self.nll + self.grad @ delta + 0.5 * delta @ self.hessian @ delta
+
+            # Intensity of the new events.
+            mu, p, c, k, alpha, SI, pt, ct, kt = model.get_params()
+            productivity = k * 10 ** (alpha * mag_rel)  # (1, L)
+            rate_omori = model.get_omori_rate(t_select, t, productivity)
+            rate_drive = torch.pow(10, v_select + SI) * v_mask
+            rate_trail = kt * (dt_trail + ct).pow(-pt) * t_mask
+            nll = nll - torch.log(mu + rate_omori + rate_drive + rate_trail).sum()
+
+            # Increments of the integrated intensity from t_old to t_new.
+            one_minus_p = 1 - p
+            omori_int = (
+                (t_new - t + c).pow(one_minus_p) - ((t_old - t).clamp_min(0.0) + c).pow(one_minus_p)
+            ) / one_minus_p
+            one_minus_pt = 1 - pt
+            trail_int = (ct + self.dt_trail_max).pow(one_minus_pt) - (ct + dt_trail_max).pow(one_minus_pt)
+            nll = nll + mu * (t_new - t_old) + (omori_int * productivity).sum()
+            nll = nll + torch.pow(10, SI) * (torch.pow(10, Vc_max) - torch.pow(10, self.Vc_max))
+            nll = nll + (-kt / one_minus_pt) * trail_int
+            return nll / num_events
+
+        history = []
+        model.project_params()
+        num_iter = model._run_lbfgs(objective, history, self.max_iter, self.tol, verbose)
+
+        # Outside the trust region, the expansion is not accurate enough: refit on the full catalog.
+        raw_params = torch.cat([param.detach().reshape(1) for param in model.parameters()])
+        if (raw_params - self.raw_params).abs().max() > self.trust_radius:
+            self.chunks.append(new_seq)
+            fit = self.refresh(refit=True)
+            return dict(
+                method='online',
+                params={name: float(value.detach()) for name, value in zip(model.param_names, model.get_params())},
+                loss=fit['loss'],
+                grad_norm=fit['grad_norm'],
+                num_iter=num_iter + fit['num_iter'],
+                num_evals=num_evals + fit['num_evals'],
+                converged=fit['converged'],
+                history=history + fit['history'],
+                refreshed=True,
+                num_events=num_events,
+                time=time.time() - t0,
+            )
+
+        # Move the expansion to the new estimate, and append the new events.
+        mean_nll = objective()
+        grad, hessian = model._grad_hessian(mean_nll)
+        self.set_expansion(mean_nll.detach() * num_events, grad * num_events, hessian * num_events)
+        self.t, self.mag_rel = t.squeeze(0), mag_rel.squeeze(0)
+        self.t_end, self.Vc_max, self.dt_trail_max = t_new, Vc_max, dt_trail_max
+        self.chunks.append(new_seq)
+
+        grad_norm = float(grad.abs().max())
+        return dict(
+            method='online',
+            params={name: float(value.detach()) for name, value in zip(model.param_names, model.get_params())},
+            loss=mean_nll.item(),
+            grad_norm=grad_norm,
+            num_iter=num_iter,
+            num_evals=num_evals,
+            converged=grad_norm < self.tol or (len(history) > 1 and abs(history[-2] - history[-1]) < self.tol),
+            history=history,
+            refreshed=False,
+            num_events=num_events,
+            time=time.time() - t0,
+        )
+
+
+def get_select_index(mask):
+    """ Get the column indices of the masked entries of each row, left-aligned and padded.
+
+    The indices are built from a cumulative sum over the mask, so they can be computed once
+    per batch and shared by every field that is selected with the same mask.
+
+    Args:
+        mask: Boolean matrix indicating what entries must be selected, shape [M, N]
+
+    Returns:
+        select_idx: Column of the j-th selected entry in each row (0 for padding), shape [M, S]
+        new_mask: Float mask indicating what entries correspond to actual values, shape [M, S]
+    """
+    mask = mask.bool()
+    num_selected = mask.sum(-1)  # (M,)
+    max_selected = int(num_selected.max()) if mask.shape[0] > 0 else 0
+    position = torch.where(mask, mask.cumsum(-1) - 1, max_selected)  # (M, N)
+    columns = torch.arange(mask.shape[1], device=mask.device).expand_as(position)
+
+    # Scatter every selected column to its position; unselected ones land in a dummy column.
+    select_idx = torch.zeros(
+        mask.shape[0], max_selected + 1, dtype=torch.long, device=mask.device
+    )
+    select_idx.scatter_(-1, position, columns)
+    select_idx = select_idx[:, :max_selected]
+    new_mask = torch.arange(max_selected, device=mask.device) < num_selected.unsqueeze(-1)
+    return select_idx, new_mask.float()
+
+
+def gather_per_row(matrix, select_idx, new_mask):
+    """ Gather the selected entries of each row, with zero padding (see get_select_index)."""
+    selected = matrix.gather(-1, select_idx)
+    return torch.where(new_mask.bool(), selected, torch.zeros_like(selected))
+
+
+def masked_select_fields(mask, *matrices):
+    """ Perform the same masked select per row on several matrices at once.
+
+    Args:
+        mask: Boolean matrix indicating what entries must be selected, shape [M, N]
+        *matrices: 2-d tensors from which values must be selected, each with shape [M, N]
+
+    Returns:
+        selected: List with the padded selected entries of each matrix, each with shape [M, S]
+        new_mask: Float mask indicating what entries correspond to actual values, shape [M, S]
+    """
+    select_idx, new_mask = get_select_index(mask)
+    return [gather_per_row(matrix, select_idx, new_mask) for matrix in matrices], new_mask
+
+
 def masked_select_per_row(matrix, mask):
     """ Perform masked select on each row, and return the result as a padded tensor.
 
@@ -651,10 +3110,5 @@ def masked_select_per_row(matrix, mask):
                 [1., 1., 0.]])
     """
     assert matrix.shape == mask.shape and matrix.ndim == 2
-    selected_rows = []
-    for matrix_row, mask_row in zip(matrix, mask.bool()):
-        selected_rows.append(matrix_row.masked_select(mask_row))
-
-    new_matrix = pad_sequence(selected_rows)
-    new_mask = pad_sequence([torch.ones_like(s) for s in selected_rows])
-    return new_matrix, new_mask.float()
+    select_idx, new_mask = get_select_index(mask)
+    return gather_per_row(matrix, select_idx, new_mask), new_mask
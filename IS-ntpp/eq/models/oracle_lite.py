@@ -139,12 +139,37 @@ class OracleLite(TPPModel):
         supp_mark = supp_mark.clamp(-10, +10)
         return supp_mark.unsqueeze(-1)
 
+    @property
+    def required_marks(self):
+        # Supplementary marks read from the batch by get_marks.
+        marks = ['aRs']
+        if self.input_magnitude:
+            marks.append('mag')
+        if self.input_injection:
+            marks += ['vm', 'dVc', 'sv', 'dTS']
+        return marks + [mark for mark in self.supplementary_mark_list if mark not in marks]
+
     def get_marks(self, batch):
         """ Get and prepare the input marks for every event in the batch.
 
+        The marks are cached on the batch (see BatchIS.cached), and recomputed if the
+        normalization buffers or the flagged marks change.
+
         Returns:
             marks: The input marks, a tensor with shape (batch_size[B], seq_len[L], mark_size[Dm]).
         """
+        dependencies = (
+            self.log_tau_mean,
+            self.log_tau_std,
+            self.mag_mean,
+            self.input_magnitude,
+            self.input_injection,
+            tuple(self.supplementary_mark_list),
+        )
+        return batch.cached('OracleLite.get_marks', lambda: self._get_marks(batch), dependencies)
+
+    def _get_marks(self, batch):
+        # Compute the input marks returned by get_marks.
         # Create the input feature tensor from all of the flagged marks.
         mark_list = [self.prep_time_marks(batch.inter_times)]
         mark_list.append(self.prep_supp_marks(batch['aRs'],'aRs'))
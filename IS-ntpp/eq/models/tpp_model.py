@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import pytorch_lightning as pl
 import torch
@@ -11,6 +11,11 @@ class TPPModel(pl.LightningModule):
         super().__init__()
         self.save_hyperparameters()
 
+    @property
+    def required_marks(self) -> Optional[List[str]]:
+        """ Supplementary marks that the model reads from a batch (None = all of them)."""
+        return None
+
     def loss(self, batch: eq.data.BatchIS) -> torch.Tensor:
         """ Compute negative log-likelihood (NLL) for a batch of event sequences.
 
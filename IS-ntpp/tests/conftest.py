@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import torch
+
+from eq.data import SequenceIS
+
+
+def synthetic_sequence(num_events, seed=0, dtype=torch.float64, t_end=5000.0, arrival_times=None):
+    """ Random induced seismicity sequence with the marks and injection schedule of a catalog.
+
+    The arrival times are uniform, unless given (then num_events is their number)."""
+    rng = np.random.default_rng(seed)
+    t_start = 0.0
+    if arrival_times is None:
+        arrival_times = np.sort(rng.uniform(t_start + 1.0, t_end - 1.0, num_events))
+    num_events = len(arrival_times)
+    inter_times = np.diff(arrival_times, prepend=[t_start], append=[t_end])
+    num_inj = 2 * num_events + 3
+    inj_time = np.sort(rng.uniform(t_start, t_end, num_inj))
+    shut_in = 0.7 * t_end
+    return SequenceIS(
+        inter_times=torch.tensor(inter_times, dtype=dtype),
+        t_start=t_start,
+        mag_completeness=torch.tensor(0.5, dtype=torch.float64),
+        mag=torch.tensor(0.5 + rng.exponential(0.5, num_events), dtype=dtype),
+        vm=torch.tensor(rng.uniform(-2.0, 0.0, num_events), dtype=dtype),
+        sv=torch.tensor((arrival_times < shut_in).astype(float), dtype=dtype),
+        dTS=torch.tensor(np.log10(np.clip(arrival_times - shut_in, 1e-3, None)), dtype=dtype),
+        Vc=torch.tensor(np.linspace(-1.0, 0.5, num_events), dtype=dtype),
+        inj_time=torch.tensor(inj_time, dtype=dtype),
+        inj_rate=torch.tensor(rng.uniform(0.0, 1.0, num_inj), dtype=dtype),
+        inj_dvol=torch.tensor(rng.uniform(0.0, 1.0, num_inj), dtype=dtype),
+        inj_sign=torch.tensor((inj_time < shut_in).astype(float), dtype=dtype),
+        inj_tsgn=torch.tensor(np.log10(np.clip(inj_time - shut_in, 1e-3, None)), dtype=dtype),
+    )
+
+
+@pytest.fixture
+def make_sequence():
+    return synthetic_sequence
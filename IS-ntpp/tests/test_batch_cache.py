@@ -0,0 +1,44 @@
+import torch
+
+import eq
+from eq.data import BatchIS
+
+
+def test_cached_feature_is_reused_until_the_batch_changes(make_sequence):
+    batch = BatchIS.from_list([make_sequence(20, seed=0), make_sequence(8, seed=1)])
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return batch.mag * 2
+
+    first = batch.cached('double_mag', compute)
+    assert batch.cached('double_mag', compute) is first
+    assert len(calls) == 1
+
+    # An in-place edit of the batch and a new dependency value both invalidate the entry.
+    batch.mag.add_(1.0)
+    assert torch.equal(batch.cached('double_mag', compute), batch.mag * 2)
+    batch.cached('double_mag', compute, dependencies=(1.0,))
+    assert len(calls) == 3
+
+    batch.clear_cache()
+    assert '_feature_cache' not in batch.keys()
+    batch.cached('double_mag', compute, dependencies=(1.0,))
+    assert len(calls) == 4
+
+
+def test_cached_event_features_give_the_same_loss(make_sequence):
+    batch = BatchIS.from_list([make_sequence(20, seed=0), make_sequence(8, seed=1)])
+    model = eq.models.ETAS_IS().double()
+    loss = model.loss(batch)
+    assert torch.equal(model.loss(batch), loss)
+    batch.clear_cache()
+    assert torch.equal(model.loss(batch), loss)
+
+
+def test_features_requiring_grad_are_not_stored(make_sequence):
+    batch = BatchIS.from_list([make_sequence(20, seed=0)])
+    weight = torch.tensor(2.0, dtype=batch.mag.dtype, requires_grad=True)
+    first = batch.cached('weighted_mag', lambda: batch.mag * weight)
+    assert batch.cached('weighted_mag', lambda: batch.mag * weight) is not first
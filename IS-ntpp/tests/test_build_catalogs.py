@@ -0,0 +1,28 @@
+import shutil
+
+import torch
+
+import eq
+from eq.catalogs import is_cases
+from eq.data import InMemoryDataset, default_catalogs_dir
+
+
+def test_incremental_build(tmp_path, monkeypatch):
+    case_dir = tmp_path / 'Basel'
+    case_dir.mkdir()
+    for suffix in ['_Cat.csv', '_Hed.csv', '_Inj.csv']:
+        shutil.copy(default_catalogs_dir / 'Basel' / ('Basel' + suffix), case_dir)
+    monkeypatch.setattr(is_cases, 'default_catalogs_dir', tmp_path)
+
+    assert eq.catalogs.IScases.build_catalogs(n_jobs=1) == {'Basel': 'built'}
+    built = InMemoryDataset.load_from_disk(case_dir / 'full_sequence.pt')[0]
+    expected = InMemoryDataset.load_from_disk(default_catalogs_dir / 'Basel' / 'full_sequence.pt')[0]
+    for key, value in expected.items():
+        if isinstance(value, torch.Tensor):
+            assert torch.equal(built[key], value), key
+
+    # Only the cases whose csv inputs changed are rebuilt.
+    assert eq.catalogs.IScases.build_catalogs(n_jobs=1) == {'Basel': 'skipped'}
+    with open(case_dir / 'Basel_Hed.csv', 'a') as f:
+        f.write('\n')
+    assert eq.catalogs.IScases.build_catalogs(['Basel'], n_jobs=1) == {'Basel': 'built'}
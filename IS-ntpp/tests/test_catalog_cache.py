@@ -0,0 +1,26 @@
+import torch
+
+import eq
+
+
+def test_cached_catalog_modified_in_place_is_reloaded():
+    original = eq.catalogs.IScases('Basel').full_sequence.mag.clone()
+    view = eq.catalogs.IScases('Basel').full_sequence
+    view.mag.add_(1.0)
+
+    reloaded = eq.catalogs.IScases('Basel').full_sequence
+    assert torch.equal(reloaded.mag, original)
+    assert reloaded.mag.data_ptr() != view.mag.data_ptr()
+
+
+def test_sequence_views_are_shared_aliases():
+    first = eq.catalogs.IScases('Basel').full_sequence
+    second = eq.catalogs.IScases('Basel').full_sequence
+    assert first.mag.data_ptr() == second.mag.data_ptr()
+
+    first.t_nll_start = first.t_start + 1.0
+    assert second.t_nll_start != first.t_nll_start
+    first.mag.add_(1.0)
+    assert torch.equal(second.mag, first.mag)
+    # The cache is left consistent for the later lookups.
+    assert not torch.equal(eq.catalogs.IScases('Basel').full_sequence.mag, first.mag)
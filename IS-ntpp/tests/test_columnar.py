@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+from eq.data import load_columnar, save_columnar
+from eq.data.columnar import is_columnar
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(make_sequence, tmp_path, mmap):
+    sequence = make_sequence(50, seed=0)
+    save_columnar(sequence, tmp_path / "store")
+    assert is_columnar(tmp_path / "store")
+
+    loaded = load_columnar(tmp_path / "store", mmap=mmap, validate=True)
+    assert set(loaded.keys()) == set(sequence.keys())
+    for key, value in sequence.items():
+        if isinstance(value, torch.Tensor):
+            assert loaded[key].dtype == value.dtype, key
+            assert torch.equal(loaded[key], value), key
+        else:
+            assert loaded[key] == value, key
+
+
+def test_projected_and_half_precision_load(make_sequence, tmp_path):
+    sequence = make_sequence(50, seed=1)
+    save_columnar(sequence, tmp_path / "store", half_precision_marks=True)
+
+    loaded = load_columnar(tmp_path / "store", fields=['mag', 'vm'])
+    assert 'vm' in loaded and 'sv' not in loaded and 'inj_time' in loaded
+    # The times, magnitudes and injection schedule keep their precision.
+    assert torch.equal(loaded.arrival_times, sequence.arrival_times)
+    assert torch.equal(loaded.mag, sequence.mag)
+    assert loaded.vm.dtype == sequence.vm.dtype
+    assert torch.allclose(loaded.vm, sequence.vm, rtol=1e-3)
+
+    with pytest.raises(ValueError, match="fields must be a subset"):
+        load_columnar(tmp_path / "store", fields=['unknown'])
@@ -0,0 +1,44 @@
+import torch
+
+import eq
+from eq.data import BatchIS
+from eq.models.etasIS import etas_e_step
+
+
+def test_windowed_e_step_matches_all_parents(make_sequence):
+    sequences = [make_sequence(80, seed=0), make_sequence(30, seed=1)]
+    batch = BatchIS.from_list(sequences)
+    model = eq.models.ETAS_IS().double()
+    with torch.no_grad():
+        features = model.get_event_features(batch)
+        params = torch.stack(model.get_params())
+        c_grid = (model.c * torch.exp(torch.linspace(-1.0, 1.0, 5))).tolist()
+        exact = etas_e_step(params, features, c_grid=c_grid)
+        # A tiny memory budget also splits the targets into several row blocks.
+        windowed = etas_e_step(params, features, 1e-3, c_grid=c_grid, max_parents=8)
+
+    for name in ['prob_background', 'prob_aftershock', 'prob_injection', 'prob_trailing', 'offspring']:
+        assert torch.allclose(windowed[name], exact[name], rtol=1e-4, atol=1e-10), name
+    assert torch.allclose(windowed.log_delta_sums, exact.log_delta_sums, rtol=1e-3)
+    assert torch.allclose(
+        windowed.prob_background + windowed.prob_aftershock + windowed.prob_injection + windowed.prob_trailing,
+        features.intensity_mask.double(),
+    )
+
+
+def test_fit_em_without_iterations(make_sequence):
+    batch = BatchIS.from_list([make_sequence(40, seed=2)])
+    model = eq.models.ETAS_IS().double()
+    result = model.fit(batch, method='em', max_iter=0)
+    assert result['num_iter'] == 0
+    assert not result['converged']
+
+
+def test_branching_is_exact_by_default(make_sequence):
+    batch = BatchIS.from_list([make_sequence(300, seed=3)])
+    model = eq.models.ETAS_IS().double()
+    branching = model.get_branching(batch)
+    with torch.no_grad():
+        exact = etas_e_step(torch.stack(model.get_params()), model.get_event_features(batch))
+    for name in ['prob_background', 'prob_aftershock', 'prob_injection', 'prob_trailing', 'offspring']:
+        assert torch.equal(branching[name], exact[name]), name
@@ -0,0 +1,12 @@
+import pytest
+
+import eq
+from eq.data import BatchIS
+
+
+@pytest.mark.parametrize("max_iter", [3, 25])
+def test_lbfgs_respects_max_iter(make_sequence, max_iter):
+    batch = BatchIS.from_list([make_sequence(60, seed=0)])
+    model = eq.models.ETAS_IS().double()
+    result = model.fit(batch, method='lbfgs', max_iter=max_iter, tol=0.0)
+    assert result['num_iter'] <= max_iter
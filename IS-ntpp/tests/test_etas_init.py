@@ -0,0 +1,29 @@
+import numpy as np
+import torch
+
+import eq
+from eq.models.etasIS import nearest_neighbour_lags
+
+
+def test_nearest_neighbour_lags_prefer_large_parents():
+    t = np.array([0.0, 1.0, 2.0, 3.0])
+    mag_rel = np.array([3.0, 0.0, 0.0, 0.0])
+    # The first event is 1000 times larger, so it is the parent of all the others.
+    assert np.allclose(nearest_neighbour_lags(t, mag_rel, b=1.0), [1.0, 2.0, 3.0])
+
+
+def test_init_reports_speedup_and_keeps_init(make_sequence):
+    sequence = make_sequence(80, seed=0)
+    model = eq.models.ETAS_IS().double()
+    report = model.init_from_sequence(sequence)
+
+    params = {name: getattr(model, name).item() for name in model.param_names}
+    assert params == report['params']
+    assert report['loss_fit'] <= report['loss_init'] + 1e-6
+    assert report['expected_epochs_saved'] == report['epochs_default'] - report['epochs_init']
+
+
+def test_init_without_speedup(make_sequence):
+    report = eq.models.ETAS_IS().double().init_from_sequence(make_sequence(40, seed=1), estimate_speedup=False)
+    assert 'expected_epochs_saved' not in report
+    assert np.isfinite(report['loss_init'])
@@ -0,0 +1,35 @@
+import torch
+
+import eq
+from eq.data import BatchIS
+
+
+def test_loss_params_matches_loss(make_sequence):
+    sequences = [make_sequence(40, seed=0), make_sequence(12, seed=1)]
+    sequences[1].t_nll_start = 1500.0
+    batch = BatchIS.from_list(sequences)
+    model = eq.models.ETAS_IS(pairwise_memory_mb=1e-3).double()
+
+    base = torch.stack(model.get_params()).detach()
+    scales = torch.tensor([0.5, 1.0, 2.0], dtype=torch.float64)
+    params = base * torch.ones(3, 1, dtype=torch.float64)
+    params[:, 0] *= scales  # mu
+    params[:, 3] *= scales.flip(0)  # k
+    params[:, 5] += torch.tensor([-1.0, 0.0, 0.5], dtype=torch.float64)  # SI
+    params.requires_grad_()
+    nll = model.loss_params(batch, params)
+    assert nll.shape == (3, 2)
+
+    nll.sum().backward()
+    for i in range(3):
+        single = eq.models.ETAS_IS().double()
+        single.set_params(params[i].detach())
+        loss = single.loss(batch)
+        assert torch.allclose(nll[i], loss, rtol=1e-10)
+
+        # The raw parameters are the logs of the natural ones, except for SI.
+        loss.sum().backward()
+        raw_grads = torch.stack([param.grad for param in single.parameters()])
+        chain = params[i].detach().clone()
+        chain[5] = 1.0
+        assert torch.allclose(params.grad[i] * chain, raw_grads, rtol=1e-8, atol=1e-12)
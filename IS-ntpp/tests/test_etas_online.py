@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+
+import eq
+from eq.models.etasIS import ETASOnlineFitter
+
+
+def test_update_keeps_dtype_and_counts_evals(make_sequence):
+    sequence = make_sequence(60, seed=0, dtype=torch.float32)
+    t_split = float(sequence.arrival_times[39] + sequence.arrival_times[40]) / 2
+    first = sequence.get_subsequence(sequence.t_start, t_split)
+    second = sequence.get_subsequence(t_split, sequence.t_end)
+
+    fitter = ETASOnlineFitter(eq.models.ETAS_IS(), first, refit=False, max_iter=5)
+    result = fitter.update(second)
+    assert result['num_evals'] > result['num_iter']
+
+    merged = fitter.sequence
+    assert merged.inter_times.dtype == torch.float32
+    assert torch.allclose(merged.arrival_times, sequence.arrival_times)
+    assert merged.t_end == sequence.t_end
+
+
+def test_large_move_refits_on_full_catalog(make_sequence):
+    # The rate of events jumps tenfold after t = 2500, which moves the estimate far away.
+    rng = np.random.default_rng(0)
+    times = np.sort(np.concatenate([rng.uniform(1.0, 2500.0, 30), rng.uniform(2500.0, 4999.0, 300)]))
+    sequence = make_sequence(len(times), seed=1, arrival_times=times)
+    first = sequence.get_subsequence(sequence.t_start, 2500.0)
+    second = sequence.get_subsequence(2500.0, sequence.t_end)
+
+    online = eq.models.ETAS_IS().double()
+    fitter = ETASOnlineFitter(online, first)
+    result = fitter.update(second)
+    assert result['refreshed']
+
+    full = eq.models.ETAS_IS().double()
+    full_result = full.fit(eq.data.BatchIS.from_list([sequence]))
+    loss_online = online.loss(eq.data.BatchIS.from_list([sequence])).item()
+    assert abs(loss_online - full_result['loss']) < 1e-3 * abs(full_result['loss'])
+    assert abs(result['loss'] - loss_online) < 1e-6 * abs(loss_online)
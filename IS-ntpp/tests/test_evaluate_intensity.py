@@ -0,0 +1,32 @@
+import torch
+
+import eq
+
+
+def test_grid_ends_exactly_at_event_times(make_sequence):
+    sequence = make_sequence(50, seed=0, dtype=torch.float32)
+    grid = eq.models.ETAS_IS.get_grid(sequence, num_grid_points=10).reshape(-1, 10)
+    assert torch.equal(grid[:-1, -1], sequence.arrival_times.double())
+    assert grid[-1, -1] == sequence.t_end
+
+
+def test_grid_intensity_excludes_event_at_query_time(make_sequence):
+    sequence = make_sequence(50, seed=1, dtype=torch.float32)
+    model = eq.models.ETAS_IS()
+    grid = model.get_grid(sequence, num_grid_points=10).reshape(-1, 10)
+    omori = model.get_intensity_index(sequence).omori_state(grid[:-1, -1]).sum(-1)
+
+    with torch.no_grad():
+        t = sequence.arrival_times.double()
+        productivity = model.k * 10 ** (model.alpha * (sequence.mag - sequence.mag_completeness)).double()
+        lag = t.unsqueeze(-1) - t
+        exact = ((lag.clamp_min(0.0) + model.c).pow(-model.p) * productivity * (lag > 0)).sum(-1)
+    assert torch.allclose(omori, exact, rtol=1e-4)
+
+
+def test_default_evaluates_at_event_times(make_sequence):
+    sequence = make_sequence(30, seed=2)
+    model = eq.models.ETAS_IS()
+    times, intensity = model.evaluate_intensity(sequence)
+    assert len(times) == len(sequence.arrival_times)
+    assert torch.allclose(intensity, model.evaluate_intensity(sequence, num_grid_points=0)[1])
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+import eq
+
+
+def test_explosive_process_raises():
+    model = eq.models.ETAS_IS(productivity_k_init=1.0, omori_p_init=1.2).double()
+    with pytest.raises(ValueError, match="explosive"):
+        model.forecast_expected(1000.0)
+
+
+def test_subcritical_counts_are_finite():
+    model = eq.models.ETAS_IS(productivity_alpha_init=0.5).double()
+    forecast = model.forecast_expected(1000.0, num_bins=100)
+    assert torch.isfinite(forecast.cumulative).all()
+    assert torch.allclose(forecast.cumulative[-1], forecast.counts.sum())
+
+
+def test_conditional_forecast_matches_sample_mean(make_sequence):
+    model = eq.models.ETAS_IS(
+        base_rate_init=1e-3, productivity_k_init=0.05, productivity_alpha_init=0.5
+    ).double()
+    past_seq = make_sequence(30, seed=0)
+    forecast = model.forecast_expected(1000.0, past_seq=past_seq)
+    # The forecast includes the aftershocks of the past events and the held injection schedule.
+    sequences = model.sample_injection(
+        past_seq, 2000, past_seq=past_seq, t_end=past_seq.t_end + 1000.0, return_sequences=True
+    )
+    counts = torch.tensor([float(len(seq.arrival_times)) for seq in sequences])
+    std_error = (counts.var() / len(counts)).sqrt()
+    assert abs(counts.mean() - forecast.cumulative[-1]) < 4 * std_error
@@ -0,0 +1,24 @@
+import numpy as np
+
+import eq
+
+
+def test_rolling_forecast_matches_expected_counts(make_sequence):
+    model = eq.models.ETAS_IS(
+        base_rate_init=1e-3, productivity_k_init=0.05, productivity_alpha_init=0.5
+    ).double()
+    sequence = make_sequence(40, seed=0)
+    origins, horizon = [1000.0, 2500.0, 4000.0], 500.0
+    forecast = model.forecast_rolling(sequence, origins, horizon, num_samples=2000)
+    assert (forecast.counts >= 0).all()
+
+    arrival_times = sequence.arrival_times.numpy()
+    for i, origin in enumerate(origins):
+        # Each window is conditioned on the events before its origin and uses the actual schedule.
+        past_seq = sequence.get_subsequence(sequence.t_start, origin)
+        expected = model.forecast_expected(horizon, past_seq=past_seq, injection=sequence)
+        counts = forecast.counts[i]
+        std_error = counts.std() / np.sqrt(len(counts))
+        assert abs(counts.mean() - expected.cumulative[-1].item()) < 4 * std_error
+        in_window = (arrival_times > origin) & (arrival_times <= origin + horizon)
+        assert forecast.observed[i] == in_window.sum()
@@ -0,0 +1,20 @@
+import torch
+
+import eq
+
+
+def test_omori_state_matches_exact_rate(make_sequence):
+    sequence = make_sequence(50, seed=0)
+    model = eq.models.ETAS_IS().double()
+    index = model.get_intensity_index(sequence)
+    times = torch.tensor([100.0, 2500.0, sequence.t_end])
+
+    amplitudes = index.omori_state(times)
+    assert amplitudes.shape == (len(times), len(index.rates))
+
+    with torch.no_grad():
+        t = sequence.arrival_times
+        productivity = model.k * 10 ** (model.alpha * (sequence.mag - sequence.mag_completeness))
+        lag = times.unsqueeze(-1) - t
+        exact = ((lag.clamp_min(0.0) + model.c).pow(-model.p) * productivity * (lag > 0)).sum(-1)
+    assert torch.allclose(amplitudes.sum(-1), exact, rtol=1e-4)
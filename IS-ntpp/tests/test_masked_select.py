@@ -0,0 +1,46 @@
+import torch
+
+from eq.models.etasIS import masked_select_fields, masked_select_per_row
+
+
+def reference_select(matrix, mask):
+    # Row-by-row masked select, padded with zeros.
+    rows = [row[row_mask.bool()] for row, row_mask in zip(matrix, mask)]
+    width = max(len(row) for row in rows)
+    selected = torch.zeros(matrix.shape[0], width, dtype=matrix.dtype)
+    new_mask = torch.zeros(matrix.shape[0], width)
+    for i, row in enumerate(rows):
+        selected[i, :len(row)] = row
+        new_mask[i, :len(row)] = 1.0
+    return selected, new_mask
+
+
+def test_docstring_example():
+    matrix = torch.tensor([[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]])
+    mask = torch.tensor([[0, 1, 1, 1, 0], [0, 0, 0, 1, 1]])
+    selected, new_mask = masked_select_per_row(matrix, mask)
+    assert torch.equal(selected, torch.tensor([[1, 2, 3], [8, 9, 0]]))
+    assert torch.equal(new_mask, torch.tensor([[1.0, 1.0, 1.0], [1.0, 1.0, 0.0]]))
+
+
+def test_matches_row_by_row_select():
+    generator = torch.Generator().manual_seed(0)
+    matrix = torch.randn(7, 50, generator=generator, dtype=torch.float64)
+    mask = torch.rand(7, 50, generator=generator) < 0.3
+    mask[3] = False  # A row without selected entries is all padding.
+    selected, new_mask = masked_select_per_row(matrix, mask)
+    expected, expected_mask = reference_select(matrix, mask)
+    assert torch.equal(selected, expected)
+    assert torch.equal(new_mask, expected_mask)
+
+
+def test_fields_share_the_selection():
+    generator = torch.Generator().manual_seed(1)
+    mask = torch.rand(4, 30, generator=generator) < 0.5
+    matrices = [torch.randn(4, 30, generator=generator) for _ in range(3)]
+    selected, new_mask = masked_select_fields(mask, *matrices)
+    assert len(selected) == len(matrices)
+    for matrix, field in zip(matrices, selected):
+        expected, expected_mask = masked_select_per_row(matrix, mask)
+        assert torch.equal(field, expected)
+        assert torch.equal(new_mask, expected_mask)
@@ -0,0 +1,32 @@
+import torch
+
+import eq
+from eq.data import BatchIS
+
+
+def test_soe_loss_matches_exact_for_padded_batch(make_sequence):
+    sequences = [make_sequence(60, seed=0), make_sequence(25, seed=1), make_sequence(40, seed=2)]
+    sequences[2].t_nll_start = 1500.0
+    batch = BatchIS.from_list(sequences)
+
+    exact = eq.models.ETAS_IS(omori_kernel='exact').double()
+    soe = eq.models.ETAS_IS(omori_kernel='soe').double()
+    soe.load_state_dict(exact.state_dict())
+
+    loss_exact = exact.loss(batch)
+    loss_soe = soe.loss(batch)
+    assert torch.isfinite(loss_soe).all()
+    assert torch.allclose(loss_soe, loss_exact, rtol=1e-4)
+
+    loss_soe.sum().backward()
+    assert all(torch.isfinite(param.grad).all() for param in soe.parameters())
+
+
+def test_soe_rate_is_zero_at_padded_targets(make_sequence):
+    batch = BatchIS.from_list([make_sequence(50, seed=3), make_sequence(10, seed=4)])
+    model = eq.models.ETAS_IS(omori_kernel='soe').double()
+    features = model.get_event_features(batch)
+    productivity = model.k * 10 ** (model.alpha * features.mag_rel)
+    rate = model.get_omori_rate(features.t_select, features.t, productivity, features.intensity_mask)
+    assert torch.isfinite(rate).all()
+    assert (rate[features.intensity_mask == 0] == 0).all()
@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+from eq.data import BatchIS, PackedBatchIS
+
+
+@pytest.fixture
+def sequences(make_sequence):
+    sequences = [make_sequence(14, seed=0), make_sequence(6, seed=1), make_sequence(10, seed=2)]
+    sequences[2].t_nll_start = 1500.0
+    return sequences
+
+
+def assert_same_fields(actual, expected):
+    assert set(actual.keys()) == set(expected.keys())
+    for key, value in expected.items():
+        assert actual[key].shape == value.shape, key
+        assert torch.allclose(actual[key].to(value.dtype), value, rtol=1e-12), key
+
+
+def test_to_padded_matches_batch(sequences):
+    packed = PackedBatchIS.from_list(sequences)
+    assert_same_fields(packed.to_padded(), BatchIS.from_list(sequences))
+
+
+def test_from_padded_matches_from_list(sequences):
+    packed = PackedBatchIS.from_list(sequences)
+    assert_same_fields(PackedBatchIS.from_padded(BatchIS.from_list(sequences)), packed)
+
+
+def test_to_list_round_trip(sequences):
+    for sequence, unpacked in zip(sequences, PackedBatchIS.from_list(sequences).to_list()):
+        assert set(unpacked.keys()) == set(sequence.keys())
+        for key, value in sequence.items():
+            if isinstance(value, torch.Tensor):
+                assert torch.allclose(unpacked[key].to(value.dtype), value, rtol=1e-12), key
+            else:
+                assert unpacked[key] == pytest.approx(value), key
+
+
+def test_pack_sequence_round_trip(sequences):
+    packed = PackedBatchIS.from_list(sequences)
+    assert torch.equal(packed.unpack_sequence(packed.pack_sequence(packed.mag)), packed.mag)
@@ -0,0 +1,17 @@
+import torch
+
+import eq
+from eq.data import InMemoryDataset
+
+
+def test_projected_static_loader_gives_same_loss(make_sequence):
+    sequences = [make_sequence(40, seed=0), make_sequence(25, seed=1)]
+    for seq in sequences:
+        seq.Mo = torch.randn(len(seq), dtype=seq.mag.dtype)
+    dataset = InMemoryDataset(sequences)
+    model = eq.models.ETAS_IS().double()
+
+    batch = next(iter(dataset.get_static_loaderIS(batch_size=2, fields=model.required_marks)))
+    full_batch = next(iter(dataset.get_static_loaderIS(batch_size=2)))
+    assert 'Mo' not in batch and 'Mo' in full_batch
+    assert torch.allclose(model.loss(batch), model.loss(full_batch))
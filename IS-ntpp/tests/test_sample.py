@@ -0,0 +1,68 @@
+import pytest
+import torch
+
+import eq
+from eq.data import BatchIS
+
+
+@pytest.fixture
+def model():
+    return eq.models.ETAS_IS(productivity_alpha_init=0.5)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_sample_returns_batch(model, vectorized):
+    batch = model.sample(3, 500.0, mag_completeness=1.0, n_jobs=1, vectorized=vectorized)
+    assert isinstance(batch, BatchIS)
+    assert batch.inj_time.shape == (3, 0)
+    assert (batch.mag_completeness == 1.0).all()
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_conditional_sample_holds_past_schedule(model, make_sequence, vectorized):
+    past_seq = make_sequence(30, seed=0)
+    batch = model.sample(2, 500.0, past_seq=past_seq, n_jobs=1, vectorized=vectorized)
+    t_start, t_end = past_seq.t_end, past_seq.t_end + 500.0
+    assert torch.allclose(batch.inj_time[:, 0], torch.tensor(t_start, dtype=batch.inj_time.dtype))
+    assert torch.allclose(batch.inj_time[:, -1], torch.tensor(t_end, dtype=batch.inj_time.dtype))
+    assert (batch.mag_completeness == float(past_seq.mag_completeness)).all()
+
+
+@pytest.fixture
+def triggering_model():
+    # Subcritical, with about a third of the events triggered.
+    return eq.models.ETAS_IS(
+        base_rate_init=1e-3, productivity_k_init=0.05, productivity_alpha_init=0.5
+    ).double()
+
+
+def assert_mean_count(sequences, expected):
+    counts = torch.tensor([float(len(seq.arrival_times)) for seq in sequences])
+    std_error = (counts.var() / len(counts)).sqrt()
+    assert abs(counts.mean() - float(expected)) < 4 * std_error
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_sample_mean_matches_forecast(triggering_model, vectorized):
+    forecast = triggering_model.forecast_expected(5000.0)
+    sequences = triggering_model.sample(
+        1000, 5000.0, n_jobs=1, vectorized=vectorized, return_sequences=True
+    )
+    assert_mean_count(sequences, forecast.cumulative[-1])
+
+
+def test_thinning_mean_matches_forecast(triggering_model):
+    forecast = triggering_model.forecast_expected(5000.0)
+    sequences = triggering_model.sample_thinning(1000, 5000.0, n_jobs=1, return_sequences=True)
+    assert_mean_count(sequences, forecast.cumulative[-1])
+
+
+def test_injection_mean_matches_forecast(triggering_model, make_sequence):
+    schedule = make_sequence(30, seed=0)
+    forecast = triggering_model.forecast_expected(
+        5000.0, t_start=0.0, injection=schedule, mag_completeness=0.5
+    )
+    sequences = triggering_model.sample_injection(
+        schedule, 1000, t_start=0.0, t_end=5000.0, mag_completeness=0.5, return_sequences=True
+    )
+    assert_mean_count(sequences, forecast.cumulative[-1])
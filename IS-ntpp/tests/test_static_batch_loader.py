@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from eq.data import BatchIS, InMemoryDataset, StaticBatchLoader
+
+
+@pytest.fixture
+def dataset(make_sequence):
+    return InMemoryDataset([make_sequence(10 + 5 * i, seed=i) for i in range(5)])
+
+
+def test_batches_are_collated_once(dataset):
+    loader = StaticBatchLoader(dataset, batch_size=2)
+    first_epoch = list(loader)
+    assert len(loader) == 3
+    assert all(a is b for a, b in zip(first_epoch, loader))
+
+    expected = BatchIS.from_list([dataset[2], dataset[3]])
+    for key, value in expected.items():
+        assert torch.equal(first_epoch[1][key], value), key
+
+
+def test_shuffle_reorders_the_same_batches(dataset):
+    loader = StaticBatchLoader(dataset, batch_size=1, shuffle=True, seed=0)
+    epochs = [[id(batch) for batch in loader] for _ in range(4)]
+    assert all(sorted(epoch) == sorted(epochs[0]) for epoch in epochs)
+    assert any(epoch != epochs[0] for epoch in epochs)
+
+
+def test_in_place_modification_raises(dataset):
+    loader = StaticBatchLoader(dataset, batch_size=2, assert_immutable=True)
+    batch = next(iter(loader))
+    batch.mag.mul_(2.0)
+    with pytest.raises(RuntimeError, match="modified in place"):
+        next(iter(loader))
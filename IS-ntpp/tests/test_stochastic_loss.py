@@ -0,0 +1,31 @@
+import pytest
+import torch
+
+import eq
+from eq.data import BatchIS
+from eq.models.etasIS import omori_rate, omori_rate_sampled
+
+
+def test_sampled_omori_rate_matches_exact(make_sequence):
+    batch = BatchIS.from_list([make_sequence(300, seed=5)])
+    model = eq.models.ETAS_IS().double()
+    f = model.get_event_features(batch)
+    productivity = model.k * 10 ** (model.alpha * f.mag_rel)
+    rates = model.get_soe_rates(f.t.max() - f.t.min())
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        exact = omori_rate(f.t_select, f.t, productivity, model.c, model.p)
+        sampled = torch.stack([
+            omori_rate_sampled(f.t_select, f.t, productivity, model.c, model.p, 5, rates, 4, generator)[0]
+            for _ in range(20)
+        ]).mean(0)
+    assert torch.allclose(sampled, exact, rtol=1e-3, atol=1e-12)
+
+
+def test_stochastic_loss_rejects_zero_samples(make_sequence):
+    batch = BatchIS.from_list([make_sequence(50, seed=6)])
+    model = eq.models.ETAS_IS(stochastic_targets=10, stochastic_parents=5)
+    with pytest.raises(ValueError):
+        model.stochastic_loss(batch, num_targets=0)
+    with pytest.raises(ValueError):
+        model.stochastic_loss(batch, num_tail_samples=0)
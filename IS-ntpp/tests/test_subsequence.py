@@ -0,0 +1,64 @@
+import pytest
+import torch
+
+from eq.data import SequenceIS
+
+
+def constructed_subsequence(sequence, start, end):
+    # Select the events with masks and build the subsequence with the SequenceIS constructor.
+    mask = (sequence.arrival_times >= start) & (sequence.arrival_times <= end)
+    inj_mask = (sequence.inj_time >= start) & (sequence.inj_time <= end)
+    arrival_times = sequence.arrival_times[mask]
+    inter_times = torch.diff(
+        arrival_times, prepend=torch.tensor([start], dtype=arrival_times.dtype),
+        append=torch.tensor([end], dtype=arrival_times.dtype),
+    )
+    marks = {}
+    for key, value in sequence.items():
+        if key in SequenceIS.inj_attrs:
+            marks[key] = value[inj_mask]
+        elif key not in SequenceIS.default_sequence_attrs:
+            marks[key] = value[mask]
+    return SequenceIS(
+        inter_times,
+        t_start=start,
+        t_nll_start=max(sequence.t_nll_start, start),
+        mag_completeness=sequence.mag_completeness,
+        **marks,
+    )
+
+
+@pytest.fixture
+def sequence(make_sequence):
+    sequence = make_sequence(100, seed=0)
+    sequence.t_nll_start = 200.0
+    return sequence
+
+
+@pytest.mark.filterwarnings("ignore:Found 1 zero inter-event times")
+def test_matches_constructor(sequence):
+    t = sequence.arrival_times
+    intervals = [
+        (0.0, sequence.t_end),
+        (100.0, 2500.0),
+        (float(t[30]), float(t[40])),  # Events on both bounds are included.
+        (float(t[30]) + 1e-6, float(t[31]) - 1e-6),  # No events.
+    ]
+    for start, end in intervals:
+        subsequence = sequence.get_subsequence(start, end)
+        expected = constructed_subsequence(sequence, start, end)
+        assert set(subsequence.keys()) == set(expected.keys())
+        for key, value in expected.items():
+            if key in ['inter_times', 'arrival_times', 't_end']:
+                assert torch.allclose(
+                    torch.as_tensor(subsequence[key]), torch.as_tensor(value), rtol=1e-12
+                ), key
+            elif isinstance(value, torch.Tensor):
+                assert torch.equal(subsequence[key], value), key
+            else:
+                assert subsequence[key] == value, key
+
+
+def test_out_of_range_interval_raises(sequence):
+    with pytest.raises(ValueError):
+        sequence.get_subsequence(-1.0, 100.0)
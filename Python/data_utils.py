@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
 import torch
 from eq.catalogs import IScases
-from eq.data.batch import BatchIS
+from eq.data import StaticBatchLoader
 
-def get_Datasets(case_list: List[str]):
-    """ Simple function that will return Pytorch dataloaders from the list of IS sequences."""
+def get_Datasets(case_list: List[str], fields: Optional[List[str]] = None):
+    """ Simple function that will return Pytorch dataloaders from the list of IS sequences.
+    The catalogs are collated once, and the same batches are reused on every epoch.
+    Only the supplementary marks in fields (e.g., model.required_marks) are put in the batches."""
     
     # Loop over all of the cases.
     Ne = 0
@@ -16,10 +18,10 @@ def get_Datasets(case_list: List[str]):
 
     # Return the dataloader and number of event samples.
     train_datasets = torch.utils.data.ConcatDataset(dataset_list)
-    dataloader = torch.utils.data.DataLoader(train_datasets,batch_size=1,shuffle=False,collate_fn=BatchIS.from_list)
+    dataloader = StaticBatchLoader(train_datasets,batch_size=1,shuffle=False,fields=fields)
     return (dataloader,Ne)
 
-def get_kFold_datasets_test(case_test: str, case_val: str):
+def get_kFold_datasets_test(case_test: str, case_val: str, fields: Optional[List[str]] = None):
     """ Simple function that makes training/validation/test k-folds of the datasets."""
 
     # Organize/list all of the sequences into their named partitions.
@@ -72,14 +74,14 @@ def get_kFold_datasets_test(case_test: str, case_val: str):
         train_list.remove(case_name)
 
     # Get the dataloaders.
-    train_dataloader, Ntrain = get_Datasets(train_list)
-    val_dataloader,   Nval =   get_Datasets(val_list)
-    test_dataloader,  Ntest =  get_Datasets(test_list)
+    train_dataloader, Ntrain = get_Datasets(train_list, fields)
+    val_dataloader,   Nval =   get_Datasets(val_list, fields)
+    test_dataloader,  Ntest =  get_Datasets(test_list, fields)
 
     # Return everything.
     return (train_dataloader,val_dataloader,test_dataloader, Ntrain,Nval,Ntest)
 
-def get_kFold_datasets_val(case: str):
+def get_kFold_datasets_val(case: str, fields: Optional[List[str]] = None):
     """ Simple function that makes training/validation k-folds of the datasets."""
 
     # Organize/list all of the sequences into their named partitions.
@@ -116,8 +118,8 @@ def get_kFold_datasets_val(case: str):
         test_list = PNR2_list
 
     # Get the dataloaders.
-    train_dataloader, Ntrain = get_Datasets(train_list)
-    test_dataloader,  Ntest =  get_Datasets(test_list)
+    train_dataloader, Ntrain = get_Datasets(train_list, fields)
+    test_dataloader,  Ntest =  get_Datasets(test_list, fields)
 
     # Return everything.
     return (train_dataloader,test_dataloader, Ntrain,Ntest)
\ No newline at end of file
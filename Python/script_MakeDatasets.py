@@ -11,31 +11,19 @@ from eq.catalogs import IScases
 # Load in a different catalog.
 #catalog = eq.catalogs.White()
 
-# Generate the catalogues.
-IScases.generate_catalog('Basel')
-IScases.generate_catalog('SSFS93')
-IScases.generate_catalog('SSFS00')
-IScases.generate_catalog('SSFS03')
-IScases.generate_catalog('SSFS04')
-IScases.generate_catalog('SSFS05')
-IScases.generate_catalog('CB1a')
-IScases.generate_catalog('CB1b')
-IScases.generate_catalog('CB4')
-IScases.generate_catalog('Paralana')
-IScases.generate_catalog('St1-2018')
-IScases.generate_catalog('St1-2020')
-IScases.generate_catalog('FORGE-S1')
-IScases.generate_catalog('FORGE-S2')
-IScases.generate_catalog('FORGE-S3')
-IScases.generate_catalog('PNR1z-a')
-IScases.generate_catalog('PNR1z-b')
-IScases.generate_catalog('PNR1z-c')
-IScases.generate_catalog('PNR2-cWa')
-IScases.generate_catalog('PNR2-cWb')
-IScases.generate_catalog('PNR2-cE')
-IScases.generate_catalog('GTS-HS4')
-IScases.generate_catalog('GTS-HS5')
-IScases.generate_catalog('GTS-HF2')
+# Generate the catalogues (in parallel, skipping the ones whose csv files are unchanged).
+case_list = [
+    'Basel', 'SSFS93', 'SSFS00', 'SSFS03', 'SSFS04', 'SSFS05',
+    'CB1a', 'CB1b', 'CB4', 'Paralana', 'St1-2018', 'St1-2020',
+    'FORGE-S1', 'FORGE-S2', 'FORGE-S3', 'PNR1z-a', 'PNR1z-b', 'PNR1z-c',
+    'PNR2-cWa', 'PNR2-cWb', 'PNR2-cE', 'GTS-HS4', 'GTS-HS5', 'GTS-HF2',
+]
+status = IScases.build_catalogs(case_list)
+for case, case_status in status.items():
+    print(case, case_status)
+
+# Convert the catalogues to the columnar (memory-mapped) store.
+IScases.convert_catalogs()
 
 # Load in the catalogues.
 #d=IScases('SSFS93')
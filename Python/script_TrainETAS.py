@@ -25,6 +25,10 @@ case_list = ['Basel',
               ]
 case_list = ['SSFS05']
 
+# Optimizer for the fit: None trains with the Lightning Trainer (Adam), while 'lbfgs' or 'newton'
+# use the deterministic full-batch fitter ETAS_IS.fit, which finishes in seconds.
+fit_method = None
+
 # Loop over all of the test cases.
 for case_test in case_list:
 
@@ -37,12 +41,20 @@ for case_test in case_list:
     catalog = IScases(case_test)
 
     #'''
-    ## Define the validation and test datasets.
-    dl_train = catalog.dataset.get_dataloaderIS()
-
     # Define the model.
     model = eq.models.ETAS_IS()
 
+    ## Define the validation and test datasets (with only the marks used by the model).
+    dl_train = catalog.dataset.get_static_loaderIS(fields=model.required_marks)
+
+    # Deterministic full-batch fit.
+    if fit_method is not None:
+        diagnostics = model.fit(next(iter(dl_train)), method=fit_method, verbose=True)
+        torch.save(model.state_dict(), model_savepath)
+        print('\n')
+        model.print_params()
+        continue
+
     # Training setup.
     early_stopping = pl_callbacks.EarlyStopping(monitor='val_fit_loss', patience=100, min_delta=1e-4)
     checkpoint = pl_callbacks.ModelCheckpoint(dirpath=chkpt_dir, monitor='val_fit_loss')
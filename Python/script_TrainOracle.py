@@ -37,13 +37,6 @@ for case_test in test_list:
     #val_list = ['CB']
     for case_val in val_list:
 
-        # Get the dataloaders for the training/validation/test datasets.
-        (dl_train,dl_val,dl_test, Nt,Nv,Ne) = get_kFold_datasets_test(case_test,case_val)
-        print('Number of events for training', Nt)
-        print('Test: ', case_test)
-        print('Val:  ', case_val)
-        #dl_train.num_workers=2
-
         # Flag the types of supplementary marks considered.
         M_marks = ['Mo', 'Vc']
         P_marks = ['Pm','pm','dP','sp']
@@ -65,6 +58,13 @@ for case_test in test_list:
         #'''
         # Define the model.
         model = eq.models.Oracle(supplementary_mark_list=supp_mark_list)
+
+        # Get the dataloaders for the training/validation/test datasets (with only the marks used by the model).
+        (dl_train,dl_val,dl_test, Nt,Nv,Ne) = get_kFold_datasets_test(case_test,case_val,fields=model.required_marks)
+        print('Number of events for training', Nt)
+        print('Test: ', case_test)
+        print('Val:  ', case_val)
+        #dl_train.num_workers=2
         
         # Change early stopping loss metric, depending on forecasting type.
         if model.train_to_forecast:
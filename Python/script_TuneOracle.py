@@ -24,12 +24,6 @@ train_list = ['SSFS93','SSFS00','SSFS04','CB1a','CB1b','Basel']
 val_list = ['SSFS05']
 test_list = ['Basel']
 
-# Get the dataloaders for the training/validation/test datasets.
-(dl_train, Ne) = get_Datasets(train_list)
-dl_val = get_Datasets(val_list)[0]
-dl_test = get_Datasets(test_list)[0]
-print('Number of events for training',Ne)
-
 # Flag the types of supplementary marks considered.
 M_marks = ['Mo','Vc']
 P_marks = ['Pm','pm','dP','sp']
@@ -46,6 +40,12 @@ chkpt_dir = 'checkpointsExp/'
 # Define the model.
 model = eq.models.Oracle(supplementary_mark_list=supp_mark_list)
 
+# Get the dataloaders for the training/validation/test datasets (with only the marks used by the model).
+(dl_train, Ne) = get_Datasets(train_list, model.required_marks)
+dl_val = get_Datasets(val_list, model.required_marks)[0]
+dl_test = get_Datasets(test_list, model.required_marks)[0]
+print('Number of events for training',Ne)
+
 # Change early stopping loss metric, depending on forecasting type.
 if model.train_to_forecast:
     loss_stop_type = 'val_forecast_loss'